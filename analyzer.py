@@ -0,0 +1,212 @@
+#!/usr/local/bin/python3
+
+"""
+Checks that puzzles have a unique solution and measures how much search effort
+it takes to prove it, as an objective difficulty score to compare against the
+Guardian's EASY/MEDIUM/HARD labels.
+
+The search is the solver's, but keeps going after the first solution and stops
+as soon as a second one is found. Propagation rounds, branch nodes and the
+maximum search depth are counted along the way. Analyses are memoized by the
+encoded grid, so identical grids in a batch are only searched once, and puzzles
+already analyzed with the current version are skipped on later runs.
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+import logger
+from bench_solver import percentile
+from datastore_client import DatastoreClient
+from kakurizer_types import Difficulty, PuzzleAnalysis, PuzzleGrid
+from solver import Solver, ALL_DIGITS
+
+ANALYSIS_VERSION = 1 # Increase when the search or score changes to re-analyze every puzzle
+SOLUTION_LIMIT = 2 # Enough to tell unique puzzles from ambiguous ones
+BRANCH_WEIGHT = 10 # Cost of a branch node, in propagation rounds, for the difficulty score
+CHUNK_SIZE = 16
+PUZZLE_TIMEOUT = 30.0
+
+
+class Analyzer(Solver):
+    """
+    Counts the solutions of a single puzzle, up to a limit, and records the search
+    effort needed to do so.
+    """
+
+    def __init__(self, grid, limit=SOLUTION_LIMIT):
+        """
+        :param grid: kakurizer_types.PuzzleGrid of the puzzle to analyze
+        :param limit: Number of solutions after which to stop searching
+        :raises ValueError: if the clues are invalid
+        """
+        super().__init__(grid)
+        self.limit = limit
+        self.solutions = 0
+        self.propagations = 0
+        self.branches = 0
+        self.max_depth = 0
+
+
+    def analyze(self, deadline=None):
+        """
+        :param deadline: If set, time.perf_counter() value after which to give up
+        :returns: kakurizer_types.PuzzleAnalysis of the puzzle
+        :raises TimeoutError: if the deadline passes before the search finishes
+        """
+        self.deadline = deadline
+        masks = [ALL_DIGITS] * len(self.positions)
+        options = list(self.run_combinations)
+        self.propagations += 1
+        if self.propagate(masks, options, list(range(len(self.run_cells)))):
+            self.count(masks, options, 0)
+        return PuzzleAnalysis(self.solutions, self.propagations, self.branches, self.max_depth,
+                              self.propagations + BRANCH_WEIGHT * self.branches)
+
+
+    def count(self, masks, options, depth):
+        """
+        Depth-first search over fully propagated states which adds each solution
+        found to the total, until the limit is reached.
+
+        :param masks: List of candidate bitmasks, one per cell
+        :param options: List of tuples of combination bitmasks still possible, one per run
+        :param depth: Number of branches taken to reach this state
+        :raises TimeoutError: if the deadline passes
+        """
+        self.check_deadline()
+        self.max_depth = max(self.max_depth, depth)
+        best_cell = self.choose_cell(masks)
+        if best_cell is None:
+            self.solutions += 1
+            return
+
+        remaining = masks[best_cell]
+        while remaining and self.solutions < self.limit:
+            digit = remaining & -remaining
+            remaining ^= digit
+            trial = masks[:]
+            trial[best_cell] = digit
+            trial_options = options[:]
+            self.branches += 1
+            self.propagations += 1
+            if self.propagate(trial, trial_options, list(self.cell_runs[best_cell])):
+                self.count(trial, trial_options, depth + 1)
+
+
+def analyze():
+    """
+    Analyzes every puzzle in the database with clues and logs how the measured
+    difficulty compares with each difficulty label.
+    """
+    logger.setup_logger()
+    datastore = DatastoreClient()
+    scores = {difficulty.name: [] for difficulty in Difficulty}
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        for page in datastore.get_pages_with_clues():
+            analyze_page(datastore, pool, page, scores)
+    logging.getLogger().info("Measured difficulty by label:\n%s", format_scores(scores))
+
+
+def analyze_page(datastore, pool, entities, scores, chunk_size=CHUNK_SIZE,
+                 timeout=PUZZLE_TIMEOUT):
+    """
+    Analyzes a page of puzzles in the pool and saves the results.
+
+    :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+    :param pool: multiprocessing.Pool of workers
+    :param entities: List of database entries with has_clues set
+    :param scores: Dict from difficulty name to list of kakurizer_types.PuzzleAnalysis,
+                   which is updated
+    :param chunk_size: Number of puzzles sent to a worker at a time
+    :param timeout: Seconds allowed for each puzzle
+    :returns: None
+    """
+    pending = {}
+    for entity in entities:
+        if entity.get('analysis_version') == ANALYSIS_VERSION:
+            scores.setdefault(entity['difficulty'], []).append(get_analysis(entity))
+        else:
+            pending.setdefault(entity['grid_data'], []).append(entity)
+
+    tasks = [(grid_data, timeout) for grid_data in pending]
+    updated = []
+    for grid_data, analysis in pool.imap_unordered(analyze_task, tasks, chunk_size):
+        for entity in pending[grid_data]:
+            if analysis is None:
+                logging.getLogger().warning("Unable to analyze puzzle %s", entity['id'])
+                continue
+            set_analysis(entity, analysis)
+            scores.setdefault(entity['difficulty'], []).append(analysis)
+            updated.append(entity)
+    if updated:
+        datastore.update_multi(updated)
+
+
+def analyze_task(task):
+    """
+    Analyzes one grid in a worker process.
+
+    :param task: Tuple of (encoded kakurizer_types.PuzzleGrid, timeout in seconds)
+    :returns: Tuple of (encoded grid, kakurizer_types.PuzzleAnalysis or None if it
+              timed out or the clues are invalid)
+    """
+    grid_data, timeout = task
+    try:
+        grid = PuzzleGrid.decode(grid_data)
+        return grid_data, Analyzer(grid).analyze(deadline=time.perf_counter() + timeout)
+    except (TimeoutError, ValueError):
+        return grid_data, None
+
+
+def set_analysis(entity, analysis):
+    """
+    Stores the results of an analysis on a puzzle entity.
+
+    :param entity: database entry representing a puzzle
+    :param analysis: kakurizer_types.PuzzleAnalysis of the puzzle
+    :returns: None
+    """
+    entity['solution_count'] = analysis.solutions
+    entity['is_unique'] = analysis.solutions == 1
+    entity['search_propagations'] = analysis.propagations
+    entity['search_branches'] = analysis.branches
+    entity['search_depth'] = analysis.max_depth
+    entity['difficulty_score'] = analysis.score
+    entity['analysis_version'] = ANALYSIS_VERSION
+    entity.exclude_from_indexes = set(entity.exclude_from_indexes) | {
+        'search_propagations', 'search_branches', 'search_depth'}
+
+
+def get_analysis(entity):
+    """
+    :param entity: database entry for a puzzle which has been analyzed
+    :returns: kakurizer_types.PuzzleAnalysis stored on the entity
+    """
+    return PuzzleAnalysis(entity['solution_count'], entity['search_propagations'],
+                          entity['search_branches'], entity['search_depth'],
+                          entity['difficulty_score'])
+
+
+def format_scores(scores):
+    """
+    :param scores: Dict from difficulty name to list of kakurizer_types.PuzzleAnalysis
+    :returns: Table comparing measured difficulty scores for each difficulty label
+    """
+    lines = ["%-8s %7s %7s %8s %8s %8s %9s" % ("", "puzzles", "unique", "min", "median",
+                                               "p90", "max")]
+    for difficulty, analyses in scores.items():
+        if not analyses:
+            lines.append("%-8s %7d" % (difficulty, 0))
+            continue
+        values = sorted(analysis.score for analysis in analyses)
+        unique = sum(1 for analysis in analyses if analysis.solutions == 1)
+        lines.append("%-8s %7d %7d %8d %8d %8d %9d" % (
+            difficulty, len(values), unique, values[0], percentile(values, 0.5),
+            percentile(values, 0.9), values[-1]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    analyze()
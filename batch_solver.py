@@ -0,0 +1,117 @@
+#!/usr/local/bin/python3
+
+"""
+Solves every unsolved puzzle in the database across a pool of worker processes
+and reports solve times for each difficulty level.
+
+Only the clue structure of each puzzle is sent to the workers, in chunks to
+keep inter-process overhead low, and solved puzzles are saved back in batches
+as results arrive.
+"""
+
+import collections
+import logging
+import multiprocessing
+import os
+import time
+import logger
+import clue_reader
+from bench_solver import format_report
+from datastore_client import DatastoreClient
+from kakurizer_types import Difficulty
+from solver import Solver, set_solution
+
+CHUNK_SIZE = 16 # Puzzles sent to a worker at a time
+PUZZLE_TIMEOUT = 5.0 # Seconds allowed for each puzzle before giving up on it
+
+SOLVED = "solved"
+NO_SOLUTION = "no_solution"
+TIMED_OUT = "timed_out"
+INVALID = "invalid"
+
+
+def run(processes=None, chunk_size=CHUNK_SIZE, timeout=PUZZLE_TIMEOUT):
+    """
+    Solves all puzzles which have clues but no solution, saves the solutions and
+    logs solve time statistics by difficulty.
+
+    :param processes: Number of worker processes, defaulting to one per CPU
+    :param chunk_size: Number of puzzles sent to a worker at a time
+    :param timeout: Seconds allowed for each puzzle
+    :returns: Dict from difficulty name to a list of (status, seconds) for each puzzle
+    """
+    logger.setup_logger()
+    datastore = DatastoreClient()
+    results = {difficulty.name: [] for difficulty in Difficulty}
+    with multiprocessing.Pool(processes or os.cpu_count()) as pool:
+        for page in datastore.get_pages_with_clues(unsolved_only=True):
+            solve_page(datastore, pool, page, chunk_size, timeout, results)
+    logging.getLogger().info("Solve times by difficulty:\n%s", format_results(results))
+    return results
+
+
+def solve_page(datastore, pool, entities, chunk_size, timeout, results):
+    """
+    Solves a page of puzzles in the pool and saves those which were solved.
+
+    :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+    :param pool: multiprocessing.Pool of workers
+    :param entities: List of database entries with has_clues set
+    :param chunk_size: Number of puzzles sent to a worker at a time
+    :param timeout: Seconds allowed for each puzzle
+    :param results: Dict from difficulty name to list of (status, seconds), which is updated
+    :returns: None
+    """
+    tasks = [(index, clue_reader.get_clue_grid(entity), timeout)
+             for index, entity in enumerate(entities)]
+    solved = []
+    for index, status, solution, seconds in pool.imap_unordered(solve_task, tasks, chunk_size):
+        entity = entities[index]
+        results.setdefault(entity['difficulty'], []).append((status, seconds))
+        if status == SOLVED:
+            set_solution(entity, solution)
+            solved.append(entity)
+        else:
+            logging.getLogger().warning("Puzzle %s not solved: %s", entity['id'], status)
+    if solved:
+        datastore.update_multi(solved)
+
+
+def solve_task(task):
+    """
+    Solves one puzzle in a worker process.
+
+    :param task: Tuple of (index, kakurizer_types.PuzzleGrid, timeout in seconds)
+    :returns: Tuple of (index, status, solution or None, seconds taken)
+    """
+    index, grid, timeout = task
+    start = time.perf_counter()
+    try:
+        solution = Solver(grid).solve(deadline=start + timeout)
+        status = SOLVED if solution is not None else NO_SOLUTION
+    except TimeoutError:
+        solution, status = None, TIMED_OUT
+    except ValueError:
+        solution, status = None, INVALID
+    return index, status, solution, time.perf_counter() - start
+
+
+def format_results(results):
+    """
+    :param results: Dict from difficulty name to list of (status, seconds)
+    :returns: Table of solve time statistics for solved puzzles by difficulty,
+              followed by the number of puzzles which weren't solved
+    """
+    timings = {difficulty: [seconds for status, seconds in outcomes if status == SOLVED]
+               for difficulty, outcomes in results.items()}
+    lines = [format_report(timings)]
+    for difficulty, outcomes in results.items():
+        unsolved = collections.Counter(status for status, _ in outcomes if status != SOLVED)
+        if unsolved:
+            lines.append("%s unsolved: %s" % (difficulty, ", ".join(
+                "%d %s" % (count, status) for status, count in sorted(unsolved.items()))))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    run()
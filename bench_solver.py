@@ -0,0 +1,75 @@
+#!/usr/local/bin/python3
+
+"""
+Benchmarks the solver against every puzzle in the database whose clues have
+been read, reporting solve times for each difficulty level.
+"""
+
+import math
+import statistics
+import time
+import clue_reader
+from datastore_client import DatastoreClient
+from kakurizer_types import Difficulty
+from solver import Solver
+
+REPEATS = 3 # Each puzzle is solved this many times and the fastest time kept
+
+
+def benchmark():
+    """
+    Loads all puzzles with clues and prints solve time statistics by difficulty.
+    """
+    datastore = DatastoreClient()
+    timings = {difficulty.name: [] for difficulty in Difficulty}
+    for page in datastore.get_pages_with_clues():
+        for entity in page:
+            grid = clue_reader.get_clue_grid(entity)
+            timings.setdefault(entity['difficulty'], []).append(time_solve(grid))
+    print(format_report(timings))
+
+
+def time_solve(grid, repeats=REPEATS):
+    """
+    :param grid: kakurizer_types.PuzzleGrid to solve
+    :param repeats: Number of times to solve the puzzle
+    :returns: Fastest time in seconds taken to set up the solver and solve the puzzle
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        Solver(grid).solve()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def format_report(timings):
+    """
+    :param timings: Dict from difficulty name to a list of solve times in seconds
+    :returns: Table of solve time statistics in milliseconds, one row per difficulty
+    """
+    lines = ["%-8s %7s %9s %9s %9s %9s" % ("", "puzzles", "mean ms", "median ms",
+                                          "p90 ms", "max ms")]
+    for difficulty, times in timings.items():
+        if not times:
+            lines.append("%-8s %7d" % (difficulty, 0))
+            continue
+        times = sorted(times)
+        lines.append("%-8s %7d %9.3f %9.3f %9.3f %9.3f" % (
+            difficulty, len(times), statistics.mean(times) * 1000,
+            statistics.median(times) * 1000, percentile(times, 0.9) * 1000,
+            times[-1] * 1000))
+    return "\n".join(lines)
+
+
+def percentile(sorted_times, fraction):
+    """
+    :param sorted_times: Non-empty list of times in ascending order
+    :param fraction: Fraction of times which should be at or below the result
+    :returns: Nearest-rank percentile of the times
+    """
+    return sorted_times[max(0, math.ceil(fraction * len(sorted_times)) - 1)]
+
+
+if __name__ == "__main__":
+    benchmark()
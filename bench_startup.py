@@ -0,0 +1,54 @@
+#!/usr/local/bin/python3
+
+"""
+Benchmarks how long each entry point takes to import, and which heavy libraries
+importing it pulls in. Each module is imported in a fresh interpreter with
+-X importtime so that nothing is already cached.
+"""
+
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = ("check", "index_scanner", "img_finder", "datastore_client")
+HEAVY_MODULES = ("bs4", "requests", "PIL", "google.cloud.datastore", "numpy")
+
+
+def benchmark():
+    """
+    Prints the import time and heavy libraries loaded for every entry point.
+    """
+    print("%-18s %9s  %s" % ("module", "import ms", "heavy modules loaded"))
+    for module in ENTRY_POINTS:
+        micros, loaded = measure_import(module)
+        print("%-18s %9.1f  %s" % (module, micros / 1000, ", ".join(loaded) or "-"))
+
+
+def measure_import(module):
+    """
+    :param module: Name of the module to import
+    :returns: Tuple of (cumulative import time in microseconds, list of HEAVY_MODULES loaded)
+    """
+    code = "import sys, %s; print(' '.join(m for m in %r if m in sys.modules))" % (
+        module, HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    return import_time(result.stderr, module), result.stdout.split()
+
+
+def import_time(report, module):
+    """
+    :param report: stderr output of an interpreter run with -X importtime
+    :param module: Name of the top level module imported
+    :returns: Cumulative time in microseconds taken to import the module
+    """
+    for line in report.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise ValueError("No import time reported for " + module)
+
+
+if __name__ == "__main__":
+    benchmark()
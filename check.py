@@ -0,0 +1,108 @@
+#!/usr/local/bin/python3
+
+"""
+Quickly checks whether the Guardian has published any puzzles since the last scan,
+so that the full pipeline only needs to start when there is something to do.
+
+Only the first index page is loaded, using the standard library, and the ID of
+the puzzle at the top of it is compared with the newest ID saved by index_scanner,
+which is kept in a small state file. IDs are compared for equality rather than
+order, as the index occasionally carries a mistyped ID. Exits with status 0 if
+there are new puzzles, 1 if not and 2 if the check failed, so that a caller can
+tell an error apart from a quiet day.
+"""
+
+import argparse
+import os
+import re
+import sys
+import urllib.request
+
+INDEX_URL = "https://www.theguardian.com/lifeandstyle/series/kakuro?page="
+STATE_PATH = os.path.join(os.path.expanduser("~"), ".kakurizer_last_seen")
+REQUEST_TIMEOUT = 30 # Seconds
+EXIT_NEW = 0
+EXIT_NOTHING_NEW = 1
+EXIT_ERROR = 2
+HEADLINE_ID = re.compile(r"Kakuro ([\d,]+) (?:easy|medium|hard)", re.IGNORECASE)
+
+
+def check(state_path=STATE_PATH):
+    """
+    :param state_path: File holding the newest puzzle ID already saved
+    :returns: ID of the newest published puzzle if it differs from the one saved, otherwise None
+    :raises ValueError: if no puzzle IDs can be found on the index page
+    """
+    with urllib.request.urlopen(INDEX_URL + "1", timeout=REQUEST_TIMEOUT) as response:
+        html = response.read().decode("utf-8", "replace")
+    latest = latest_id(html)
+    if latest != load_last_seen(state_path):
+        return latest
+    return None
+
+
+def latest_id(html):
+    """
+    :param html: String containing HTML content of an index page
+    :returns: ID in the first puzzle headline on the page, which is the newest puzzle
+    :raises ValueError: if the page has no puzzle headlines
+    """
+    match = HEADLINE_ID.search(html)
+    if match is None:
+        raise ValueError("No puzzle headlines found on index page")
+    return int(match.group(1).replace(",", ""))
+
+
+def load_last_seen(state_path=STATE_PATH):
+    """
+    :param state_path: File holding the newest puzzle ID already saved
+    :returns: The saved ID, or None if nothing has been saved yet
+    """
+    try:
+        with open(state_path) as state_file:
+            return int(state_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def save_last_seen(puzzle_id, state_path=STATE_PATH):
+    """
+    Records the newest puzzle ID saved, replacing the state file atomically.
+
+    :param puzzle_id: ID of the newest puzzle saved to the database
+    :param state_path: File holding the newest puzzle ID already saved
+    :returns: None
+    """
+    temp_path = state_path + ".tmp"
+    with open(temp_path, "w") as state_file:
+        state_file.write(str(puzzle_id))
+    os.replace(temp_path, state_path)
+
+
+def main():
+    """
+    Command line entry point, exiting with EXIT_NEW if there are new puzzles,
+    EXIT_NOTHING_NEW if not and EXIT_ERROR if the check failed.
+    """
+    parser = argparse.ArgumentParser(description="Check for newly published kakuro puzzles.")
+    parser.add_argument("--state", default=STATE_PATH, help="File holding the newest saved ID")
+    parser.add_argument("--record", action="store_true",
+                        help="Record the newest published ID as seen, for instance on first use")
+    args = parser.parse_args()
+
+    try:
+        latest = check(args.state)
+        if latest is None:
+            print("No new puzzles")
+            sys.exit(EXIT_NOTHING_NEW)
+        print("New puzzles up to", latest)
+        if args.record:
+            save_last_seen(latest, args.state)
+    except Exception as error: # Anything else would exit with 1, the same as nothing new
+        print("Check failed:", error, file=sys.stderr)
+        sys.exit(EXIT_ERROR)
+    sys.exit(EXIT_NEW)
+
+
+if __name__ == "__main__":
+    main()
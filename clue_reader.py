@@ -0,0 +1,326 @@
+#!/usr/local/bin/python3
+
+"""
+Reads the clue numbers from puzzle images and saves the clue structure for
+each puzzle.
+
+Every clue cell is split by a diagonal, with the across sum in the top-right
+triangle and the down sum in the bottom-left. A fixed box inside each triangle
+is sampled from every clue cell of every puzzle in a batch into one stacked
+array, and the digits in all of them are then classified together by template
+matching against a small built-in font.
+"""
+
+import logging
+import numpy as np
+import logger
+import grid_detector
+from datastore_client import DatastoreClient
+from kakurizer_types import CellType, PuzzleGrid
+
+# Built-in 5x7 digit font, also used to draw test and synthetic puzzles
+DIGIT_FONT = (
+    (".###.", "#...#", "#..##", "#.#.#", "##..#", "#...#", ".###."),
+    ("..#..", ".##..", "..#..", "..#..", "..#..", "..#..", ".###."),
+    (".###.", "#...#", "....#", "...#.", "..#..", ".#...", "#####"),
+    ("#####", "...#.", "..#..", "...#.", "....#", "#...#", ".###."),
+    ("...#.", "..##.", ".#.#.", "#..#.", "#####", "...#.", "...#."),
+    ("#####", "#....", "####.", "....#", "....#", "#...#", ".###."),
+    ("..##.", ".#...", "#....", "####.", "#...#", "#...#", ".###."),
+    ("#####", "....#", "...#.", "..#..", ".#...", ".#...", ".#..."),
+    (".###.", "#...#", "#...#", ".###.", "#...#", "#...#", ".###."),
+    (".###.", "#...#", "#...#", ".####", "....#", "...#.", ".##.."),
+)
+
+# Regions of a clue cell, as fractions of its height and width (top, bottom, left, right),
+# chosen to stay clear of the diagonal and the grid lines
+ACROSS_REGION = (0.06, 0.42, 0.52, 0.94)
+DOWN_REGION = (0.58, 0.94, 0.06, 0.48)
+BOX_HEIGHT = 18 # Resolution at which each region is sampled
+BOX_WIDTH = 21
+GLYPH_HEIGHT = 14 # Resolution at which each digit is compared with the font
+GLYPH_WIDTH = 10
+INK_CONTRAST = 0.3 # How much darker than a region's background a pixel must be to be ink
+TWO_DIGIT_ASPECT = 1.1 # Numbers wider than this multiple of their height have two digits
+SPLIT_WINDOW = (0.3, 0.7) # Part of a two digit number searched for the gap between digits
+
+
+def read():
+    """
+    Reads the clues of every puzzle in the database which has an image but no clues yet.
+    """
+    logger.setup_logger()
+    grid_detector.persist_layouts()
+    datastore = DatastoreClient()
+    for page in datastore.get_pages_without_clues():
+        update_puzzles_with_clues(datastore, page)
+
+
+def update_puzzles_with_clues(datastore, entities):
+    """
+    Reads the clues for a batch of puzzles and saves them to the database. Puzzles
+    whose grid or clues can't be read consistently are logged and left unchanged.
+
+    :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+    :param entities: List of database entries with image blobs
+    :returns: List of the entities which were updated
+    """
+    grids = read_clue_grids([entity['img_blob'] for entity in entities])
+    updated = []
+    for entity, grid in zip(entities, grids):
+        if grid is None or not is_consistent(grid):
+            logging.getLogger().warning("Unable to read clues for puzzle %s", entity['id'])
+            continue
+        set_clue_grid(entity, grid)
+        updated.append(entity)
+    if updated:
+        datastore.update_multi(updated)
+    logging.getLogger().info("Read clues for %s of %s puzzles", len(updated), len(entities))
+    return updated
+
+
+def set_clue_grid(entity, grid):
+    """
+    Stores a clue structure on a puzzle entity and marks it as having clues.
+
+    :param entity: database entry representing a puzzle
+    :param grid: kakurizer_types.PuzzleGrid read from the puzzle's image
+    :returns: None
+    """
+    entity['grid_data'] = grid.encode()
+    entity['has_clues'] = True
+    entity.exclude_from_indexes = set(entity.exclude_from_indexes) | {'grid_data'}
+
+
+def get_clue_grid(entity):
+    """
+    :param entity: database entry for a puzzle with has_clues set
+    :returns: kakurizer_types.PuzzleGrid stored on the entity
+    """
+    return PuzzleGrid.decode(entity['grid_data'])
+
+
+def read_clue_grids(image_blobs):
+    """
+    Finds the grid and reads the clues of a batch of puzzle images.
+
+    :param image_blobs: List or tuple of raw image bytes
+    :returns: List of kakurizer_types.PuzzleGrid in the same order as the input, with
+              None for any image whose grid could not be found
+    """
+    images = grid_detector.load_greyscale_batch(image_blobs)
+    geometries = grid_detector.detect_grids_in_images(images)
+    found = [index for index, geometry in enumerate(geometries) if geometry is not None]
+    darks = [grid_detector.darkness(images[index]) for index in found]
+    clue_cells = [np.flatnonzero(geometries[index].cells.ravel() == CellType.CLUE.value)
+                  for index in found]
+    found_geometries = [geometries[index] for index in found]
+    across = read_numbers(stack_regions(darks, found_geometries, clue_cells, ACROSS_REGION))
+    down = read_numbers(stack_regions(darks, found_geometries, clue_cells, DOWN_REGION))
+
+    results = [None] * len(image_blobs)
+    start = 0
+    for index, cells in zip(found, clue_cells):
+        geometry = geometries[index]
+        height, width = geometry.cells.shape
+        across_sums = np.zeros(height * width, dtype=np.uint8)
+        down_sums = np.zeros(height * width, dtype=np.uint8)
+        across_sums[cells] = across[start: start + len(cells)]
+        down_sums[cells] = down[start: start + len(cells)]
+        start += len(cells)
+        results[index] = PuzzleGrid(height, width, geometry.cells.tobytes(),
+                                    across_sums.tobytes(), down_sums.tobytes())
+    return results
+
+
+def stack_regions(darks, geometries, clue_cells, region):
+    """
+    Samples one region of every clue cell across a batch of images into a single array.
+
+    :param darks: List of 2D numpy.ndarray darkness images
+    :param geometries: List of kakurizer_types.GridGeometry for those images
+    :param clue_cells: List of 1D numpy.ndarray of row-major clue cell indexes for each image
+    :param region: Tuple of (top, bottom, left, right) fractions of the cell to sample
+    :returns: 3D numpy.ndarray of shape (total clue cells, BOX_HEIGHT, BOX_WIDTH)
+    """
+    boxes = [region_boxes(dark, geometry, cells, region)
+             for dark, geometry, cells in zip(darks, geometries, clue_cells)]
+    if not boxes:
+        return np.zeros((0, BOX_HEIGHT, BOX_WIDTH), dtype=np.float32)
+    return np.concatenate(boxes)
+
+
+def region_boxes(dark, geometry, cells, region):
+    """
+    Samples the same region from each of a set of cells at a fixed resolution.
+
+    :param dark: 2D numpy.ndarray of darkness values for the whole image
+    :param geometry: kakurizer_types.GridGeometry of the image
+    :param cells: 1D numpy.ndarray of row-major indexes of the cells to sample
+    :param region: Tuple of (top, bottom, left, right) fractions of the cell to sample
+    :returns: 3D numpy.ndarray of shape (cells, BOX_HEIGHT, BOX_WIDTH)
+    """
+    rows, cols = np.divmod(cells, geometry.cells.shape[1])
+    top, bottom, left, right = region
+    y_fractions = top + (bottom - top) * (np.arange(BOX_HEIGHT) + 0.5) / BOX_HEIGHT
+    x_fractions = left + (right - left) * (np.arange(BOX_WIDTH) + 0.5) / BOX_WIDTH
+    heights = np.diff(geometry.row_edges)[rows]
+    widths = np.diff(geometry.col_edges)[cols]
+    ys = (geometry.row_edges[rows][:, None] + heights[:, None] * y_fractions).astype(np.intp)
+    xs = (geometry.col_edges[cols][:, None] + widths[:, None] * x_fractions).astype(np.intp)
+    return dark[ys[:, :, None], xs[:, None, :]]
+
+
+def read_numbers(boxes):
+    """
+    Reads the number written in each of a stack of sampled regions.
+
+    :param boxes: 3D numpy.ndarray of darkness values with shape (regions, height, width)
+    :returns: 1D numpy.ndarray with the number in each region, or 0 for blank regions
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    background = np.median(boxes, axis=(1, 2), keepdims=True)
+    ink = boxes > background + INK_CONTRAST
+    first_col = np.zeros(len(ink), dtype=np.intp)
+    last_col = np.full(len(ink), ink.shape[2] - 1, dtype=np.intp)
+    has_ink, top, bottom, left, right = ink_bounds(ink, first_col, last_col)
+    two_digits = has_ink & (right - left + 1 > TWO_DIGIT_ASPECT * (bottom - top + 1))
+
+    # Split two digit numbers at the emptiest column near the middle
+    cols = np.arange(ink.shape[2])
+    span = right - left + 1
+    window = ((cols[None, :] >= left[:, None] + SPLIT_WINDOW[0] * span[:, None])
+              & (cols[None, :] <= left[:, None] + SPLIT_WINDOW[1] * span[:, None]))
+    column_ink = np.where(window, ink.sum(axis=1), ink.shape[1] + 1)
+    split = column_ink.argmin(axis=1)
+
+    tens = classify_glyphs(ink, *ink_bounds(ink, left, split)[1:])
+    units_has_ink, *units_bounds = ink_bounds(ink, np.where(two_digits, split + 1, left), right)
+    units = classify_glyphs(ink, *units_bounds)
+    return np.where(has_ink & units_has_ink, np.where(two_digits, tens * 10 + units, units), 0)
+
+
+def ink_bounds(ink, first_col, last_col):
+    """
+    Finds the bounding box of the ink in each region, only looking between the given columns.
+
+    :param ink: 3D numpy.ndarray of booleans with shape (regions, height, width)
+    :param first_col: 1D numpy.ndarray of the first column to consider in each region
+    :param last_col: 1D numpy.ndarray of the last column to consider in each region
+    :returns: Tuple of 1D numpy.ndarrays (has ink, top, bottom, left, right)
+    """
+    cols = np.arange(ink.shape[2])
+    in_range = (cols[None, :] >= first_col[:, None]) & (cols[None, :] <= last_col[:, None])
+    masked = ink & in_range[:, None, :]
+    rows_inked = masked.any(axis=2)
+    cols_inked = masked.any(axis=1)
+    top = rows_inked.argmax(axis=1)
+    bottom = ink.shape[1] - 1 - rows_inked[:, ::-1].argmax(axis=1)
+    left = cols_inked.argmax(axis=1)
+    right = ink.shape[2] - 1 - cols_inked[:, ::-1].argmax(axis=1)
+    return rows_inked.any(axis=1), top, bottom, left, right
+
+
+def sample_glyphs(ink, top, bottom, left, right):
+    """
+    Resamples the given bounding box of each region to the glyph resolution.
+
+    :returns: 3D numpy.ndarray of booleans with shape (regions, GLYPH_HEIGHT, GLYPH_WIDTH)
+    """
+    row_steps = (np.arange(GLYPH_HEIGHT) + 0.5) / GLYPH_HEIGHT
+    col_steps = (np.arange(GLYPH_WIDTH) + 0.5) / GLYPH_WIDTH
+    rows = top[:, None] + (row_steps * (bottom - top + 1)[:, None]).astype(np.intp)
+    cols = left[:, None] + (col_steps * (right - left + 1)[:, None]).astype(np.intp)
+    regions = np.arange(len(ink))[:, None, None]
+    return ink[regions, rows[:, :, None], cols[:, None, :]]
+
+
+def classify_glyphs(ink, top, bottom, left, right):
+    """
+    Matches the glyph in the given bounding box of each region against the digit font.
+
+    :returns: 1D numpy.ndarray of the closest digit for each region
+    """
+    glyphs = sample_glyphs(ink, top, bottom, left, right).reshape(len(ink), -1)
+    glyphs = glyphs.astype(np.float32)
+    distances = (DIGIT_TEMPLATES ** 2).sum(axis=1)[None, :] - 2 * glyphs @ DIGIT_TEMPLATES.T
+    return distances.argmin(axis=1)
+
+
+def build_templates():
+    """
+    Crops each digit of the font to its ink and samples it at the glyph resolution,
+    in the same way that digits read from images are.
+
+    :returns: 2D numpy.ndarray of shape (10, GLYPH_HEIGHT * GLYPH_WIDTH)
+    """
+    font = np.array([[[pixel == "#" for pixel in line] for line in digit]
+                     for digit in DIGIT_FONT])
+    first_col = np.zeros(len(font), dtype=np.intp)
+    last_col = np.full(len(font), font.shape[2] - 1, dtype=np.intp)
+    bounds = ink_bounds(font, first_col, last_col)[1:]
+    return sample_glyphs(font, *bounds).reshape(len(font), -1).astype(np.float32)
+
+
+def is_consistent(grid):
+    """
+    Checks that a clue structure describes a playable grid: every clue cell has at
+    least one sum and each sum is followed by a run of empty cells, while every
+    empty cell belongs to an across run and a down run. Each sum must also be one
+    that n distinct digits can add up to for a run of n cells, which rejects runs
+    of more than nine cells too.
+
+    :param grid: kakurizer_types.PuzzleGrid
+    :returns: True if and only if the clues are consistent with the cells
+    """
+    cells = np.frombuffer(grid.cells, dtype=np.uint8).reshape(grid.height, grid.width)
+    across = np.frombuffer(grid.across, dtype=np.uint8).reshape(cells.shape)
+    down = np.frombuffer(grid.down, dtype=np.uint8).reshape(cells.shape)
+    clue = cells == CellType.CLUE.value
+    empty = cells == CellType.EMPTY.value
+    right_empty = np.zeros_like(empty)
+    right_empty[:, :-1] = empty[:, 1:]
+    below_empty = np.zeros_like(empty)
+    below_empty[:-1, :] = empty[1:, :]
+    left_open = np.zeros_like(empty)
+    left_open[:, 1:] = cells[:, :-1] != CellType.BLOCKED.value
+    above_open = np.zeros_like(empty)
+    above_open[1:, :] = cells[:-1, :] != CellType.BLOCKED.value
+    return bool(np.all(across[clue] + down[clue] > 0)
+                and np.array_equal(across[clue] > 0, right_empty[clue])
+                and np.array_equal(down[clue] > 0, below_empty[clue])
+                and np.all(left_open[empty])
+                and np.all(above_open[empty])
+                and sums_possible(across[clue], run_lengths(empty)[clue])
+                and sums_possible(down[clue], run_lengths(empty.T).T[clue]))
+
+
+def run_lengths(empty):
+    """
+    :param empty: 2D boolean array of empty cells
+    :returns: 2D array of the number of consecutive empty cells to the right of each cell
+    """
+    lengths = np.zeros(empty.shape, dtype=np.int64)
+    for col in range(empty.shape[1] - 2, -1, -1):
+        lengths[:, col] = empty[:, col + 1] * (lengths[:, col + 1] + 1)
+    return lengths
+
+
+def sums_possible(sums, lengths):
+    """
+    :param sums: array of clue sums, 0 where there is no run
+    :param lengths: array of the lengths of the runs following each clue
+    :returns: True if and only if each non-zero sum can be made from its run's distinct digits
+    """
+    sums = sums.astype(np.int64)
+    has_sum = sums > 0
+    return bool(np.all(sums[has_sum] >= lengths[has_sum] * (lengths[has_sum] + 1) // 2)
+                and np.all(sums[has_sum] <= lengths[has_sum] * (19 - lengths[has_sum]) // 2))
+
+
+DIGIT_TEMPLATES = build_templates()
+
+
+if __name__ == "__main__":
+    read()
@@ -1,9 +1,25 @@
 """
 Provides client wrapping access to Google Cloud Datastore for use with kakuro puzzles.
+
+The google.cloud.datastore library is only imported once a client is created or an
+entity built, so that scripts which exit early don't pay for loading it.
+
+Every request a client makes is counted by operation, with the entities and
+estimated bytes it moved and the time spent waiting on it. The counts of every
+client in a process are added together, and a report with the estimated cost of
+the run is logged once when the script exits.
 """
 
+import atexit
+import collections
 import logging
-from google.cloud import datastore
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import image_archive
+import logger
+import puzzle_export
+from kakurizer_types import index_hash
 
 class DatastoreClient:
     """
@@ -13,10 +29,23 @@ class DatastoreClient:
     CLOUD_PROJECT = "kakurizer"
     CLOUDSTORE_TYPE = "kakuro"
     MAX_PUT_SIZE = 500 # Maximum supported mutations in same transaction (Google-imposed limit)
+    MAX_PUT_BYTES = 9 * 1024 * 1024 # Under the 10 MiB limit on a commit request (Google-imposed),
+                                    # leaving headroom for errors in estimate_size
     DATASTORE_MAX_INT = 9223372036854775807
+    EXPORT_PAGE_SIZE = 250 # Entities fetched per cursor page, and rows per export row group
+    IMPORT_WORKERS = 4
+    CLUE_PAGE_SIZE = 100 # Puzzles with images fetched at once for clue recognition
+    SOLVE_PAGE_SIZE = 500
+    IMAGE_PAGE_SIZE = 100 # Puzzles with images fetched at once for the image archive
+    METADATA_PAGE_SIZE = 1000
+    METADATA_PROPERTIES = ("id", "timestamp_millis", "difficulty", "page_url",
+                           "has_img", "has_clues", "has_solution")
 
     def __init__(self):
+        from google.cloud import datastore
         self.client = datastore.Client(project=self.CLOUD_PROJECT)
+        self.usage = USAGE
+        report_usage_at_exit()
 
 
     def get_ids(self, min_id=-DATASTORE_MAX_INT, max_id=DATASTORE_MAX_INT):
@@ -31,7 +60,29 @@ class DatastoreClient:
         query = self.client.query(kind=self.CLOUDSTORE_TYPE, projection=("id",))
         query.add_filter('id', '>=', min_id)
         query.add_filter('id', '<=', max_id)
-        return (puzzle['id'] for puzzle in query.fetch())
+        pages = self.__metered_pages("get_ids", PROJECTION, query.fetch())
+        return (puzzle['id'] for page in pages for puzzle in page)
+
+
+    def get_index_hashes(self, min_id=-DATASTORE_MAX_INT, max_id=DATASTORE_MAX_INT):
+        """
+        Looks up the stored index hash of every puzzle in a range of IDs, using
+        projection queries so that no full entities are loaded.
+
+        :param min_id: If set, only look for IDs greater than or equal to this
+        :param max_id: If set, only look for IDs less than or equal to this
+        :returns: Dict from puzzle ID to (key, index hash), where the hash is None for
+                  puzzles saved before hashes were stored
+        """
+        stored = {}
+        for projection in (("id",), ("id", "index_hash")):
+            query = self.client.query(kind=self.CLOUDSTORE_TYPE, projection=projection)
+            query.add_filter('id', '>=', min_id)
+            query.add_filter('id', '<=', max_id)
+            for page in self.__metered_pages("get_index_hashes", PROJECTION, query.fetch()):
+                for puzzle in page:
+                    stored[puzzle['id']] = (puzzle.key, puzzle.get('index_hash'))
+        return stored
 
 
     def get_index_puzzles(self, min_id=-DATASTORE_MAX_INT, max_id=DATASTORE_MAX_INT):
@@ -39,7 +90,8 @@ class DatastoreClient:
         query.add_filter('id', '>=', min_id)
         query.add_filter('id', '<=', max_id)
         query.add_filter('has_img', '=', False)
-        return [puzzle for puzzle in query.fetch()]
+        return [puzzle for page in self.__metered_pages("get_index_puzzles", READ, query.fetch())
+                for puzzle in page]
 
 
     def put_index_puzzles(self, index_puzzles):
@@ -49,16 +101,24 @@ class DatastoreClient:
         set.
 
         :param index_puzzles: List or tuple of kakurizer_types.IndexPuzzle
-        :returns: void
+        :returns: List of the saved google.cloud.datastore.entity.Entity
         """
         partial_key = self.client.key(self.CLOUDSTORE_TYPE)
+        saved = []
         for chunk_start in range(0, len(index_puzzles), self.MAX_PUT_SIZE):
             puzzles = index_puzzles[chunk_start: chunk_start + self.MAX_PUT_SIZE]
             size = len(puzzles)
+            started = time.perf_counter()
             keys = self.client.allocate_ids(partial_key, size)
+            self.usage.record("allocate_ids", SMALL_OPERATION, entities=size,
+                              seconds=time.perf_counter() - started)
             entities = tuple(prepare_index_puzzle(puzzles[p], keys[p]) for p in range(size))
-            self.client.put_multi(entities)
+            touch(entities)
+            for batch in put_batches(entities, self.MAX_PUT_SIZE, self.MAX_PUT_BYTES):
+                self.__put_batch(batch)
+            saved.extend(entities)
             logging.getLogger().info("Saved %s puzzles from index", size)
+        return saved
 
 
     def update(self, entity):
@@ -66,8 +126,489 @@ class DatastoreClient:
         :param entities: List or tuple of google.cloud.datastore.entity.Entity with updated values
         :returns: void
         """
+        touch([entity])
+        started = time.perf_counter()
         self.client.put(entity)
-        logging.getLogger().info("Updated puzzle %s", entity['id'])
+        self.usage.record("put", WRITE, entities=1, size=estimate_size(entity),
+                          seconds=time.perf_counter() - started)
+        logging.getLogger(logger.PUZZLE_LOGGER).info("Updated puzzle %s", entity['id'],
+                                                     extra={"puzzle_id": entity['id']})
+
+
+    def get_all_pages(self, page_size=EXPORT_PAGE_SIZE):
+        """
+        Streams every puzzle in the database, one page at a time, following query
+        cursors so that only a single page is ever held in memory.
+
+        :param page_size: Number of entities to fetch per page
+        :returns: Generator of lists of google.cloud.datastore.entity.Entity
+        """
+        query = self.client.query(kind=self.CLOUDSTORE_TYPE)
+        return self.__fetch_pages("get_all_pages", READ, query, page_size)
+
+
+    def get_pages_without_clues(self, page_size=CLUE_PAGE_SIZE):
+        """
+        Streams puzzles which have an image but whose clues haven't been read yet.
+
+        :param page_size: Number of entities to fetch per page
+        :returns: Generator of lists of google.cloud.datastore.entity.Entity
+        """
+        query = self.client.query(kind=self.CLOUDSTORE_TYPE)
+        query.add_filter('has_img', '=', True)
+        query.add_filter('has_clues', '=', False)
+        return self.__fetch_pages("get_pages_without_clues", READ, query, page_size)
+
+
+    def get_pages_with_images(self, page_size=IMAGE_PAGE_SIZE):
+        """
+        Streams puzzles which have an image.
+
+        :param page_size: Number of entities to fetch per page
+        :returns: Generator of lists of google.cloud.datastore.entity.Entity
+        """
+        query = self.client.query(kind=self.CLOUDSTORE_TYPE)
+        query.add_filter('has_img', '=', True)
+        return self.__fetch_pages("get_pages_with_images", READ, query, page_size)
+
+
+    def get_untranscoded_pages(self, version, page_size=IMAGE_PAGE_SIZE):
+        """
+        Streams puzzles which have an image that hasn't been transcoded at the given
+        version. Keys-only queries find which puzzles these are, so that only those
+        are loaded in full.
+
+        :param version: Current transcoder.TRANSCODE_VERSION
+        :param page_size: Number of entities to fetch per page
+        :returns: Generator of lists of google.cloud.datastore.entity.Entity
+        """
+        query = self.client.query(kind=self.CLOUDSTORE_TYPE)
+        query.add_filter('has_img', '=', True)
+        query.keys_only()
+        keys = [entity.key for page in self.__metered_pages(
+            "get_untranscoded_pages", PROJECTION, query.fetch()) for entity in page]
+        query = self.client.query(kind=self.CLOUDSTORE_TYPE)
+        query.add_filter('transcode_version', '=', version)
+        query.keys_only()
+        done = {entity.key for page in self.__metered_pages(
+            "get_untranscoded_pages", PROJECTION, query.fetch()) for entity in page}
+        keys = [key for key in keys if key not in done]
+        for chunk_start in range(0, len(keys), page_size):
+            started = time.perf_counter()
+            page = self.client.get_multi(keys[chunk_start: chunk_start + page_size])
+            self.usage.record("get_multi", READ, entities=len(page),
+                              size=sum(estimate_size(entity) for entity in page),
+                              seconds=time.perf_counter() - started)
+            yield page
+
+
+    def get_pages_with_clues(self, unsolved_only=False, page_size=SOLVE_PAGE_SIZE):
+        """
+        Streams puzzles whose clues have been read.
+
+        :param unsolved_only: If set, only return puzzles which haven't been solved yet
+        :param page_size: Number of entities to fetch per page
+        :returns: Generator of lists of google.cloud.datastore.entity.Entity
+        """
+        query = self.client.query(kind=self.CLOUDSTORE_TYPE)
+        query.add_filter('has_clues', '=', True)
+        if unsolved_only:
+            query.add_filter('has_solution', '=', False)
+        return self.__fetch_pages("get_pages_with_clues", READ, query, page_size)
+
+
+    def get_metadata_pages(self, updated_since=None, page_size=METADATA_PAGE_SIZE):
+        """
+        Streams the metadata of every puzzle using projection queries, so that no
+        images or other large properties are loaded.
+
+        :param updated_since: If set, only include puzzles saved after this time, in
+                              milliseconds since the epoch
+        :param page_size: Number of entities to fetch per page
+        :returns: Generator of lists of projected google.cloud.datastore.entity.Entity,
+                  holding METADATA_PROPERTIES (and updated_millis if updated_since is set)
+        """
+        if updated_since is None:
+            query = self.client.query(kind=self.CLOUDSTORE_TYPE,
+                                      projection=self.METADATA_PROPERTIES)
+        else:
+            query = self.client.query(kind=self.CLOUDSTORE_TYPE,
+                                      projection=("updated_millis",) + self.METADATA_PROPERTIES)
+            query.add_filter('updated_millis', '>', updated_since)
+        return self.__fetch_pages("get_metadata_pages", PROJECTION, query, page_size)
+
+
+    def update_index_puzzles(self, changes):
+        """
+        Overwrites the index page fields of existing puzzles, leaving everything
+        found by later stages of the pipeline alone.
+
+        :param changes: List of (google.cloud.datastore.key.Key, kakurizer_types.IndexPuzzle)
+        :returns: List of the updated google.cloud.datastore.entity.Entity
+        """
+        updated = []
+        for chunk_start in range(0, len(changes), self.MAX_PUT_SIZE):
+            chunk = changes[chunk_start: chunk_start + self.MAX_PUT_SIZE]
+            started = time.perf_counter()
+            found = self.client.get_multi([key for key, _ in chunk])
+            self.usage.record("get_multi", READ, entities=len(found),
+                              size=sum(estimate_size(entity) for entity in found),
+                              seconds=time.perf_counter() - started)
+            entities = {entity.key: entity for entity in found}
+            for key, index_puzzle in chunk:
+                if key in entities:
+                    set_index_fields(entities[key], index_puzzle)
+                    updated.append(entities[key])
+        self.update_multi(updated)
+        return updated
+
+
+    def update_multi(self, entities):
+        """
+        Saves changes to a set of existing puzzles in as few requests as possible,
+        keeping each request within both the mutation and the size limits.
+
+        :param entities: List or tuple of google.cloud.datastore.entity.Entity with updated values
+        :returns: void
+        """
+        touch(entities)
+        for batch in put_batches(entities, self.MAX_PUT_SIZE, self.MAX_PUT_BYTES):
+            self.__put_batch(batch)
+            logging.getLogger().info("Updated %s puzzles", len(batch))
+
+
+    def __put_batch(self, batch):
+        """
+        Saves a batch of entities in one request. If the request is still rejected
+        as too large, because the size estimate was too low, the batch is split in
+        half and each half saved separately. Any other rejection is raised at once,
+        since retrying the rest piecemeal would only leave a partial write.
+
+        :param batch: List or tuple of google.cloud.datastore.entity.Entity
+        :returns: void
+        :raises google.api_core.exceptions.InvalidArgument: if the batch is rejected other
+                than for its size, or a single entity is rejected
+        """
+        from google.api_core.exceptions import InvalidArgument
+        started = time.perf_counter()
+        try:
+            self.client.put_multi(batch)
+        except InvalidArgument as error:
+            self.usage.record("put_multi", WRITE, seconds=time.perf_counter() - started)
+            if len(batch) == 1 or not is_size_error(error):
+                raise
+            logging.getLogger().warning("Batch of %s puzzles rejected, retrying in halves: %s",
+                                        len(batch), error)
+            middle = len(batch) // 2
+            self.__put_batch(batch[:middle])
+            self.__put_batch(batch[middle:])
+        else:
+            self.usage.record("put_multi", WRITE, entities=len(batch),
+                              size=sum(estimate_size(entity) for entity in batch),
+                              seconds=time.perf_counter() - started)
+
+
+    def __fetch_pages(self, operation, kind, query, page_size):
+        cursor = None
+        while True:
+            started = time.perf_counter()
+            query_iter = query.fetch(start_cursor=cursor, limit=page_size)
+            page = list(next(query_iter.pages, ()))
+            self.usage.record(operation, kind, entities=len(page),
+                              size=sum(estimate_size(entity) for entity in page),
+                              seconds=time.perf_counter() - started)
+            if not page:
+                return
+            yield page
+            cursor = query_iter.next_page_token
+            if cursor is None:
+                return
+
+
+    def __metered_pages(self, operation, kind, query_iter):
+        """
+        Passes on the pages of a query, recording each one as a request.
+
+        :returns: Generator of lists of google.cloud.datastore.entity.Entity
+        """
+        pages = query_iter.pages
+        while True:
+            started = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            page = list(page)
+            self.usage.record(operation, kind, entities=len(page),
+                              size=sum(estimate_size(entity) for entity in page),
+                              seconds=time.perf_counter() - started)
+            yield page
+
+
+    def export_puzzles(self, path):
+        """
+        Writes a snapshot of every puzzle in the database to a columnar export file.
+
+        :param path: Location of the export file to write
+        :returns: Number of puzzles exported
+        """
+        with puzzle_export.ExportWriter(path) as writer:
+            for page in self.get_all_pages():
+                writer.write_group(page)
+        logging.getLogger().info("Exported %s puzzles to %s", writer.rows, path)
+        return writer.rows
+
+
+    def export_images(self, path):
+        """
+        Writes the image of every puzzle which has one to a packed image archive.
+
+        :param path: Location of the archive file to write
+        :returns: Number of images exported
+        """
+        with image_archive.ArchiveWriter(path) as writer:
+            for page in self.get_pages_with_images():
+                for entity in page:
+                    writer.add(entity['id'], entity['img_blob'])
+        logging.getLogger().info("Exported %s images to %s", len(writer.entries), path)
+        return len(writer.entries)
+
+
+    def import_puzzles(self, path, workers=IMPORT_WORKERS):
+        """
+        Loads a snapshot written by export_puzzles back into the database, keeping the
+        original keys. Batches are saved in parallel, with the number of batches in
+        flight bounded so that memory use doesn't grow with the size of the snapshot.
+
+        :param path: Location of the export file to read
+        :param workers: Number of batches to save concurrently
+        :returns: Number of puzzles imported
+        """
+        imported = 0
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for group in puzzle_export.read_groups(path):
+                entities = tuple(self.__prepare_imported(row) for row in group)
+                for batch in put_batches(entities, self.MAX_PUT_SIZE, self.MAX_PUT_BYTES):
+                    if len(in_flight) >= workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    in_flight.add(executor.submit(self.__put_batch, batch))
+                    imported += len(batch)
+            for future in in_flight:
+                future.result()
+        logging.getLogger().info("Imported %s puzzles from %s", imported, path)
+        return imported
+
+
+    def __prepare_imported(self, row):
+        from google.cloud.datastore.entity import Entity
+        key_id, properties, unindexed = row
+        entity = Entity(key=self.client.key(self.CLOUDSTORE_TYPE, key_id),
+                        exclude_from_indexes=unindexed)
+        entity.update(properties)
+        return entity
+
+
+# Kinds of operation, which are billed differently
+READ = "read" # Full entities, billed per entity read
+PROJECTION = "projection" # Projection queries, billed as one read per request and
+                          # a small operation per entity
+SMALL_OPERATION = "small" # Key allocations, billed per key as small operations
+WRITE = "write" # Billed per entity written
+
+OperationUsage = collections.namedtuple('OperationUsage',
+                                        ['operation', 'kind', 'requests', 'entities',
+                                         'bytes', 'seconds', 'cost'])
+
+DatastorePrices = collections.namedtuple('DatastorePrices',
+                                         ['entity_read', 'entity_write', 'small_operation',
+                                          'gib_transferred'])
+
+# Estimated prices in US dollars, from the list prices for Datastore mode at
+# the time of writing. Update these from the bill if they drift.
+DATASTORE_PRICES = DatastorePrices(entity_read=0.06 / 100000, entity_write=0.18 / 100000,
+                                   small_operation=0.0, gib_transferred=0.12)
+GIB = 1024 ** 3
+
+class DatastoreUsage:
+    """
+    Counts the requests made to the database by operation, with the entities
+    and estimated bytes each moved and the time spent waiting on them. Safe to
+    record to from several threads.
+    """
+
+    def __init__(self, prices=DATASTORE_PRICES):
+        """
+        :param prices: DatastorePrices to estimate costs with
+        """
+        self.prices = prices
+        self.operations = {} # Operation name to [kind, requests, entities, bytes, seconds]
+        self.lock = threading.Lock()
+
+
+    def record(self, operation, kind, entities=0, size=0, seconds=0.0):
+        """
+        Adds one request to the counts for an operation.
+
+        :param operation: Name of the operation, such as the client method called
+        :param kind: READ, PROJECTION, SMALL_OPERATION or WRITE
+        :param entities: Number of entities read or written by the request
+        :param size: Estimated bytes of the entities
+        :param seconds: Time spent waiting on the request
+        :returns: None
+        """
+        with self.lock:
+            counts = self.operations.setdefault(operation, [kind, 0, 0, 0, 0.0])
+            counts[1] += 1
+            counts[2] += entities
+            counts[3] += size
+            counts[4] += seconds
+
+
+    def report(self):
+        """
+        :returns: List of OperationUsage for each operation used,
+                  most expensive first
+        """
+        with self.lock:
+            usages = [OperationUsage(operation, kind, requests, entities, size, seconds,
+                                     self.cost(kind, requests, entities, size))
+                      for operation, (kind, requests, entities, size, seconds)
+                      in self.operations.items()]
+        return sorted(usages, key=lambda usage: (-usage.cost, usage.operation))
+
+
+    def cost(self, kind, requests, entities, size):
+        """
+        :returns: Estimated cost in US dollars of requests of the given kind
+        """
+        prices = self.prices
+        cost = size / GIB * prices.gib_transferred
+        if kind == READ:
+            return cost + entities * prices.entity_read
+        if kind == PROJECTION:
+            return cost + requests * prices.entity_read + entities * prices.small_operation
+        if kind == WRITE:
+            return cost + entities * prices.entity_write
+        return cost + entities * prices.small_operation
+
+
+    def log_report(self):
+        """
+        Logs a line for each operation used and a line with the totals, or
+        nothing if no requests were made.
+        """
+        usages = self.report()
+        if not usages:
+            return
+        for usage in usages:
+            logging.getLogger().info(
+                "Datastore %s: %s requests, %s %s entities, %.1f KiB in %.2fs, estimated $%.6f",
+                usage.operation, usage.requests, usage.entities, usage.kind, usage.bytes / 1024,
+                usage.seconds, usage.cost, extra={"datastore_usage": usage._asdict()})
+        logging.getLogger().info(
+            "Datastore total: %s requests, %s entities, %.1f KiB in %.2fs, estimated $%.6f",
+            sum(usage.requests for usage in usages), sum(usage.entities for usage in usages),
+            sum(usage.bytes for usage in usages) / 1024, sum(usage.seconds for usage in usages),
+            sum(usage.cost for usage in usages))
+
+
+USAGE = DatastoreUsage() # Shared by every client in the process
+_report_registered = False
+
+def report_usage_at_exit():
+    """
+    Logs the usage report when the process exits. Called as clients are created,
+    after scripts have set up logging, and only registers the report once.
+    """
+    global _report_registered
+    if not _report_registered:
+        atexit.register(USAGE.log_report)
+        _report_registered = True
+
+
+def put_batches(entities, max_count, max_bytes):
+    """
+    Packs entities, in order, into batches which each hold as many entities as
+    both limits allow. An entity which alone is over max_bytes goes in a batch of its own.
+
+    :param entities: List or tuple of google.cloud.datastore.entity.Entity
+    :param max_count: Maximum number of entities in a batch
+    :param max_bytes: Maximum estimated serialized size of a batch
+    :returns: Generator of tuples of entities
+    """
+    start = 0
+    size = 0
+    for position, entity in enumerate(entities):
+        entity_size = estimate_size(entity)
+        if position > start and (position - start == max_count or size + entity_size > max_bytes):
+            yield tuple(entities[start: position])
+            start = position
+            size = 0
+        size += entity_size
+    if start < len(entities):
+        yield tuple(entities[start:])
+
+
+SIZE_ERROR_MARKERS = ("payload size", "request size", "too much data", "too large")
+
+def is_size_error(error):
+    """
+    :param error: google.api_core.exceptions.InvalidArgument from a commit
+    :returns: True if the request was rejected for being too large
+    """
+    message = str(error).lower()
+    return any(marker in message for marker in SIZE_ERROR_MARKERS)
+
+
+ENTITY_OVERHEAD = 32 # Bytes per entity besides its properties, from Google's storage size rules
+PROPERTY_OVERHEAD = 8 # Bytes per property for its type and field tags
+
+def estimate_size(entity):
+    """
+    Estimates how many bytes an entity adds to a commit request, following the
+    way Google counts entity sizes: names and string values by their UTF-8
+    length, bytes by their length and numbers as 8 bytes.
+
+    :param entity: google.cloud.datastore.entity.Entity
+    :returns: Estimated size in bytes
+    """
+    size = ENTITY_OVERHEAD
+    if entity.key is not None:
+        size += sum(len(str(part).encode("utf-8")) + PROPERTY_OVERHEAD
+                    for part in entity.key.flat_path)
+    for name, value in entity.items():
+        size += len(name.encode("utf-8")) + value_size(value)
+    return size
+
+
+def value_size(value):
+    """
+    :returns: Estimated serialized size in bytes of a single property value
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return PROPERTY_OVERHEAD + len(value)
+    if isinstance(value, str):
+        return PROPERTY_OVERHEAD + len(value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return PROPERTY_OVERHEAD + sum(value_size(item) for item in value)
+    if isinstance(value, dict):
+        return PROPERTY_OVERHEAD + sum(len(name.encode("utf-8")) + value_size(item)
+                                       for name, item in value.items())
+    return PROPERTY_OVERHEAD + 8
+
+
+def touch(entities):
+    """
+    Stamps entities with the time they are saved, so readers can pick up changes since a given time.
+
+    :param entities: List or tuple of google.cloud.datastore.entity.Entity about to be saved
+    :returns: None
+    """
+    now = int(time.time() * 1000)
+    for entity in entities:
+        entity['updated_millis'] = now
 
 
 def prepare_index_puzzle(index_puzzle, final_key):
@@ -79,12 +620,25 @@ def prepare_index_puzzle(index_puzzle, final_key):
     :param final_key: google.cloud.datastore.key.Key to uniquely identify this puzzle
     :returns: Puzzle represented as google.cloud.datastore.entity.Entity for saving into database.
     """
-    entity = datastore.entity.Entity(key=final_key)
+    from google.cloud.datastore.entity import Entity
+    entity = Entity(key=final_key)
+    set_index_fields(entity, index_puzzle)
+    entity['has_img'] = False
+    entity['has_clues'] = False
+    entity['has_solution'] = False
+    return entity
+
+
+def set_index_fields(entity, index_puzzle):
+    """
+    Copies the fields parsed from the index page onto an entity, along with their hash.
+
+    :param entity: google.cloud.datastore.entity.Entity representing a puzzle
+    :param index_puzzle: kakurizer_types.IndexPuzzle of the puzzle's metadata from index page
+    :returns: None
+    """
     entity['id'] = index_puzzle.id
     entity['timestamp_millis'] = index_puzzle.timestamp_millis
     entity['difficulty'] = index_puzzle.difficulty
     entity['page_url'] = index_puzzle.page_url
-    entity['has_img'] = False
-    entity['has_clues'] = False
-    entity['has_solution'] = False
-    return entity
\ No newline at end of file
+    entity['index_hash'] = index_hash(index_puzzle)
\ No newline at end of file
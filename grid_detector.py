@@ -0,0 +1,429 @@
+"""
+Detects the cell lattice of kakuro puzzles from their images and classifies
+each cell as blocked, clue or empty.
+
+Grid lines are found from row and column intensity projections rather than
+by examining individual pixels: a grid line is a thin band of rows (or
+columns) which is much darker than the rows a few pixels either side of it.
+Images of the same size are stacked so that projections for a whole batch
+are computed in single array operations, and cells are classified by
+sampling a fixed pattern of points from every cell at once.
+
+Puzzle images come in only a few sizes and layouts, so detected lattices are
+kept in a LayoutCache. The cache is only kept in memory unless an entry point
+calls persist_layouts to save it to disk between runs. An image is fingerprinted by
+its size and the extent of the grid in projections taken over every
+FINGERPRINT_STRIDE-th row and column, and a cached lattice is used if the lines
+visible in those projections agree with it. Only images with no matching
+layout need the full-resolution projections.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from kakurizer_types import CellType, GridGeometry
+
+DARK_THRESHOLD = 128 # Greyscale values below this count as ink when looking for lines
+LINE_HALF_WIDTH = 4 # Grid lines are assumed thinner than this many pixels
+LINE_MIN_SCORE = 0.3 # How much darker than its surroundings a row must be to be a line
+GRID_MIN_INK = 0.02 # Rows or columns with less ink than this are margin, not grid
+MIN_CELL_PIXELS = 8
+MIN_GRID_CELLS = 2
+SAMPLES_PER_CELL = 7 # Points sampled along each axis of a cell when classifying it
+SAMPLE_MARGIN = 0.2 # Fraction of the cell at each side left unsampled to avoid grid lines
+BLOCKED_MIN_DARKNESS = 0.25
+DIAGONAL_MIN_CONTRAST = 0.4
+LAYOUT_CACHE_PATH = os.environ.get("KAKURIZER_LAYOUT_CACHE",
+                                   os.path.expanduser("~/.kakurizer_layouts.json"))
+LAYOUT_CACHE_SIZE = 64 # Layouts kept, evicting the least recently used
+LAYOUT_CACHE_VERSION = 1 # Change to discard saved layouts when detection changes
+FINGERPRINT_STRIDE = 8 # Sample every this many pixels across the axis being projected
+LAYOUT_MIN_VISIBLE = 0.6 # Fraction of cached edges which must show as lines to reuse a layout,
+                         # above the half a lattice with twice the cells could show
+
+
+def detect_grid(image_bytes):
+    """
+    Finds the grid of a single puzzle image.
+
+    :param image_bytes: raw bytes making up the image
+    :returns: kakurizer_types.GridGeometry of the puzzle
+    :raises ValueError: if the image is unparseable or has no recognizable grid
+    """
+    geometry = detect_grids([image_bytes])[0]
+    if geometry is None:
+        raise ValueError("Cannot find grid in puzzle image")
+    return geometry
+
+
+def detect_grids(image_blobs):
+    """
+    Finds the grids of a batch of puzzle images. Images which share a size are
+    processed together.
+
+    :param image_blobs: List or tuple of raw image bytes
+    :returns: List of kakurizer_types.GridGeometry in the same order as the input,
+              with None for any image in which no grid could be found
+    """
+    return detect_grids_in_images(load_greyscale_batch(image_blobs))
+
+
+def detect_grids_in_images(images, cache=None):
+    """
+    Finds the grids of a batch of already decoded puzzle images, reusing cached
+    layouts where they match.
+
+    :param images: List of 2D numpy.ndarray greyscale images, or None for images to skip
+    :param cache: LayoutCache of known lattices, defaulting to the one shared by the module
+    :returns: List of kakurizer_types.GridGeometry in the same order as the input,
+              with None for any image in which no grid could be found
+    """
+    cache = LAYOUT_CACHE if cache is None else cache
+    results = [None] * len(images)
+    unmatched = [None] * len(images)
+    fingerprints = [None] * len(images)
+    for index, image in enumerate(images):
+        if image is None:
+            continue
+        fingerprints[index], row_profile, col_profile = sample_projections(image)
+        layout = cache.get(fingerprints[index])
+        reused = layout is not None \
+            and matches_lattice(line_scores(row_profile[None])[0], layout[0]) \
+            and matches_lattice(line_scores(col_profile[None])[0], layout[1])
+        cache.count(reused)
+        if reused:
+            cells = classify_cells(darkness(image), *layout)
+            results[index] = GridGeometry(layout[0], layout[1], cells)
+        else:
+            unmatched[index] = image
+
+    for indexes in group_by_shape(unmatched):
+        ink = np.stack([images[i] for i in indexes]) < DARK_THRESHOLD
+        row_profiles = ink.mean(axis=2)
+        col_profiles = ink.mean(axis=1)
+        row_scores = line_scores(row_profiles)
+        col_scores = line_scores(col_profiles)
+        for position, index in enumerate(indexes):
+            row_edges = find_lattice(row_scores[position], row_profiles[position])
+            col_edges = find_lattice(col_scores[position], col_profiles[position])
+            if row_edges is None or col_edges is None:
+                logging.getLogger().warning("No grid found in image at batch position %s", index)
+                continue
+            cells = classify_cells(darkness(images[index]), row_edges, col_edges)
+            results[index] = GridGeometry(row_edges, col_edges, cells)
+            if fingerprints[index] is not None:
+                cache.put(fingerprints[index], row_edges, col_edges)
+    cache.save()
+    return results
+
+
+def load_greyscale_batch(image_blobs):
+    """
+    Decodes a batch of images, logging and skipping any which can't be parsed.
+
+    :param image_blobs: List or tuple of raw image bytes
+    :returns: List of 2D numpy.ndarray greyscale images, with None for unparseable images
+    """
+    images = [None] * len(image_blobs)
+    for index, blob in enumerate(image_blobs):
+        try:
+            images[index] = load_greyscale(blob)
+        except ValueError:
+            logging.getLogger().warning("Skipping unparseable image at batch position %s", index)
+    return images
+
+
+def load_greyscale(image_bytes):
+    """
+    Decodes an image into a greyscale array.
+
+    :param image_bytes: raw bytes making up the image
+    :returns: 2D numpy.ndarray of uint8 intensities, 0 for black and 255 for white
+    :raises ValueError: if image bytes are unparseable
+    """
+    try:
+        return np.asarray(Image.open(BytesIO(image_bytes)).convert("L"))
+    except OSError:
+        raise ValueError("Cannot parse puzzle image")
+
+
+def darkness(image):
+    """
+    :param image: 2D numpy.ndarray of uint8 greyscale intensities
+    :returns: 2D numpy.ndarray of floats, 0.0 for white and 1.0 for black
+    """
+    return 1.0 - image.astype(np.float32) / 255.0
+
+
+def sample_projections(image):
+    """
+    Projects an image onto each axis using only every FINGERPRINT_STRIDE-th pixel
+    across the axis, and fingerprints its layout from them. Grid borders are
+    lines crossing the whole grid, so the inked extent of these projections
+    depends on the layout but not on which cells are shaded.
+
+    :param image: 2D numpy.ndarray of uint8 greyscale intensities
+    :returns: Tuple of (fingerprint string or None if there is no ink,
+              1D numpy.ndarray of mean ink per row, 1D numpy.ndarray of mean ink per column)
+    """
+    row_profile = (image[:, ::FINGERPRINT_STRIDE] < DARK_THRESHOLD).mean(axis=1)
+    col_profile = (image[::FINGERPRINT_STRIDE, :] < DARK_THRESHOLD).mean(axis=0)
+    rows = np.flatnonzero(row_profile > GRID_MIN_INK)
+    cols = np.flatnonzero(col_profile > GRID_MIN_INK)
+    if len(rows) == 0 or len(cols) == 0:
+        return None, row_profile, col_profile
+    extents = np.array([rows[0], rows[-1], cols[0], cols[-1]], dtype=np.int32)
+    digest = hashlib.blake2b(extents.tobytes(), digest_size=8).hexdigest()
+    return "%dx%d:%s" % (image.shape[1], image.shape[0], digest), row_profile, col_profile
+
+
+def matches_lattice(scores, edges):
+    """
+    Checks a cached lattice against the lines found along one axis of an image.
+    Every line found must lie on a cached edge, which rules out lattices with too
+    few cells, and most cached edges must show as lines, which rules out lattices
+    with too many.
+
+    :param scores: 1D numpy.ndarray of line scores for one axis
+    :param edges: 1D numpy.ndarray of cached cell edge positions along the same axis
+    :returns: True if the lattice fits the image
+    """
+    lines = np.flatnonzero(scores > LINE_MIN_SCORE)
+    if len(lines) == 0:
+        return False
+    distances = np.abs(lines[:, None] - edges[None, :])
+    if distances.min(axis=1).max() > LINE_HALF_WIDTH:
+        return False
+    return (distances.min(axis=0) <= LINE_HALF_WIDTH).mean() >= LAYOUT_MIN_VISIBLE
+
+
+def group_by_shape(images):
+    """
+    :param images: List of 2D numpy.ndarray, or None for images which failed to load
+    :returns: List of lists of indexes into images, one list per distinct shape
+    """
+    groups = {}
+    for index, image in enumerate(images):
+        if image is not None:
+            groups.setdefault(image.shape, []).append(index)
+    return list(groups.values())
+
+
+def line_scores(profiles):
+    """
+    Scores each position of a batch of projections by how much darker it is than
+    the positions LINE_HALF_WIDTH either side. Thin dark lines score highly, while
+    broad dark areas such as runs of blocked cells score close to zero.
+
+    :param profiles: 2D numpy.ndarray of shape (images, positions) with mean ink per row or column
+    :returns: 2D numpy.ndarray of the same shape with the line score for each position
+    """
+    length = profiles.shape[1]
+    padded = np.pad(profiles, ((0, 0), (LINE_HALF_WIDTH, LINE_HALF_WIDTH)))
+    before = padded[:, :length]
+    after = padded[:, 2 * LINE_HALF_WIDTH:]
+    return profiles - np.maximum(before, after)
+
+
+def find_lattice(scores, profile):
+    """
+    Turns the line scores for one axis of an image into evenly spaced cell edges.
+    Lines which are missing from the projection (for instance between two blocked
+    cells, or along the border of a row of blocked cells) are filled in from the
+    spacing of the lines which were found, out to the edges of the inked area.
+
+    :param scores: 1D numpy.ndarray of line scores for one axis
+    :param profile: 1D numpy.ndarray of mean ink for each position on the same axis
+    :returns: 1D numpy.ndarray of float edge positions, or None if there is no lattice
+    """
+    positions = np.flatnonzero(scores > LINE_MIN_SCORE)
+    if len(positions) == 0:
+        return None
+    breaks = np.flatnonzero(np.diff(positions) > 1)
+    starts = positions[np.r_[0, breaks + 1]]
+    ends = positions[np.r_[breaks, len(positions) - 1]]
+    centres = (starts + ends) / 2.0
+    if len(centres) < 2:
+        return None
+    spacing = np.median(np.diff(centres))
+    if spacing < MIN_CELL_PIXELS:
+        return None
+    inked = np.flatnonzero(profile > GRID_MIN_INK)
+    first = centres[0] - spacing * round((centres[0] - inked[0]) / spacing)
+    last = centres[-1] + spacing * round((inked[-1] - centres[-1]) / spacing)
+    count = int(round((last - first) / spacing))
+    if count < MIN_GRID_CELLS:
+        return None
+    return np.linspace(first, last, count + 1)
+
+
+def cell_sample_points(edges):
+    """
+    :param edges: 1D numpy.ndarray of cell edge positions along one axis
+    :returns: 2D numpy.ndarray of shape (cells, SAMPLES_PER_CELL) of pixel coordinates
+              spread across the interior of each cell
+    """
+    fractions = np.linspace(SAMPLE_MARGIN, 1.0 - SAMPLE_MARGIN, SAMPLES_PER_CELL)
+    return np.rint(edges[:-1, None] + np.diff(edges)[:, None] * fractions).astype(np.intp)
+
+
+def classify_cells(dark, row_edges, col_edges):
+    """
+    Classifies every cell of a grid. Clue cells are recognized by the inked diagonal
+    line that splits them, which stands out against the cell's shading; the
+    remaining cells are blocked if shaded and empty otherwise.
+
+    :param dark: 2D numpy.ndarray of darkness values for the whole image
+    :param row_edges: 1D numpy.ndarray of horizontal cell edge positions
+    :param col_edges: 1D numpy.ndarray of vertical cell edge positions
+    :returns: 2D numpy.ndarray of uint8 kakurizer_types.CellType values, one per cell
+    """
+    ys = cell_sample_points(row_edges)
+    xs = cell_sample_points(col_edges)
+    samples = dark[ys[:, None, :, None], xs[None, :, None, :]]
+
+    offsets = np.arange(SAMPLES_PER_CELL)
+    away_from_diagonal = np.abs(offsets[:, None] - offsets[None, :]) >= 2
+    background = np.median(samples[..., away_from_diagonal], axis=-1)
+
+    # Allow a pixel of slack either side, as the diagonal is only a line or two thick
+    max_x = dark.shape[1] - 1
+    diagonal = np.max([dark[ys[:, None, :], np.clip(xs[None, :, :] + shift, 0, max_x)]
+                       for shift in (-1, 0, 1)], axis=0).mean(axis=-1)
+
+    cells = np.full(background.shape, CellType.EMPTY.value, dtype=np.uint8)
+    cells[background > BLOCKED_MIN_DARKNESS] = CellType.BLOCKED.value
+    cells[np.abs(diagonal - background) > DIAGONAL_MIN_CONTRAST] = CellType.CLUE.value
+    return cells
+
+
+class LayoutCache:
+    """
+    Least recently used cache of grid lattices by image fingerprint, optionally
+    loaded from and saved to a JSON file. Safe to share between threads.
+    """
+
+    def __init__(self, path=None, max_entries=LAYOUT_CACHE_SIZE):
+        """
+        :param path: File the layouts are kept in, or None to keep them only in memory
+        :param max_entries: Number of layouts to keep
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.layouts = None # Loaded on first use
+        self.changed = False
+        self.hits = 0 # Images which reused a cached layout
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, fingerprint):
+        """
+        :param fingerprint: Image fingerprint from sample_projections, or None
+        :returns: Tuple of (row edges, col edges) as 1D numpy.ndarray, or None if not cached
+        """
+        with self.lock:
+            self.load()
+            layout = self.layouts.get(fingerprint)
+            if layout is None:
+                return None
+            self.layouts.move_to_end(fingerprint)
+            return np.array(layout[0]), np.array(layout[1])
+
+
+    def count(self, reused):
+        """
+        Records whether an image could reuse a cached layout.
+
+        :param reused: True if a cached layout matched the image
+        :returns: None
+        """
+        with self.lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+    def put(self, fingerprint, row_edges, col_edges):
+        """
+        Records the lattice found for a fingerprint, evicting the least recently used
+        layout if the cache is full.
+
+        :param fingerprint: Image fingerprint from sample_projections
+        :param row_edges: 1D numpy.ndarray of horizontal cell edge positions
+        :param col_edges: 1D numpy.ndarray of vertical cell edge positions
+        :returns: None
+        """
+        with self.lock:
+            self.load()
+            self.layouts[fingerprint] = (row_edges.tolist(), col_edges.tolist())
+            self.layouts.move_to_end(fingerprint)
+            while len(self.layouts) > self.max_entries:
+                self.layouts.popitem(last=False)
+            self.changed = True
+
+
+    def load(self):
+        """
+        Reads saved layouts if they haven't been read yet, starting empty if the
+        file is missing, unreadable or from another version. Called with the lock held.
+        """
+        if self.layouts is not None:
+            return
+        self.layouts = OrderedDict()
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as cache_file:
+                saved = json.load(cache_file)
+            if saved.get("version") == LAYOUT_CACHE_VERSION:
+                self.layouts.update((fingerprint, tuple(layout))
+                                    for fingerprint, layout in saved["layouts"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            logging.getLogger().info("Starting with no saved grid layouts")
+
+
+    def save(self):
+        """
+        Writes the layouts, most recently used last, if any were added since the
+        last save. The file is replaced atomically, and failing to write it only
+        loses the layouts for later runs.
+
+        :returns: None
+        """
+        with self.lock:
+            if not self.changed or self.path is None:
+                return
+            temp_path = "%s.%s.tmp" % (self.path, os.getpid())
+            try:
+                with open(temp_path, "w") as cache_file:
+                    json.dump({"version": LAYOUT_CACHE_VERSION,
+                               "layouts": [[fingerprint, layout]
+                                           for fingerprint, layout in self.layouts.items()]},
+                              cache_file)
+                os.replace(temp_path, self.path)
+            except OSError as error:
+                logging.getLogger().warning("Cannot save grid layouts: %s", error)
+            self.changed = False
+
+
+LAYOUT_CACHE = LayoutCache() # Used when no cache is passed in, kept in memory only
+
+def persist_layouts(path=LAYOUT_CACHE_PATH):
+    """
+    Makes the shared layout cache load from and save to a file. Only called by
+    entry points, so that imports and tests never read or write the saved layouts.
+
+    :param path: File the layouts are kept in
+    :returns: None
+    """
+    with LAYOUT_CACHE.lock:
+        LAYOUT_CACHE.path = path
+        LAYOUT_CACHE.layouts = None
@@ -0,0 +1,241 @@
+#!/usr/local/bin/python3
+
+"""
+Reads and writes packed archives of puzzle images for batch jobs, which can
+then look up any image by puzzle ID without a datastore call per image.
+
+The images are stored back to back in one contiguous region, followed by a
+fixed-width index of (puzzle ID, offset, length) entries sorted by puzzle ID.
+A reader memory-maps the file and binary searches the index in place, so
+opening an archive reads nothing up front and every image is returned as a
+memoryview slice of the mapping without being copied. Worker processes which
+each open the same archive share its pages through the operating system's page
+cache rather than each holding their own copy of the images.
+
+File layout:
+    header (MAGIC, version byte, image count, index offset)
+    blob region
+    index entries sorted by puzzle ID
+"""
+
+import argparse
+import bisect
+import mmap
+import os
+import struct
+
+MAGIC = b"KKRI"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sB3xQQ")
+INDEX_ENTRY = struct.Struct("<qQI") # Puzzle ID, offset of image in file, length of image
+
+
+class ArchiveWriter:
+    """
+    Writes images to a packed archive file, in any order of puzzle ID.
+    Use as a context manager, so that the index and header are written once every
+    image has been, and an archive left incomplete by an error is removed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "wb")
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, 0))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finished = False
+        try:
+            if exc_type is None:
+                self.finish()
+                finished = True
+        finally:
+            self.file.close()
+            if not finished:
+                os.remove(self.path)
+
+    def add(self, puzzle_id, blob):
+        """
+        Appends one image to the blob region.
+
+        :param puzzle_id: ID of the puzzle the image belongs to
+        :param blob: bytes of the image
+        :returns: None
+        """
+        self.entries.append((puzzle_id, self.file.tell(), len(blob)))
+        self.file.write(blob)
+
+    def finish(self):
+        """
+        Writes the sorted index after the blob region, then fills in the header.
+
+        :raises ValueError: if two images were added for the same puzzle ID
+        """
+        self.entries.sort()
+        for previous, entry in zip(self.entries, self.entries[1:]):
+            if previous[0] == entry[0]:
+                raise ValueError("Puzzle " + str(entry[0]) + " added to archive twice")
+        index_offset = self.file.tell()
+        for entry in self.entries:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.entries), index_offset))
+
+
+class ImageArchive:
+    """
+    Memory-mapped reader for an archive written by ArchiveWriter. Images are
+    returned as read-only memoryview slices of the mapping, which stay valid
+    until the archive is closed; anything kept longer should be copied with bytes().
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Location of an archive file
+        :raises ValueError: if the file is not an image archive or is truncated
+        """
+        self.path = path
+        with open(path, "rb") as archive_file:
+            size = os.fstat(archive_file.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError("Not an image archive: " + str(path))
+            self.map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.index_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError("Not an image archive: " + str(path))
+        if version != FORMAT_VERSION:
+            self.map.close()
+            raise ValueError("Unsupported image archive version " + str(version))
+        if self.index_offset + self.count * INDEX_ENTRY.size > size:
+            self.map.close()
+            raise ValueError("Truncated image archive: " + str(path))
+        self.view = memoryview(self.map)
+        self.ids = IndexColumn(self.map, self.index_offset, self.count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, puzzle_id):
+        return self.find(puzzle_id) is not None
+
+    def __getitem__(self, puzzle_id):
+        image = self.get(puzzle_id)
+        if image is None:
+            raise KeyError(puzzle_id)
+        return image
+
+    def get(self, puzzle_id):
+        """
+        :param puzzle_id: ID of a puzzle
+        :returns: memoryview of the puzzle's image, or None if the archive doesn't have it
+        """
+        position = self.find(puzzle_id)
+        if position is None:
+            return None
+        return self.image_at(position)[1]
+
+    def items(self):
+        """
+        :returns: Generator of (puzzle ID, memoryview of image) in order of puzzle ID
+        """
+        for position in range(self.count):
+            yield self.image_at(position)
+
+    def find(self, puzzle_id):
+        """
+        :returns: Position of the puzzle in the index, or None if it isn't there
+        """
+        position = bisect.bisect_left(self.ids, puzzle_id)
+        if position < self.count and self.ids[position] == puzzle_id:
+            return position
+        return None
+
+    def image_at(self, position):
+        """
+        :returns: Tuple of (puzzle ID, memoryview of image) for a position in the index
+        """
+        puzzle_id, offset, length = INDEX_ENTRY.unpack_from(
+            self.map, self.index_offset + position * INDEX_ENTRY.size)
+        return puzzle_id, self.view[offset: offset + length]
+
+    def close(self):
+        """
+        Unmaps the archive. If slices are still in use, the mapping is instead
+        released once the last of them is garbage collected.
+        """
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+
+
+class IndexColumn:
+    """
+    Sequence of the puzzle IDs in an archive's index, read directly from the
+    mapping so that bisect can search the index without loading it.
+    """
+
+    def __init__(self, archive_map, index_offset, count):
+        self.map = archive_map
+        self.index_offset = index_offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        return INDEX_ENTRY.unpack_from(self.map, self.index_offset + position * INDEX_ENTRY.size)[0]
+
+
+ARCHIVE = None # Archive opened in this worker process by init_worker
+
+def init_worker(path):
+    """
+    Pool initializer which opens an archive once in each worker process, e.g.
+    multiprocessing.Pool(initializer=image_archive.init_worker, initargs=(path,)).
+    Tasks then pass puzzle IDs rather than images, and look them up with worker_image.
+
+    :param path: Location of an archive file
+    """
+    global ARCHIVE
+    ARCHIVE = ImageArchive(path)
+
+
+def worker_image(puzzle_id):
+    """
+    :param puzzle_id: ID of a puzzle
+    :returns: memoryview of the puzzle's image in the worker's archive
+    :raises KeyError: if the archive has no image for the puzzle
+    """
+    return ARCHIVE[puzzle_id]
+
+
+def main():
+    """
+    Command line entry point to export every stored image to an archive.
+    """
+    import logger
+    from datastore_client import DatastoreClient
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="Archive file to write")
+    args = parser.parse_args()
+
+    logger.setup_logger()
+    DatastoreClient().export_images(args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,18 +2,24 @@
 
 """
 Finds new puzzles in the database and updates them with image details.
+
+bs4 and PIL are imported where they are first needed to keep start up fast. All
+requests go through rate_limiter so that concurrent workers share each host's budget.
 """
 
 import logging
 import re
 from io import BytesIO
-import requests
-import bs4
-from PIL import Image
 import logger
+import rate_limiter
 from datastore_client import DatastoreClient
 from kakurizer_types import ImageMetadata
 
+# Narrowest image wanted, which gives cells large enough for clue_reader to read
+# the digits in grids of up to 12 columns
+TARGET_WIDTH = 480
+SIZES_LENGTH = re.compile(r"(\d+(?:\.\d+)?)px\s*$")
+
 def find():
     """
     Updates all puzzles in the database for which we don't yet have an image.
@@ -24,23 +30,26 @@ def find():
         update_puzzle_with_image(datastore, entity)
 
 
-def update_puzzle_with_image(datastore, entity):
+def update_puzzle_with_image(datastore, entity, target_width=TARGET_WIDTH):
     """
     Updates existing database entity with details of the puzzle image and saves an update.
 
     :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
     :param entity: the database entry to be updated
+    :param target_width: Narrowest image wanted, in pixels
     :returns: None
     """
-    logging.getLogger().info("Finding image for puzzle %s", entity['id'])
-    url = __extract_img_url(entity)
+    logging.getLogger(logger.PUZZLE_LOGGER).info("Finding image for puzzle %s", entity['id'],
+                                                 extra={"puzzle_id": entity['id']})
+    url, source_width = __extract_img_url(entity, target_width)
     blob = __get_img_blob(url)
     metadata = __get_img_metadata(blob)
 
     entity['has_img'] = True
     entity['img_url'] = url
+    entity['img_source_width'] = source_width
     entity['img_blob'] = blob
-    entity.exclude_from_indexes = ('img_blob',)
+    entity.exclude_from_indexes = set(entity.exclude_from_indexes) | {'img_blob'}
     entity['img_width'] = metadata.width
     entity['img_height'] = metadata.height
     entity['img_format'] = metadata.format
@@ -48,25 +57,114 @@ def update_puzzle_with_image(datastore, entity):
     datastore.update(entity)
 
 
-def __extract_img_url(entity):
+def __extract_img_url(entity, target_width):
     """
-    Extracts the URL pointing to the puzzle image for a given puzzle.
+    Extracts the URL pointing to the puzzle image for a given puzzle, choosing the
+    smallest rendition at least target_width wide, or the widest if none are.
 
     :param entity: database entry representing a puzzle
-    :returns: url as a string pointing to the image
-    :raises ValueError: if there are no
+    :param target_width: Narrowest image wanted, in pixels
+    :returns: Tuple of url as a string pointing to the image, and the image's width
+              according to the page (None if the page doesn't say)
+    :raises ValueError: if there are no image URLs on the page
     """
-    puzzle_page = requests.get(entity['page_url'])
+    import bs4
+    puzzle_page = rate_limiter.get(entity['page_url'])
     puzzle_html = bs4.BeautifulSoup(puzzle_page.text, "html.parser")
-    sources = puzzle_html.find_all("source")
-    widest_sources = sorted(sources, key=lambda x: x.attrs['sizes'], reverse=True)
-    try:
-        raw_url = widest_sources[0].attrs['srcset']
-        url = re.search("([^ ]*) .*", raw_url).group(1).replace("&amp;", "&")
-        return url
-    except IndexError:
-        raise ValueError("No possible image URLs found for puzzle " + str(entity['id']) 
+    candidates = [candidate for source in puzzle_html.find_all("source")
+                  for candidate in source_candidates(source.attrs.get('srcset', ""),
+                                                     source.attrs.get('sizes', ""))]
+    if not candidates:
+        raise ValueError("No possible image URLs found for puzzle " + str(entity['id'])
             + " on page " + entity['page_url'])
+    url, width = choose_candidate(candidates, target_width)
+    return url.replace("&amp;", "&"), width
+
+
+def choose_candidate(candidates, target_width):
+    """
+    :param candidates: List of (url, width or None) image candidates
+    :param target_width: Narrowest image wanted, in pixels
+    :returns: The narrowest candidate at least target_width wide, or else the widest,
+              or the first candidate if none have a known width
+    """
+    sized = [candidate for candidate in candidates if candidate[1] is not None]
+    if not sized:
+        return candidates[0]
+    wide_enough = [candidate for candidate in sized if candidate[1] >= target_width]
+    if wide_enough:
+        return min(wide_enough, key=lambda candidate: candidate[1])
+    return max(sized, key=lambda candidate: candidate[1])
+
+
+def source_candidates(srcset, sizes):
+    """
+    Works out the width of each image in a srcset attribute. Width descriptors (640w)
+    give it directly, while density descriptors (2x), or no descriptor, are scaled
+    from the display width in the sizes attribute.
+
+    :param srcset: Value of a srcset attribute
+    :param sizes: Value of the matching sizes attribute
+    :returns: List of (url, width in pixels or None if unknown)
+    """
+    display_width = parse_sizes(sizes)
+    candidates = []
+    for url, descriptors in parse_srcset(srcset):
+        width = None
+        density = 1.0
+        for descriptor in descriptors:
+            try:
+                if descriptor.endswith("w"):
+                    width = int(descriptor[:-1])
+                elif descriptor.endswith("x"):
+                    density = float(descriptor[:-1])
+            except ValueError:
+                pass # Ignore invalid descriptors, as browsers do
+        if width is None and display_width is not None:
+            width = int(display_width * density)
+        candidates.append((url, width))
+    return candidates
+
+
+def parse_srcset(srcset):
+    """
+    Splits a srcset attribute into its image candidates, following the HTML parsing
+    rules so that commas inside URLs are kept.
+
+    :param srcset: Value of a srcset attribute
+    :returns: List of (url, list of descriptor strings)
+    """
+    candidates = []
+    position = 0
+    length = len(srcset)
+    while position < length:
+        while position < length and (srcset[position].isspace() or srcset[position] == ","):
+            position += 1
+        start = position
+        while position < length and not srcset[position].isspace():
+            position += 1
+        url = srcset[start:position]
+        if not url:
+            break
+        if url.endswith(","):
+            candidates.append((url.rstrip(","), []))
+            continue
+        end = srcset.find(",", position)
+        if end == -1:
+            end = length
+        candidates.append((url, srcset[position:end].split()))
+        position = end + 1
+    return candidates
+
+
+def parse_sizes(sizes):
+    """
+    :param sizes: Value of a sizes attribute, a list of optional media conditions and lengths
+    :returns: Largest pixel length listed, or None if there are none
+    """
+    lengths = [float(match.group(1)) for match in
+               (SIZES_LENGTH.search(entry) for entry in sizes.split(",")) if match]
+    return max(lengths) if lengths else None
 
 
 def __get_img_blob(url):
@@ -86,7 +184,7 @@ def __get_img_blob(url):
      :param url: string url of the image's location
      :returns: image as a series of bytes
     """
-    img_request = requests.get(url)
+    img_request = rate_limiter.get(url)
     return img_request.content
 
 
@@ -97,6 +195,7 @@ def __get_img_metadata(image_bytes):
     :returns: named tuple with image width, height and format (jpg/gif/png/etc)
     :raises ValueError: if image bytes are unparseable
     """
+    from PIL import Image
     try:
         img = Image.open(BytesIO(image_bytes))
         width = img.width
@@ -108,4 +207,5 @@ def __get_img_metadata(image_bytes):
 
 
 if __name__ == "__main__":
-    find()
+    import profiling # Only needed when run as a script
+    profiling.main(find, __doc__.strip().splitlines()[0])
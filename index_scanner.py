@@ -2,16 +2,18 @@
 
 """
 Script to identify new Kakuro puzzles published by the Guardian.
+
+bs4 is imported where it is first needed, so that importing this module stays cheap.
 """
 
 import logging
-import requests
-import bs4
+import check
 import logger
+import rate_limiter
 from datastore_client import DatastoreClient
-from kakurizer_types import IndexPuzzle, Difficulty
+from kakurizer_types import IndexPuzzle, Difficulty, index_hash
 
-INDEX_URL = "https://www.theguardian.com/lifeandstyle/series/kakuro?page="
+INDEX_URL = check.INDEX_URL
 
 def scan():
     """
@@ -23,6 +25,50 @@ def scan():
     new_puzzles = get_new_puzzles(datastore)
     logging.getLogger().info("Found %s new puzzles", len(new_puzzles))
     datastore.put_index_puzzles(new_puzzles)
+    if new_puzzles:
+        check.save_last_seen(new_puzzles[0].id) # Puzzles are listed newest first
+
+
+def verify():
+    """
+    Re-reads the whole of the Guardian's index and saves any puzzles whose details
+    have changed since they were first scanned, such as a corrected difficulty.
+    """
+    logger.setup_logger()
+    datastore = DatastoreClient()
+    updated = verify_index(datastore)
+    logging.getLogger().info("Updated %s changed puzzles", updated)
+
+
+def verify_index(datastore, last_page=None):
+    """
+    Compares a hash of each puzzle on the index pages with the hash stored when it
+    was saved, and writes back only those which differ. Puzzles saved before
+    hashes were stored are written once to record their hash.
+
+    :param datastore: datastore_client.DatastoreClient for accessing Google Cloud datastore.
+    :param last_page: If set, stop after this index page rather than at the end of the index
+    :returns: Number of puzzles updated
+    """
+    page_number = 1
+    changes = []
+    updated = 0
+    while last_page is None or page_number <= last_page:
+        logging.getLogger().info("Verifying puzzles from page %s", str(page_number))
+        page_puzzles = parse_index(get_index(INDEX_URL, page_number))
+        if not page_puzzles:
+            break
+        ids = [puzzle.id for puzzle in page_puzzles]
+        stored = datastore.get_index_hashes(min(ids), max(ids))
+        changes += [(stored[puzzle.id][0], puzzle) for puzzle in page_puzzles
+                    if puzzle.id in stored and stored[puzzle.id][1] != index_hash(puzzle)]
+        if len(changes) >= datastore.MAX_PUT_SIZE:
+            updated += len(datastore.update_index_puzzles(changes))
+            changes = []
+        page_number += 1
+    if changes:
+        updated += len(datastore.update_index_puzzles(changes))
+    return updated
 
 
 def get_new_puzzles(datastore):
@@ -61,7 +107,7 @@ def get_index(url, page):
     :param page: Number of page to be loaded
     :returns: HTML content of specified index page
     """
-    response = requests.get(url + str(page))
+    response = rate_limiter.get(url + str(page))
     return response.text
 
 
@@ -73,6 +119,7 @@ def parse_index(html):
     :param html: String containing HTML content of index page
     :returns: Tuple of kakurizer_types.IndexPuzzle, each representing one puzzle from the page
     """
+    import bs4
     page = bs4.BeautifulSoup(html, "html.parser")
     all_sections = page.find_all("section")
     puzzle_sections = (section for section in all_sections if is_puzzle(section))
@@ -86,6 +133,7 @@ def is_puzzle(section):
     :param section: bs4.element.Tag representing a <section> element
     :returns: True if and only if this section tag relates to a puzzle
     """
+    import bs4
     return (isinstance(section, bs4.element.Tag)
             and section.name == "section"
             and 'id' in section.attrs)
@@ -181,5 +229,19 @@ def get_difficulty(section):
         raise ValueError("Unable to find difficulty in title text")
 
 
+def main():
+    """
+    Command line entry point to scan for new puzzles, or verify existing ones.
+    """
+    import argparse
+    import profiling # Only needed when run as a script
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--verify", action="store_true",
+                        help="Re-read the whole index and save puzzles whose details changed")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.run(verify if args.verify else scan, args)
+
+
 if __name__ == "__main__":
-    scan()
+    main()
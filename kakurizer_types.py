@@ -5,6 +5,8 @@ various stages of the processing pipeline.
 
 from enum import Enum
 import collections
+import hashlib
+import struct
 
 IndexPuzzle = collections.namedtuple('IndexPuzzle',
                                      ['id', 'timestamp_millis', 'page_url', 'difficulty'])
@@ -12,6 +14,25 @@ IndexPuzzle = collections.namedtuple('IndexPuzzle',
 ImageMetadata = collections.namedtuple('ImageMetadata',
                                        ['width', 'height', 'format'])
 
+GridGeometry = collections.namedtuple('GridGeometry',
+                                      ['row_edges', 'col_edges', 'cells'])
+
+PuzzleAnalysis = collections.namedtuple('PuzzleAnalysis',
+                                        ['solutions', 'propagations', 'branches',
+                                         'max_depth', 'score'])
+
+INDEX_HASH_BYTES = 8
+
+GRID_FORMAT_VERSION = 1
+SOLUTION_FORMAT_VERSION = 1
+ENCODING_HEADER = struct.Struct("<BHH") # Format version, grid height, grid width
+
+# Lookup tables for bytes.translate, to pack and unpack two digits per byte
+# without creating a Python object per digit
+HIGH_NIBBLE_SHIFT = bytes((value << 4) & 0xFF for value in range(256))
+HIGH_NIBBLE = bytes(value >> 4 for value in range(256))
+LOW_NIBBLE = bytes(value & 0x0F for value in range(256))
+
 class Difficulty(Enum):
     """
     Defines the valid difficulty levels that a puzzle can be.
@@ -19,3 +40,159 @@ class Difficulty(Enum):
     EASY = 1
     MEDIUM = 2
     HARD = 3
+
+
+class CellType(Enum):
+    """
+    Defines the kinds of cell found in a kakuro grid.
+    """
+    EMPTY = 0
+    BLOCKED = 1
+    CLUE = 2
+
+
+class PuzzleGrid:
+    """
+    Clue structure of a puzzle. Cells, across and down are bytes with one value per
+    cell in row-major order: the CellType value of the cell, and its across and
+    down clue sums (0 where a cell has no clue in that direction).
+    """
+
+    __slots__ = ('height', 'width', 'cells', 'across', 'down')
+
+    def __init__(self, height, width, cells, across, down):
+        """
+        :raises ValueError: if any of cells, across or down has the wrong length
+        """
+        self.height = height
+        self.width = width
+        self.cells = bytes(cells)
+        self.across = bytes(across)
+        self.down = bytes(down)
+        size = height * width
+        if not len(self.cells) == len(self.across) == len(self.down) == size:
+            raise ValueError("Grid data doesn't match grid size " + str(height) + "x" + str(width))
+
+    def __eq__(self, other):
+        return (isinstance(other, PuzzleGrid)
+                and (self.height, self.width, self.cells, self.across, self.down)
+                == (other.height, other.width, other.cells, other.across, other.down))
+
+    def __repr__(self):
+        return "PuzzleGrid(height=%r, width=%r, cells=%r, across=%r, down=%r)" % (
+            self.height, self.width, self.cells, self.across, self.down)
+
+    def encode(self):
+        """
+        :returns: bytes of the version header followed by the cells, across and down planes
+        """
+        return (ENCODING_HEADER.pack(GRID_FORMAT_VERSION, self.height, self.width)
+                + self.cells + self.across + self.down)
+
+    @classmethod
+    def decode(cls, data):
+        """
+        :param data: bytes produced by PuzzleGrid.encode
+        :returns: PuzzleGrid
+        :raises ValueError: if the data is from an unknown version or is the wrong length
+        """
+        height, width = decode_header(data, GRID_FORMAT_VERSION)
+        size = height * width
+        start = ENCODING_HEADER.size
+        if len(data) != start + 3 * size:
+            raise ValueError("Grid data is the wrong length for its size")
+        return cls(height, width, data[start: start + size],
+                   data[start + size: start + 2 * size], data[start + 2 * size:])
+
+
+class Solution:
+    """
+    Solved digits of a puzzle, packed two to a byte in row-major order with 0 for
+    cells which aren't filled in.
+    """
+
+    __slots__ = ('height', 'width', 'packed')
+
+    def __init__(self, height, width, packed):
+        """
+        :raises ValueError: if the packed digits have the wrong length
+        """
+        self.height = height
+        self.width = width
+        self.packed = bytes(packed)
+        if len(self.packed) != (height * width + 1) // 2:
+            raise ValueError("Solution data doesn't match grid size")
+
+    def __eq__(self, other):
+        return (isinstance(other, Solution)
+                and (self.height, self.width, self.packed)
+                == (other.height, other.width, other.packed))
+
+    def __repr__(self):
+        return "Solution(height=%r, width=%r, digits=%r)" % (
+            self.height, self.width, self.digits)
+
+    @classmethod
+    def from_digits(cls, height, width, digits):
+        """
+        :param digits: bytes or sequence of ints from 0 to 9, one per cell in row-major order
+        :returns: Solution
+        """
+        digits = bytes(digits)
+        if len(digits) % 2:
+            digits += b"\x00"
+        high = digits[0::2].translate(HIGH_NIBBLE_SHIFT)
+        # Each high byte has an empty low nibble, so OR-ing the bytes as one big
+        # integer combines every pair of digits at once
+        packed = int.from_bytes(high, "big") | int.from_bytes(digits[1::2], "big")
+        return cls(height, width, packed.to_bytes(len(high), "big"))
+
+    @property
+    def digits(self):
+        """
+        :returns: bytes with one digit per cell in row-major order
+        """
+        unpacked = bytearray(2 * len(self.packed))
+        unpacked[0::2] = self.packed.translate(HIGH_NIBBLE)
+        unpacked[1::2] = self.packed.translate(LOW_NIBBLE)
+        return bytes(unpacked[:self.height * self.width])
+
+    def encode(self):
+        """
+        :returns: bytes of the version header followed by the packed digits
+        """
+        return ENCODING_HEADER.pack(SOLUTION_FORMAT_VERSION, self.height, self.width) + self.packed
+
+    @classmethod
+    def decode(cls, data):
+        """
+        :param data: bytes produced by Solution.encode
+        :returns: Solution
+        :raises ValueError: if the data is from an unknown version or is the wrong length
+        """
+        height, width = decode_header(data, SOLUTION_FORMAT_VERSION)
+        return cls(height, width, data[ENCODING_HEADER.size:])
+
+
+def decode_header(data, expected_version):
+    """
+    :param data: bytes starting with an encoding header
+    :param expected_version: Format version the data must have
+    :returns: Tuple of (height, width)
+    :raises ValueError: if the header is missing or has a different version
+    """
+    if len(data) < ENCODING_HEADER.size:
+        raise ValueError("Encoded data is too short")
+    version, height, width = ENCODING_HEADER.unpack_from(data)
+    if version != expected_version:
+        raise ValueError("Unsupported encoding version " + str(version))
+    return height, width
+
+
+def index_hash(index_puzzle):
+    """
+    :param index_puzzle: IndexPuzzle parsed from an index page
+    :returns: Hex string hash of all of the puzzle's fields, which changes if any of them do
+    """
+    content = "\x1f".join(str(field) for field in index_puzzle)
+    return hashlib.blake2b(content.encode(), digest_size=INDEX_HASH_BYTES).hexdigest()
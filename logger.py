@@ -1,20 +1,156 @@
 """
 Convenience module to initalize logging output in a common format for use
 in various related scripts.
+
+Log records are handed to a background thread through a queue, so formatting and
+writing to std out never holds up the thread doing the work. Messages about
+individual puzzles go to PUZZLE_LOGGER, which can be sampled or rate limited so
+that large runs don't produce a line for every puzzle.
+
+Options can also be set from the environment, so every script picks them up:
+    KAKURIZER_LOG_JSON=1       write one JSON object per line
+    KAKURIZER_LOG_SAMPLE=n     keep one in every n puzzle messages
+    KAKURIZER_LOG_RATE=n       keep at most n puzzle messages per second
 """
 
-import sys
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+PUZZLE_LOGGER = "kakurizer.puzzle"
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 
-def setup_logger():
+# Attributes present on every LogRecord, so anything else was passed in extra
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_installed = None # (queue handler, listener, puzzle filter) from the last setup
+
+
+def setup_logger(json_output=None, sample_every=None, max_per_second=None):
     """
     Initializes logging to print INFO level messages to std out.
-    Should be called from main() at start of script.
+    Should be called from main() at start of script. Calling it again replaces
+    the previous setup rather than adding to it.
+
+    :param json_output: If True, write each record as a JSON object rather than text
+    :param sample_every: Only keep one in this many puzzle messages
+    :param max_per_second: Keep at most this many puzzle messages each second
+    :returns: None
     """
+    if json_output is None:
+        json_output = os.environ.get("KAKURIZER_LOG_JSON", "") not in ("", "0")
+    if sample_every is None:
+        sample_every = int(os.environ.get("KAKURIZER_LOG_SAMPLE", 1))
+    if max_per_second is None and os.environ.get("KAKURIZER_LOG_RATE"):
+        max_per_second = float(os.environ["KAKURIZER_LOG_RATE"])
+
+    shutdown_logger()
+    global _installed
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(JsonFormatter() if json_output else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+    listener.start()
+
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    steam_handler = logging.StreamHandler(sys.stdout)
-    steam_handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    steam_handler.setFormatter(formatter)
-    logger.addHandler(steam_handler)
+    logger.addHandler(queue_handler)
+    puzzle_filter = PuzzleFilter(sample_every, max_per_second)
+    logging.getLogger(PUZZLE_LOGGER).addFilter(puzzle_filter)
+    _installed = (queue_handler, listener, puzzle_filter)
+
+
+def shutdown_logger():
+    """
+    Writes out any queued records and removes the handler added by setup_logger.
+    Registered to run at exit, so scripts don't need to call it themselves.
+    """
+    global _installed
+    if _installed is None:
+        return
+    queue_handler, listener, puzzle_filter = _installed
+    _installed = None
+    logging.getLogger().removeHandler(queue_handler)
+    logging.getLogger(PUZZLE_LOGGER).removeFilter(puzzle_filter)
+    listener.stop()
+
+
+atexit.register(shutdown_logger)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records unformatted. The standard QueueHandler formats the message and
+    traceback on the calling thread and drops exc_info, so the listener's
+    formatter would never see the exception.
+    """
+
+    def prepare(self, record):
+        return copy.copy(record)
+
+
+class PuzzleFilter(logging.Filter):
+    """
+    Thins out per-puzzle messages by sampling and rate limiting. Warnings and
+    errors are always kept.
+    """
+
+    def __init__(self, sample_every=1, max_per_second=None):
+        """
+        :param sample_every: Only keep one in this many messages
+        :param max_per_second: Keep at most this many messages each second, or None for no limit
+        """
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self.max_per_second = max_per_second
+        self.lock = threading.Lock()
+        self.seen = 0
+        self.window = 0
+        self.window_count = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self.lock:
+            self.seen += 1
+            if self.seen % self.sample_every:
+                return False
+            if self.max_per_second is None:
+                return True
+            window = int(time.monotonic())
+            if window != self.window:
+                self.window, self.window_count = window, 0
+            if self.window_count >= self.max_per_second:
+                return False
+            self.window_count += 1
+            return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single line JSON object, including any values
+    passed to the logging call in extra.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items()
+                     if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
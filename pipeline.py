@@ -0,0 +1,223 @@
+#!/usr/local/bin/python3
+
+"""
+Runs every stage of the pipeline in a single process, passing new puzzles
+straight from one stage to the next instead of through the database:
+
+    scan index -> find image -> read clues -> solve
+
+Each stage has its own pool of worker threads reading from a bounded queue,
+so a slow stage holds back the stages before it rather than letting work pile
+up in memory. Every stage still saves its results, so a puzzle which fails part
+way through is picked up by the standalone scripts later. Workers log and skip
+puzzles which fail for any reason, since a worker which died would leave the
+queue before it to fill up and block the whole pipeline.
+"""
+
+import argparse
+import logging
+import queue
+import threading
+import time
+import check
+import logger
+import clue_reader
+import grid_detector
+import img_finder
+import index_scanner
+import solver
+from datastore_client import DatastoreClient
+
+IMAGE_WORKERS = 4 # Image fetches are network bound, so several can run at once
+CLUE_WORKERS = 1
+SOLVE_WORKERS = 1
+QUEUE_SIZE = 64
+CLUE_BATCH_SIZE = 16 # Puzzles whose clues are read together
+CLUE_BATCH_WAIT = 0.5 # Seconds to wait for a batch to fill before reading a partial one
+SCAN_INTERVAL = 3600 # Seconds between scans in daemon mode
+
+STOP = object() # Queued once per worker to shut a stage down
+
+
+class Pipeline:
+    """
+    Chains the pipeline stages together with bounded queues.
+    """
+
+    def __init__(self, datastore, image_workers=IMAGE_WORKERS, clue_workers=CLUE_WORKERS,
+                 solve_workers=SOLVE_WORKERS, queue_size=QUEUE_SIZE):
+        """
+        :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+        :param image_workers: Number of threads finding images
+        :param clue_workers: Number of threads reading clues
+        :param solve_workers: Number of threads solving puzzles
+        :param queue_size: Maximum number of puzzles waiting between two stages
+        """
+        self.datastore = datastore
+        self.image_queue = queue.Queue(queue_size)
+        self.clue_queue = queue.Queue(queue_size)
+        self.solve_queue = queue.Queue(queue_size)
+        self.stages = (
+            (self.image_queue, self.start_workers(self.find_images, image_workers)),
+            (self.clue_queue, self.start_workers(self.read_clues, clue_workers)),
+            (self.solve_queue, self.start_workers(self.solve, solve_workers)),
+        )
+
+
+    def run_once(self):
+        """
+        Scans for new puzzles, waits for them to pass through every stage and stops.
+
+        :returns: Number of new puzzles found
+        """
+        found = self.scan()
+        self.stop()
+        return found
+
+
+    def run_forever(self, interval=SCAN_INTERVAL):
+        """
+        Scans for new puzzles at a regular interval until interrupted, then lets
+        puzzles already found finish passing through the stages.
+
+        :param interval: Seconds between the start of each scan
+        """
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    self.scan()
+                except Exception:
+                    logging.getLogger().exception("Scan failed, will retry at next interval")
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            logging.getLogger().info("Stopping pipeline")
+        self.stop()
+
+
+    def scan(self):
+        """
+        Saves new puzzles from the index and queues them for their images.
+
+        :returns: Number of new puzzles found
+        """
+        new_puzzles = index_scanner.get_new_puzzles(self.datastore)
+        logging.getLogger().info("Found %s new puzzles", len(new_puzzles))
+        for entity in self.datastore.put_index_puzzles(new_puzzles):
+            self.image_queue.put(entity)
+        if new_puzzles:
+            check.save_last_seen(new_puzzles[0].id)
+        return len(new_puzzles)
+
+
+    def stop(self):
+        """
+        Shuts the stages down in order, once each has finished all of its queued work.
+        """
+        for inbox, workers in self.stages:
+            for _ in workers:
+                inbox.put(STOP)
+            for worker in workers:
+                worker.join()
+
+
+    def start_workers(self, target, count):
+        """
+        :returns: List of started daemon threads running target
+        """
+        workers = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for worker in workers:
+            worker.start()
+        return workers
+
+
+    def find_images(self):
+        """
+        Image stage worker.
+        """
+        while True:
+            entity = self.image_queue.get()
+            if entity is STOP:
+                return
+            try:
+                img_finder.update_puzzle_with_image(self.datastore, entity)
+            except Exception:
+                logging.getLogger().exception("Unable to find image for puzzle %s", entity['id'])
+                continue
+            self.clue_queue.put(entity)
+
+
+    def read_clues(self):
+        """
+        Clue stage worker, reading clues for as many puzzles at once as are ready.
+        """
+        stopping = False
+        while not stopping:
+            batch = []
+            entity = self.clue_queue.get()
+            while entity is not STOP:
+                batch.append(entity)
+                if len(batch) == CLUE_BATCH_SIZE:
+                    break
+                try:
+                    entity = self.clue_queue.get(timeout=CLUE_BATCH_WAIT)
+                except queue.Empty:
+                    break
+            stopping = entity is STOP
+            if not batch:
+                continue
+            try:
+                updated = clue_reader.update_puzzles_with_clues(self.datastore, batch)
+            except Exception:
+                logging.getLogger().exception("Unable to read clues for puzzles %s",
+                                              ", ".join(str(entity['id']) for entity in batch))
+                continue
+            for entity in updated:
+                self.solve_queue.put(entity)
+
+
+    def solve(self):
+        """
+        Solve stage worker.
+        """
+        while True:
+            entity = self.solve_queue.get()
+            if entity is STOP:
+                return
+            try:
+                solver.update_puzzle_with_solution(self.datastore, entity)
+            except Exception:
+                logging.getLogger().exception("Unable to solve puzzle %s", entity['id'])
+
+
+def main():
+    """
+    Command line entry point to run the pipeline once or as a daemon.
+    """
+    import profiling # Only needed when run as a script
+    parser = argparse.ArgumentParser(description="Find, read and solve new kakuro puzzles.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep scanning for new puzzles until interrupted")
+    parser.add_argument("--interval", type=float, default=SCAN_INTERVAL,
+                        help="Seconds between scans in daemon mode")
+    parser.add_argument("--image-workers", type=int, default=IMAGE_WORKERS)
+    parser.add_argument("--clue-workers", type=int, default=CLUE_WORKERS)
+    parser.add_argument("--solve-workers", type=int, default=SOLVE_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    def run_pipeline():
+        # Workers are started inside the profiled function so that cpu profiles include them
+        pipeline = Pipeline(DatastoreClient(), args.image_workers, args.clue_workers,
+                            args.solve_workers, args.queue_size)
+        if args.daemon:
+            return pipeline.run_forever(args.interval)
+        return pipeline.run_once()
+
+    logger.setup_logger()
+    grid_detector.persist_layouts()
+    profiling.run(run_pipeline, args)
+
+if __name__ == "__main__":
+    main()
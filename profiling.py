@@ -0,0 +1,231 @@
+"""
+Runs an entry point under a profiler and writes timestamped reports, so that a
+slow production run can be diagnosed from the run itself.
+
+Three modes are supported:
+    cpu     deterministic profiling with cProfile of the calling thread and any
+            threads it starts, merged and saved as a pstats file
+    memory  allocation tracking with tracemalloc, saved as a snapshot file
+    sample  periodic sampling of every thread's stack, saved as folded stacks
+            (one "frame;frame;frame count" line per stack, as used by flame graph
+            tools), which adds far less overhead than cProfile
+Each mode also writes a text summary of the top entries alongside its report.
+"""
+
+import argparse
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+MODES = ("cpu", "memory", "sample")
+TOP_ENTRIES = 30 # Lines included in text summaries
+SAMPLE_INTERVAL = 0.005 # Seconds between stack samples
+TRACEMALLOC_FRAMES = 10
+# From 3.12 cProfile hooks sys.monitoring, which every thread shares and which
+# allows only one profiler at a time, so a single profiler sees all threads
+PROFILER_PER_THREAD = sys.version_info < (3, 12)
+
+
+def main(func, description):
+    """
+    Command line entry point running func, profiled if asked to.
+
+    :param func: Function taking no arguments to run
+    :param description: Description of the script for its help text
+    """
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser)
+    run(func, parser.parse_args())
+
+
+def add_arguments(parser):
+    """
+    Adds the profiling options to a script's argument parser.
+
+    :param parser: argparse.ArgumentParser to add to
+    """
+    parser.add_argument("--profile", choices=MODES, help="Profile the run in this mode")
+    parser.add_argument("--profile-dir", default=".", help="Directory to write reports to")
+    parser.add_argument("--profile-top", type=int, default=TOP_ENTRIES,
+                        help="Entries to include in the text summary")
+
+
+def run(func, args):
+    """
+    Runs func, profiled according to the options added by add_arguments.
+
+    :param func: Function taking no arguments to run
+    :param args: argparse.Namespace of parsed arguments
+    :returns: Whatever func returns
+    """
+    if not args.profile:
+        return func()
+    return profile(func, args.profile, args.profile_dir, args.profile_top)
+
+
+def profile(func, mode, directory=".", top=TOP_ENTRIES):
+    """
+    Runs func under a profiler and writes the report and its text summary, even
+    if func raises.
+
+    :param func: Function taking no arguments to run
+    :param mode: One of MODES
+    :param directory: Directory to write reports to, created if missing
+    :param top: Entries to include in the text summary
+    :returns: Whatever func returns
+    """
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, "%s-%s-%s" % (
+        func.__name__, time.strftime("%Y%m%d-%H%M%S"), mode))
+    profiler = {"cpu": CpuProfiler, "memory": MemoryProfiler, "sample": SamplingProfiler}[mode]()
+    profiler.start()
+    try:
+        return func()
+    finally:
+        profiler.stop()
+        paths = profiler.write(base, top)
+        logging.getLogger().info("Wrote %s profile to %s", mode, ", ".join(paths))
+
+
+class CpuProfiler:
+    """
+    Deterministic profiling with cProfile. Before Python 3.12 it only instruments
+    the thread it is enabled in, so threads started while profiling each get their
+    own profiler, and the results are merged when written. Threads started earlier
+    are missed.
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.thread_profilers = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        if PROFILER_PER_THREAD:
+            threading.setprofile(self.profile_thread)
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        if PROFILER_PER_THREAD:
+            threading.setprofile(None)
+
+    def profile_thread(self, frame, event, arg):
+        """
+        Called by each new thread as it starts, replacing itself with a profiler for the thread.
+        """
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.thread_profilers.append(profiler)
+        profiler.enable()
+
+    def write(self, base, top):
+        """
+        :returns: Tuple of paths written
+        """
+        summary = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=summary)
+        with self.lock:
+            for profiler in self.thread_profilers:
+                stats.add(profiler)
+        stats.dump_stats(base + ".pstats")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(top)
+        write_text(base + ".txt", summary.getvalue())
+        return base + ".pstats", base + ".txt"
+
+
+class MemoryProfiler:
+    """
+    Allocation tracking with tracemalloc, reporting memory still allocated at the end.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.peak = 0
+
+    def start(self):
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def stop(self):
+        self.snapshot = tracemalloc.take_snapshot()
+        _, self.peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    def write(self, base, top):
+        """
+        :returns: Tuple of paths written
+        """
+        self.snapshot.dump(base + ".tracemalloc")
+        lines = ["Peak traced memory: %.1f KiB" % (self.peak / 1024), ""]
+        for stat in self.snapshot.statistics("lineno")[:top]:
+            lines.append(str(stat))
+        write_text(base + ".txt", "\n".join(lines) + "\n")
+        return base + ".tracemalloc", base + ".txt"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every other thread from a background thread.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def sample(self):
+        own_ident = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename),
+                                                 code.co_firstlineno))
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def write(self, base, top):
+        """
+        :returns: Tuple of paths written
+        """
+        write_text(base + ".folded", "".join(
+            "%s %d\n" % (";".join(stack), count) for stack, count in self.stacks.most_common()))
+
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        lines = ["%d samples at %.1f ms intervals" % (self.samples, self.interval * 1000)]
+        for title, counts in (("Own samples", own), ("Total samples", total)):
+            lines += ["", title]
+            lines += ["%8d  %s" % (count, function) for function, count in counts.most_common(top)]
+        write_text(base + ".txt", "\n".join(lines) + "\n")
+        return base + ".folded", base + ".txt"
+
+
+def write_text(path, text):
+    with open(path, "w") as text_file:
+        text_file.write(text)
@@ -0,0 +1,200 @@
+#!/usr/local/bin/python3
+
+"""
+Reads and writes snapshots of the kakuro kind as a compressed columnar file.
+
+A snapshot is written as a sequence of row groups, one per page of entities
+fetched from the datastore, so neither writing nor reading ever needs to hold
+more than a single page in memory. Within a row group the ordinary properties
+are stored column by column as zlib-compressed JSON, while bytes properties
+(the image blobs) are stored separately as a raw contiguous region, since the
+images are already compressed and only their lengths need to live alongside
+the metadata.
+
+File layout:
+    MAGIC, version byte
+    repeated: row group header (rows, metadata length, blob region length),
+              compressed metadata, blob region
+    terminating row group header with zero rows
+"""
+
+import argparse
+import json
+import os
+import struct
+import zlib
+
+MAGIC = b"KKRX"
+FORMAT_VERSION = 1
+GROUP_HEADER = struct.Struct("<III")
+COMPRESSION_LEVEL = 6
+
+
+class ExportWriter:
+    """
+    Writes groups of datastore entities to a columnar snapshot file.
+    Use as a context manager, so that the terminating header is written once every
+    group has been, and a snapshot left incomplete by an error is removed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "wb")
+        self.file.write(MAGIC + bytes((FORMAT_VERSION,)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finished = False
+        try:
+            if exc_type is None:
+                self.file.write(GROUP_HEADER.pack(0, 0, 0))
+                finished = True
+        finally:
+            self.file.close()
+            if not finished:
+                os.remove(self.path) # A partial snapshot must never be mistaken for a complete one
+
+    def write_group(self, entities):
+        """
+        Writes one row group to the file.
+
+        :param entities: List or tuple of google.cloud.datastore.entity.Entity with complete keys
+        :returns: Number of rows written
+        :raises ValueError: if an entity has a property which cannot be exported
+        """
+        if not entities:
+            return 0
+        metadata, blobs = encode_group(entities)
+        compressed = zlib.compress(metadata, COMPRESSION_LEVEL)
+        blob_length = sum(len(blob) for blob in blobs)
+        self.file.write(GROUP_HEADER.pack(len(entities), len(compressed), blob_length))
+        self.file.write(compressed)
+        for blob in blobs:
+            self.file.write(blob)
+        self.rows += len(entities)
+        return len(entities)
+
+
+def encode_group(entities):
+    """
+    Splits a group of entities into a columnar metadata document and the list
+    of bytes values which make up its blob region.
+
+    :param entities: List or tuple of google.cloud.datastore.entity.Entity
+    :returns: Tuple of (metadata as UTF-8 JSON bytes, list of bytes for the blob region)
+    :raises ValueError: if an entity has a property of an unsupported type
+    """
+    names = sorted({name for entity in entities for name in entity.keys()})
+    columns = {}
+    blob_columns = {}
+    blobs = []
+    for name in names:
+        values = [entity.get(name) for entity in entities]
+        if any(isinstance(value, bytes) for value in values):
+            lengths = []
+            for value in values:
+                if value is None:
+                    lengths.append(None)
+                elif isinstance(value, bytes):
+                    lengths.append(len(value))
+                    blobs.append(value)
+                else:
+                    raise ValueError("Property " + name + " mixes bytes and other values")
+            blob_columns[name] = lengths
+        else:
+            for value in values:
+                if not isinstance(value, (int, float, str, type(None))):
+                    raise ValueError("Cannot export property " + name + " of type "
+                                     + type(value).__name__)
+            columns[name] = values
+    metadata = {
+        "keys": [entity.key.id for entity in entities],
+        "present": {name: [name in entity for entity in entities] for name in names},
+        "columns": columns,
+        "blob_columns": blob_columns,
+        "unindexed": [sorted(entity.exclude_from_indexes) for entity in entities],
+    }
+    return json.dumps(metadata, separators=(",", ":")).encode("utf-8"), blobs
+
+
+def read_groups(path):
+    """
+    Streams row groups back out of a snapshot file, one group at a time.
+
+    :param path: Location of a file written by ExportWriter
+    :returns: Generator of lists of (key id, property dict, tuple of unindexed property names)
+    :raises ValueError: if the file is not a snapshot or is truncated
+    """
+    with open(path, "rb") as export_file:
+        header = export_file.read(len(MAGIC) + 1)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a puzzle export file: " + str(path))
+        if header[len(MAGIC)] != FORMAT_VERSION:
+            raise ValueError("Unsupported export format version " + str(header[len(MAGIC)]))
+        while True:
+            group_header = export_file.read(GROUP_HEADER.size)
+            if len(group_header) != GROUP_HEADER.size:
+                raise ValueError("Truncated export file: " + str(path))
+            rows, metadata_length, blob_length = GROUP_HEADER.unpack(group_header)
+            if rows == 0:
+                return
+            metadata = export_file.read(metadata_length)
+            blob_region = export_file.read(blob_length)
+            if len(metadata) != metadata_length or len(blob_region) != blob_length:
+                raise ValueError("Truncated export file: " + str(path))
+            yield decode_group(json.loads(zlib.decompress(metadata)), blob_region)
+
+
+def decode_group(metadata, blob_region):
+    """
+    Rebuilds the rows of a group from its columnar metadata and blob region.
+
+    :param metadata: Parsed metadata document produced by encode_group
+    :param blob_region: Bytes holding the group's concatenated blobs
+    :returns: List of (key id, property dict, tuple of unindexed property names)
+    """
+    keys = metadata["keys"]
+    rows = [{} for _ in keys]
+    present = metadata["present"]
+    for name, values in metadata["columns"].items():
+        for row, value, is_set in zip(rows, values, present[name]):
+            if is_set:
+                row[name] = value
+    offset = 0
+    for name, lengths in metadata["blob_columns"].items():
+        for row, length, is_set in zip(rows, lengths, present[name]):
+            if length is not None:
+                row[name] = blob_region[offset: offset + length]
+                offset += length
+            elif is_set:
+                row[name] = None
+    return [(key, row, tuple(unindexed))
+            for key, row, unindexed in zip(keys, rows, metadata["unindexed"])]
+
+
+def main():
+    """
+    Command line entry point to export or import the kakuro kind.
+    """
+    import logger
+    from datastore_client import DatastoreClient
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("path", help="Snapshot file to write or read")
+    args = parser.parse_args()
+
+    logger.setup_logger()
+    datastore = DatastoreClient()
+    if args.command == "export":
+        datastore.export_puzzles(args.path)
+    else:
+        datastore.import_puzzles(args.path)
+
+
+if __name__ == "__main__":
+    main()
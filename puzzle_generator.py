@@ -0,0 +1,471 @@
+#!/usr/local/bin/python3
+
+"""
+Generates synthetic kakuro puzzles with unique solutions, and renders them in
+the Guardian's style, to benchmark the stages after img_finder on corpora and
+grids of any size.
+
+A layout is drawn at random with rotational symmetry, and filled with random
+digits which don't repeat within a run. The clue sums of a random filling
+rarely pin down a unique solution, so the digits are then improved by hill
+climbing: a digit in a cell which the solver's propagation can't yet fix is
+changed, and the change is kept unless it leaves the propagation with more
+candidates overall. Once propagation alone fixes every cell the solution is
+unique. If climbing stalls, a cell which still can't be fixed is blocked and
+climbing carries on with the shorter runs.
+"""
+
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import random
+import time
+from contextlib import ExitStack
+from io import BytesIO
+from PIL import Image, ImageDraw
+import image_archive
+import logger
+import puzzle_export
+from clue_reader import DIGIT_FONT, set_clue_grid
+from datastore_client import DatastoreClient
+from kakurizer_types import CellType, Difficulty, PuzzleGrid, Solution
+from solver import Solver, ALL_DIGITS, BIT_COUNTS, COMBINATIONS, set_solution
+
+HEIGHT = 10 # Including the top row and left column, which only hold clues
+WIDTH = 10
+DENSITY = 0.8 # Chance of each cell starting out empty, before short runs are blocked
+MAX_RUN = 9
+FILL_STEPS = 20000 # Backtracking steps allowed to fill a layout before starting again
+PATIENCE = 40 # Changes without fewer candidates before a cell is blocked instead
+MAX_ATTEMPTS = 20
+CELL_SIZE = 40
+CELL_PER_FONT_PIXEL = 28 # Cell pixels per font pixel, keeping two digit sums inside the regions
+                         # clue_reader samples
+MIN_FRACTIONAL_SCALE = 1.3 # Smaller scales round unevenly, so one pixel per font pixel is used
+LINE_WIDTH = 2
+CLUE_SHADE = 160
+CHUNK_SIZE = 16
+EXPORT_GROUP_SIZE = 250
+FIRST_ID = 1 << 60 # Far above Guardian puzzle IDs and the keys Datastore allocates, so that
+                   # imported corpora never overwrite real puzzles or hide them from index_scanner
+SYNTHETIC_TIMESTAMP = 0 # Sorts synthetic puzzles after every real one
+SYNTHETIC_URL = "synthetic:%d"
+DIFFICULTY_AREAS = ((64, Difficulty.EASY), (144, Difficulty.MEDIUM)) # Largest area for each label
+DIGITS = range(1, 10)
+
+
+def generate(height=HEIGHT, width=WIDTH, density=DENSITY, seed=None, max_run=MAX_RUN):
+    """
+    :param height: Number of rows, including the top row of clues
+    :param width: Number of columns, including the left column of clues
+    :param density: Chance of each cell starting out empty, from 0 to 1
+    :param seed: If set, seed for the random choices, so that the same puzzle is made each time
+    :param max_run: Longest run of cells to allow, from 2 to 9
+    :returns: Tuple of (kakurizer_types.PuzzleGrid, kakurizer_types.Solution) of a puzzle
+              with a unique solution
+    :raises ValueError: if the size or run length is impossible, or no puzzle could be made
+    """
+    if height < 3 or width < 3:
+        raise ValueError("Puzzles need at least 3 rows and 3 columns")
+    if not 2 <= max_run <= 9:
+        raise ValueError("Runs must be allowed to have between 2 and 9 cells")
+    rng = random.Random(seed)
+    for _ in range(MAX_ATTEMPTS):
+        is_open = generate_layout(rng, height, width, density, max_run)
+        runs, cell_runs = find_runs(is_open, height, width)
+        digits = fill_digits(rng, runs, cell_runs, height * width)
+        if digits is None:
+            continue
+        make_unique(rng, is_open, digits, height, width)
+        if any(is_open):
+            return build_grid(is_open, digits, height, width), \
+                Solution.from_digits(height, width, digits)
+    raise ValueError("Couldn't generate a %sx%s puzzle with density %s" % (height, width, density))
+
+
+def generate_layout(rng, height, width, density, max_run=MAX_RUN):
+    """
+    Chooses which cells are to be filled in. Cells are opened at random with
+    rotational symmetry about the centre of the grid below and right of the
+    clue row and column. Runs longer than max_run are then split, and cells
+    left on their own in a row or column are blocked.
+
+    :param rng: random.Random to make choices with
+    :returns: bytearray with 1 for each cell to fill in and 0 otherwise, in row-major order
+    """
+    is_open = bytearray(height * width)
+    for row in range(1, height):
+        for col in range(1, width):
+            index = row * width + col
+            mirror = (height - row) * width + width - col
+            is_open[index] = is_open[mirror] if mirror < index else rng.random() < density
+    split = True
+    while split:
+        split = False
+        for run in find_runs(is_open, height, width)[0]:
+            if len(run) > max_run:
+                index = run[rng.randint(2, len(run) - 3)]
+                row, col = divmod(index, width)
+                is_open[index] = is_open[(height - row) * width + width - col] = 0
+                split = True
+    block_cells(is_open, height, width, ())
+    return is_open
+
+
+def find_runs(is_open, height, width):
+    """
+    :param is_open: bytearray with 1 for each cell to fill in, in row-major order
+    :returns: Tuple of (list of tuples of row-major cell indexes for each across and
+              down run, dict from open cell index to list of the indexes of its runs)
+    """
+    runs = []
+    cell_runs = {}
+    for step, length, count in ((1, width, height), (width, height, width)):
+        for line in range(count):
+            first = line * width if step == 1 else line
+            run = []
+            for position in range(length + 1):
+                index = first + position * step
+                if position < length and is_open[index]:
+                    run.append(index)
+                elif run:
+                    for cell in run:
+                        cell_runs.setdefault(cell, []).append(len(runs))
+                    runs.append(tuple(run))
+                    run = []
+    return runs, cell_runs
+
+
+def block_cells(is_open, height, width, cells):
+    """
+    Blocks the given cells, then any cells which that leaves on their own in a
+    row or column, until every open cell is in runs of at least two.
+
+    :param is_open: bytearray with 1 for each cell to fill in, which is updated
+    :param cells: Iterable of row-major indexes of cells to block
+    :returns: None
+    """
+    for cell in cells:
+        is_open[cell] = 0
+    while True:
+        singles = [run[0] for run in find_runs(is_open, height, width)[0] if len(run) == 1]
+        if not singles:
+            return
+        for cell in singles:
+            is_open[cell] = 0
+
+
+def fill_digits(rng, runs, cell_runs, size):
+    """
+    Fills every open cell with a random digit, so that no run repeats a digit,
+    by backtracking search in row-major order.
+
+    :param rng: random.Random to make choices with
+    :param runs: List of tuples of cell indexes for each run
+    :param cell_runs: Dict from open cell index to the indexes of its runs
+    :param size: Number of cells in the grid
+    :returns: bytearray of digits in row-major order, with 0 for cells which aren't
+              open, or None if no filling was found within FILL_STEPS
+    """
+    cells = sorted(cell_runs)
+    digits = bytearray(size)
+    choices = [None] * len(cells)
+    position = 0
+    for _ in range(FILL_STEPS):
+        if position == len(cells):
+            return digits
+        cell = cells[position]
+        if choices[position] is None:
+            used = {digits[other] for run in cell_runs[cell] for other in runs[run]}
+            choices[position] = [digit for digit in DIGITS if digit not in used]
+            rng.shuffle(choices[position])
+        if choices[position]:
+            digits[cell] = choices[position].pop()
+            position += 1
+        else:
+            choices[position] = None
+            digits[cell] = 0
+            position -= 1
+            if position < 0:
+                return None
+    return None
+
+
+def make_unique(rng, is_open, digits, height, width):
+    """
+    Changes digits, and blocks cells if need be, until the solver's propagation
+    fixes every cell from the clue sums alone.
+
+    :param rng: random.Random to make choices with
+    :param is_open: bytearray with 1 for each cell to fill in, which is updated
+    :param digits: bytearray of a valid filling of the open cells, which is updated
+    :returns: None
+    """
+    while any(is_open):
+        solver = Solver(build_grid(is_open, digits, height, width))
+        lengths = [len(cells) for cells in solver.run_cells]
+        sums = [sum(digits[solver.positions[cell]] for cell in cells) for cells in solver.run_cells]
+        candidates, masks = propagated(solver, sums, lengths)
+        stale = 0
+        while candidates > len(masks) and stale < PATIENCE:
+            stale += 1
+            cell = rng.choice([cell for cell, mask in enumerate(masks) if BIT_COUNTS[mask] > 1])
+            position = solver.positions[cell]
+            used = {digits[solver.positions[other]] for run in solver.cell_runs[cell]
+                    for other in solver.run_cells[run]}
+            options = [digit for digit in DIGITS if digit not in used]
+            if not options:
+                continue
+            change = rng.choice(options) - digits[position]
+            for run in solver.cell_runs[cell]:
+                sums[run] += change
+            trial_candidates, trial_masks = propagated(solver, sums, lengths)
+            if trial_candidates <= candidates:
+                digits[position] += change
+                if trial_candidates < candidates:
+                    stale = 0
+                candidates, masks = trial_candidates, trial_masks
+            else:
+                for run in solver.cell_runs[cell]:
+                    sums[run] -= change
+        if candidates == len(masks):
+            return
+        unfixed = [solver.positions[cell] for cell, mask in enumerate(masks) if BIT_COUNTS[mask] > 1]
+        block_cells(is_open, height, width, [rng.choice(unfixed)])
+        for index, cell_open in enumerate(is_open):
+            if not cell_open:
+                digits[index] = 0
+
+
+def propagated(solver, sums, lengths):
+    """
+    :param solver: solver.Solver for the layout
+    :param sums: List of the clue sum of each of the solver's runs
+    :param lengths: List of the number of cells in each of the solver's runs
+    :returns: Tuple of (total candidates left, list of candidate bitmasks for each cell)
+              after propagating the clue sums
+    """
+    masks = [ALL_DIGITS] * len(solver.positions)
+    options = [COMBINATIONS[(total, length)] for total, length in zip(sums, lengths)]
+    solver.propagate(masks, options, list(range(len(sums))))
+    return sum(BIT_COUNTS[mask] for mask in masks), masks
+
+
+def build_grid(is_open, digits, height, width):
+    """
+    :param is_open: bytearray with 1 for each cell to fill in, in row-major order
+    :param digits: bytearray of the digit in each open cell
+    :returns: kakurizer_types.PuzzleGrid with the clue sums of the filling
+    """
+    size = height * width
+    cells = bytearray(size)
+    across = bytearray(size)
+    down = bytearray(size)
+    for index in range(size):
+        if is_open[index]:
+            cells[index] = CellType.EMPTY.value
+            continue
+        row, col = divmod(index, width)
+        for sums, step, end in ((across, 1, (row + 1) * width), (down, width, size)):
+            position = index + step
+            while position < end and is_open[position]:
+                sums[index] += digits[position]
+                position += step
+        has_clue = across[index] or down[index]
+        cells[index] = CellType.CLUE.value if has_clue else CellType.BLOCKED.value
+    return PuzzleGrid(height, width, cells, across, down)
+
+
+def render(grid, cell_size=CELL_SIZE, digit_scale=None, line_width=LINE_WIDTH):
+    """
+    Draws a puzzle in the Guardian's style: black blocked cells, shaded clue
+    cells split by a diagonal with the sums in the built-in digit font, and
+    white empty cells.
+
+    :param grid: kakurizer_types.PuzzleGrid to draw
+    :param cell_size: Width and height of each cell in pixels
+    :param digit_scale: Pixels per font pixel, by default scaled to the cell
+    :param line_width: Width of grid lines and diagonals in pixels
+    :returns: image as PNG bytes
+    """
+    if digit_scale is None:
+        digit_scale = cell_digit_scale(cell_size)
+    image = Image.new("L", (grid.width * cell_size + line_width,
+                            grid.height * cell_size + line_width), 255)
+    draw = ImageDraw.Draw(image)
+    for index, cell in enumerate(grid.cells):
+        row, col = divmod(index, grid.width)
+        left, top = col * cell_size, row * cell_size
+        if cell == CellType.BLOCKED.value:
+            draw.rectangle((left, top, left + cell_size, top + cell_size), fill=0)
+        elif cell == CellType.CLUE.value:
+            draw.rectangle((left, top, left + cell_size, top + cell_size), fill=CLUE_SHADE)
+            draw.line((left, top, left + cell_size, top + cell_size), fill=0, width=line_width)
+            draw_number(image, grid.across[index], left + 0.73 * cell_size,
+                        top + 0.24 * cell_size, digit_scale)
+            draw_number(image, grid.down[index], left + 0.27 * cell_size,
+                        top + 0.76 * cell_size, digit_scale)
+    for row in range(grid.height + 1):
+        draw.rectangle((0, row * cell_size, image.width, row * cell_size + line_width - 1), fill=0)
+    for col in range(grid.width + 1):
+        draw.rectangle((col * cell_size, 0, col * cell_size + line_width - 1, image.height), fill=0)
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def cell_digit_scale(cell_size):
+    """
+    :returns: pixels per font pixel for sums drawn in cells of the given size
+    """
+    scale = cell_size / CELL_PER_FONT_PIXEL
+    return scale if scale >= MIN_FRACTIONAL_SCALE else 1
+
+
+def draw_number(image, number, centre_x, centre_y, scale):
+    """
+    Draws a number in the built-in digit font centred on the given point, or
+    nothing if the number is 0.
+    """
+    if number == 0:
+        return
+    digits = str(number)
+    left = centre_x - (len(digits) * 6 - 1) * scale / 2
+    top = int(centre_y - 7 * scale / 2)
+    for position, digit in enumerate(digits):
+        image.paste(0, (int(left + position * 6 * scale), top), glyph_mask(int(digit), scale))
+
+
+@functools.lru_cache(maxsize=None)
+def glyph_mask(digit, scale):
+    """
+    :returns: PIL.Image.Image mask of a digit in the built-in font, scale pixels per font pixel
+    """
+    mask = Image.new("1", (5, 7))
+    mask.putdata([pixel == "#" for line in DIGIT_FONT[digit] for pixel in line])
+    return mask.resize((round(5 * scale), round(7 * scale)), Image.NEAREST)
+
+
+def generate_task(task):
+    """
+    Generates one puzzle in a worker process.
+
+    :param task: Tuple of (puzzle ID, height, width, density, seed, whether to render an image)
+    :returns: Tuple of (puzzle ID, encoded PuzzleGrid, encoded Solution, PNG bytes or None)
+    """
+    puzzle_id, height, width, density, seed, with_image = task
+    grid, solution = generate(height, width, density, "%s:%s" % (seed, puzzle_id))
+    return puzzle_id, grid.encode(), solution.encode(), render(grid) if with_image else None
+
+
+def generate_corpus(count, height=HEIGHT, width=WIDTH, density=DENSITY, seed=0,
+                    archive_path=None, export_path=None, images=True, processes=None,
+                    first_id=FIRST_ID):
+    """
+    Generates a corpus of puzzles in parallel and writes them out. Each puzzle
+    depends only on the seed and its ID, so a corpus can be made again exactly.
+
+    :param count: Number of puzzles to generate
+    :param seed: Seed for the corpus
+    :param archive_path: If set, write the rendered images to an image_archive file
+    :param export_path: If set, write puzzle entities, with clues, solutions and images
+                        if rendered, to a puzzle_export snapshot which import_puzzles can load
+    :param images: Whether to render an image of each puzzle
+    :param processes: Number of worker processes, defaulting to one per CPU
+    :param first_id: Puzzle ID of the first puzzle
+    :returns: Number of puzzles generated
+    """
+    tasks = [(puzzle_id, height, width, density, seed, images)
+             for puzzle_id in range(first_id, first_id + count)]
+    started = time.perf_counter()
+    group = []
+    with multiprocessing.Pool(processes or os.cpu_count()) as pool, ExitStack() as outputs:
+        archive = None if archive_path is None else outputs.enter_context(
+            image_archive.ArchiveWriter(archive_path))
+        export = None if export_path is None else outputs.enter_context(
+            puzzle_export.ExportWriter(export_path))
+        for puzzle_id, grid_data, solution_data, image in pool.imap_unordered(
+                generate_task, tasks, CHUNK_SIZE):
+            if archive is not None and image is not None:
+                archive.add(puzzle_id, image)
+            if export is not None:
+                group.append(make_entity(puzzle_id, grid_data, solution_data, image))
+                if len(group) == EXPORT_GROUP_SIZE:
+                    export.write_group(group)
+                    group = []
+        if export is not None:
+            export.write_group(group)
+    elapsed = time.perf_counter() - started
+    logging.getLogger().info("Generated %s %sx%s puzzles in %.1fs (%.1f per second)",
+                             count, height, width, elapsed, count / elapsed)
+    return count
+
+
+def make_entity(puzzle_id, grid_data, solution_data, image):
+    """
+    :returns: google.cloud.datastore.entity.Entity for a synthetic puzzle, set up as
+              the pipeline stages would leave it
+    """
+    from google.cloud.datastore.entity import Entity
+    from google.cloud.datastore.key import Key
+    grid = PuzzleGrid.decode(grid_data)
+    entity = Entity(key=Key(DatastoreClient.CLOUDSTORE_TYPE, puzzle_id, project="synthetic"))
+    entity['id'] = puzzle_id
+    entity['timestamp_millis'] = SYNTHETIC_TIMESTAMP
+    entity['difficulty'] = difficulty(grid).name
+    entity['page_url'] = SYNTHETIC_URL % puzzle_id
+    entity['synthetic'] = True
+    entity['has_img'] = image is not None
+    if image is not None:
+        entity['img_blob'] = image
+        entity['img_format'] = "PNG"
+        entity['img_width'] = grid.width * CELL_SIZE + LINE_WIDTH
+        entity['img_height'] = grid.height * CELL_SIZE + LINE_WIDTH
+        entity.exclude_from_indexes = {'img_blob'}
+    set_clue_grid(entity, grid)
+    set_solution(entity, Solution.decode(solution_data))
+    return entity
+
+
+def difficulty(grid):
+    """
+    :returns: kakurizer_types.Difficulty label for a synthetic puzzle, from the
+              area of its grid inside the clue row and column
+    """
+    area = (grid.height - 1) * (grid.width - 1)
+    for largest, label in DIFFICULTY_AREAS:
+        if area <= largest:
+            return label
+    return Difficulty.HARD
+
+
+def main():
+    """
+    Command line entry point to generate a corpus of synthetic puzzles.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("count", type=int, help="Number of puzzles to generate")
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--density", type=float, default=DENSITY,
+                        help="Chance of each cell starting out empty, from 0 to 1")
+    parser.add_argument("--seed", default="0")
+    parser.add_argument("--archive", help="Image archive file to write rendered images to")
+    parser.add_argument("--export", help="Snapshot file to write puzzle entities to")
+    parser.add_argument("--no-images", dest="images", action="store_false",
+                        help="Generate clues and solutions only")
+    parser.add_argument("--processes", type=int, help="Worker processes, default one per CPU")
+    parser.add_argument("--first-id", type=int, default=FIRST_ID)
+    args = parser.parse_args()
+    if not 0 < args.density <= 1:
+        parser.error("--density must be greater than 0 and at most 1")
+
+    logger.setup_logger()
+    generate_corpus(args.count, args.height, args.width, args.density, args.seed,
+                    args.archive, args.export, args.images, args.processes, args.first_id)
+
+
+if __name__ == "__main__":
+    main()
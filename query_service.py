@@ -0,0 +1,347 @@
+#!/usr/local/bin/python3
+
+"""
+Serves puzzle metadata over a local HTTP API from an in-memory copy of the database.
+
+Metadata for every puzzle (but no images) is loaded once with projection queries,
+then kept up to date by fetching only puzzles saved since the last refresh. Each
+refresh builds a new immutable PuzzleIndex and swaps it in, so requests never wait
+on a lock and always see a consistent snapshot.
+
+Endpoints, all returning JSON:
+    GET /puzzles        newest first, filtered by any of
+                            difficulty=EASY,HARD   from=<millis>   to=<millis>
+                            has_img= / has_clues= / has_solution=true|false
+                        paginated with limit=<n> and the cursor=<next> of the
+                        previous response
+    GET /puzzles/<id>   a single puzzle
+    GET /status         number of puzzles and the snapshot version
+
+Responses carry an ETag, and a request with a matching If-None-Match is answered
+with 304 Not Modified. Encoded responses are cached per snapshot, so repeated
+queries cost a dictionary lookup.
+"""
+
+import argparse
+import bisect
+import hashlib
+import heapq
+import json
+import logging
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import logger
+from datastore_client import DatastoreClient
+
+HOST = "127.0.0.1"
+PORT = 8080
+REFRESH_INTERVAL = 60 # Seconds between incremental refreshes
+REFRESH_OVERLAP = 5000 # Milliseconds re-read at each refresh, to allow for clock skew between writers
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+MAX_CACHED_RESPONSES = 1024
+FLAGS = ("has_img", "has_clues", "has_solution")
+
+
+class PuzzleIndex:
+    """
+    Immutable snapshot of puzzle metadata with secondary indexes. Puzzles are kept
+    in one list ordered newest first, which timestamp ranges and cursors bisect
+    into. Each difficulty and flag value also has a sorted list of positions in
+    that order, so a query only visits puzzles matching its most selective filter.
+    """
+
+    def __init__(self, puzzles, version=0):
+        """
+        :param puzzles: Dict from puzzle ID to a dict of its metadata
+        :param version: Number identifying this snapshot
+        """
+        self.puzzles = puzzles
+        self.version = version
+        ordered = sorted(puzzles.values(), key=sort_key)
+        self.ordered = [puzzle['id'] for puzzle in ordered]
+        self.keys = [sort_key(puzzle) for puzzle in ordered]
+        self.positions = {} # Ascending positions in ordered, by (field, value) filtered on
+        for position, puzzle in enumerate(ordered):
+            self.positions.setdefault(('difficulty', puzzle['difficulty']), []).append(position)
+            for flag in FLAGS:
+                self.positions.setdefault((flag, bool(puzzle.get(flag))), []).append(position)
+        self.responses = {} # Encoded responses for this snapshot, by normalized query
+
+
+    def query(self, difficulties=None, start=None, end=None, flags=None, cursor=None,
+              limit=DEFAULT_LIMIT):
+        """
+        :param difficulties: If set, collection of difficulty names to include
+        :param start: If set, earliest timestamp_millis to include
+        :param end: If set, latest timestamp_millis to include
+        :param flags: Dict from flag name to the value it must have
+        :param cursor: If set, the next cursor of a previous query to continue from
+        :param limit: Maximum number of puzzles to return
+        :returns: Tuple of (list of puzzle metadata dicts newest first, next cursor or None)
+        """
+        first = 0 if end is None else bisect.bisect_left(self.keys, (-end, -float("inf")))
+        last = len(self.keys) if start is None else bisect.bisect_right(self.keys,
+                                                                        (-start, float("inf")))
+        if cursor is not None:
+            first = max(first, bisect.bisect_right(self.keys, cursor))
+
+        filters = [] # Each a list of position lists, any of which the puzzle must be in
+        if difficulties is not None:
+            filters.append([self.positions.get(('difficulty', name), []) for name in set(difficulties)])
+        for flag, value in (flags or {}).items():
+            filters.append([self.positions.get((flag, value), [])])
+        # Only visit the positions in range of the filter with the fewest of them
+        positions, count = range(first, last), max(0, last - first)
+        for lists in filters:
+            bounds = [(members, bisect.bisect_left(members, first),
+                       bisect.bisect_left(members, last)) for members in lists]
+            if sum(high - low for _, low, high in bounds) < count:
+                count = sum(high - low for _, low, high in bounds)
+                positions = heapq.merge(*(map(members.__getitem__, range(low, high))
+                                          for members, low, high in bounds))
+
+        results = []
+        for position in positions:
+            puzzle = self.puzzles[self.ordered[position]]
+            if difficulties is not None and puzzle['difficulty'] not in difficulties:
+                continue
+            if any(bool(puzzle.get(flag)) != value for flag, value in (flags or {}).items()):
+                continue
+            if len(results) == limit:
+                return results, sort_key(results[-1])
+            results.append(puzzle)
+        return results, None
+
+
+    def get(self, puzzle_id):
+        """
+        :returns: Metadata dict of the puzzle, or None if there isn't one with this ID
+        """
+        return self.puzzles.get(puzzle_id)
+
+
+def sort_key(puzzle):
+    """
+    :returns: Key ordering puzzles newest first, with ties broken by descending ID
+    """
+    return (-puzzle['timestamp_millis'], -puzzle['id'])
+
+
+def metadata(entity):
+    """
+    :param entity: database entry, or projection of one, representing a puzzle
+    :returns: Dict of the puzzle's metadata
+    """
+    return {field: entity.get(field) for field in DatastoreClient.METADATA_PROPERTIES}
+
+
+class QueryService:
+    """
+    Keeps a PuzzleIndex up to date from the database and answers queries against it.
+    """
+
+    def __init__(self, datastore):
+        """
+        :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+        """
+        self.datastore = datastore
+        self.index = PuzzleIndex({})
+        self.refreshed_millis = None
+        self.refresh_lock = threading.Lock()
+
+
+    def refresh(self):
+        """
+        Loads metadata for all puzzles on the first call, and afterwards only for
+        puzzles saved since the previous refresh, swapping in a new index if anything changed.
+
+        :returns: Number of puzzles loaded
+        """
+        with self.refresh_lock:
+            started = int(time.time() * 1000)
+            since = None if self.refreshed_millis is None else self.refreshed_millis - REFRESH_OVERLAP
+            changed = {}
+            for page in self.datastore.get_metadata_pages(updated_since=since):
+                for entity in page:
+                    changed[entity['id']] = metadata(entity)
+            current = self.index
+            if any(current.get(puzzle_id) != puzzle for puzzle_id, puzzle in changed.items()):
+                self.index = PuzzleIndex({**current.puzzles, **changed}, current.version + 1)
+                logging.getLogger().info("Loaded %s puzzles, now serving version %s",
+                                         len(changed), self.index.version)
+            self.refreshed_millis = started
+            return len(changed)
+
+
+    def refresh_forever(self, interval=REFRESH_INTERVAL):
+        """
+        Refreshes at a regular interval, logging and carrying on after errors.
+        """
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception:
+                logging.getLogger().exception("Refresh failed, serving the previous snapshot")
+
+
+    def handle(self, target, if_none_match=None):
+        """
+        Answers a request against the current snapshot.
+
+        :param target: Request path and query string
+        :param if_none_match: Value of the If-None-Match header, if any
+        :returns: Tuple of (HTTPStatus, ETag or None, encoded JSON body)
+        """
+        index = self.index
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        cache_key = (url.path, tuple(sorted((name, tuple(values))
+                                            for name, values in params.items())))
+        cached = index.responses.get(cache_key)
+        if cached is None:
+            try:
+                status, body = self.respond(index, url.path, params)
+            except ValueError as error:
+                return HTTPStatus.BAD_REQUEST, None, encode({"error": str(error)})
+            etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+            cached = (status, etag, body)
+            if len(index.responses) < MAX_CACHED_RESPONSES:
+                index.responses[cache_key] = cached
+        status, etag, body = cached
+        if status == HTTPStatus.OK and if_none_match == etag:
+            return HTTPStatus.NOT_MODIFIED, etag, b""
+        return status, etag, body
+
+
+    def respond(self, index, path, params):
+        """
+        :returns: Tuple of (HTTPStatus, encoded JSON body)
+        :raises ValueError: if a query parameter is invalid
+        """
+        if path == "/status":
+            return HTTPStatus.OK, encode({"puzzles": len(index.puzzles), "version": index.version})
+        if path == "/puzzles":
+            limit = int(param(params, "limit", DEFAULT_LIMIT))
+            if not 0 < limit <= MAX_LIMIT:
+                raise ValueError("limit must be between 1 and " + str(MAX_LIMIT))
+            difficulties = param(params, "difficulty")
+            cursor = param(params, "cursor")
+            start = param(params, "from")
+            end = param(params, "to")
+            puzzles, next_cursor = index.query(
+                difficulties=None if difficulties is None else difficulties.upper().split(","),
+                start=None if start is None else int(start),
+                end=None if end is None else int(end),
+                flags={flag: parse_bool(param(params, flag)) for flag in FLAGS
+                       if param(params, flag) is not None},
+                cursor=None if cursor is None else parse_cursor(cursor),
+                limit=limit)
+            return HTTPStatus.OK, encode({
+                "puzzles": puzzles,
+                "next": None if next_cursor is None else "%d:%d" % (-next_cursor[0], -next_cursor[1])})
+        if path.startswith("/puzzles/"):
+            puzzle = index.get(int(path[len("/puzzles/"):]))
+            if puzzle is None:
+                return HTTPStatus.NOT_FOUND, encode({"error": "No such puzzle"})
+            return HTTPStatus.OK, encode(puzzle)
+        return HTTPStatus.NOT_FOUND, encode({"error": "No such endpoint"})
+
+
+def param(params, name, default=None):
+    """
+    :returns: Last value given for a query parameter, or default if it wasn't given
+    """
+    values = params.get(name)
+    return values[-1] if values else default
+
+
+def parse_bool(value):
+    """
+    :raises ValueError: if the value isn't true or false
+    """
+    if value.lower() in ("true", "1"):
+        return True
+    if value.lower() in ("false", "0"):
+        return False
+    raise ValueError("Expected true or false, not " + value)
+
+
+def parse_cursor(cursor):
+    """
+    :param cursor: Cursor from a previous response, as timestamp:id
+    :returns: Sort key of the last puzzle already returned
+    :raises ValueError: if the cursor is malformed
+    """
+    timestamp, puzzle_id = cursor.split(":")
+    return (-int(timestamp), -int(puzzle_id))
+
+
+def encode(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Passes GET requests to the server's QueryService.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        status, etag, body = self.server.service.handle(self.path,
+                                                        self.headers.get("If-None-Match"))
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if status != HTTPStatus.NOT_MODIFIED:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep per-request logging off the hot path
+
+
+def create_server(service, host=HOST, port=PORT):
+    """
+    :param service: QueryService to answer requests
+    :returns: ThreadingHTTPServer bound to host and port, which isn't serving yet
+    """
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    """
+    Command line entry point to load the puzzles and serve queries until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--refresh", type=float, default=REFRESH_INTERVAL,
+                        help="Seconds between incremental refreshes")
+    args = parser.parse_args()
+
+    logger.setup_logger()
+    service = QueryService(DatastoreClient())
+    service.refresh()
+    threading.Thread(target=service.refresh_forever, args=(args.refresh,), daemon=True).start()
+    server = create_server(service, args.host, args.port)
+    logging.getLogger().info("Serving puzzles on http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Schedules outbound requests so that every process fetching from the same host
+shares a single request budget for that host.
+
+Each host has a token bucket kept in a small state file, locked with fcntl while
+it is updated, so any number of scanners and image workers on one machine draw
+from the same bucket. A request reserves the next token even if it isn't
+available yet, and then sleeps until its slot comes round, which spaces requests
+evenly without polling.
+
+The rate for a host starts at its budget. A 429 or 503 response halves the rate
+and pauses the host for as long as any Retry-After header asks. Each successful
+request then raises the rate by a small step until it is back at the budget.
+"""
+
+import email.utils
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+STATE_DIR = os.environ.get("KAKURIZER_RATE_DIR",
+                           os.path.join(tempfile.gettempdir(), "kakurizer-rate"))
+HOST_RATES = { # Requests per second allowed for each host
+    "www.theguardian.com": 2.0,
+    "i.guim.co.uk": 10.0,
+}
+DEFAULT_RATE = 5.0
+BURST = 5 # Requests which can be made at once after a quiet period
+MIN_RATE = 0.05
+BACKOFF_FACTOR = 0.5
+RECOVERY_STEP = 0.05 # Requests per second added back after each success
+THROTTLED_STATUSES = (429, 503)
+DEFAULT_RETRY_AFTER = 5.0 # Seconds to pause a host which throttles without saying how long
+MAX_ATTEMPTS = 4
+
+
+class RateLimiter:
+    """
+    Token buckets for each host, shared between processes through state files.
+    """
+
+    def __init__(self, state_dir=STATE_DIR, host_rates=None):
+        """
+        :param state_dir: Directory holding one state file per host
+        :param host_rates: Dict from host name to requests per second, defaulting to HOST_RATES
+        """
+        self.state_dir = state_dir
+        self.host_rates = HOST_RATES if host_rates is None else host_rates
+
+
+    def get(self, url, **kwargs):
+        """
+        Makes a GET request once the host's budget allows, retrying if throttled.
+
+        :param url: URL to load
+        :param kwargs: Further arguments for requests.get
+        :returns: requests.Response, which is the throttled response if every attempt was throttled
+        """
+        import requests
+        host = urlsplit(url).hostname or "localhost"
+        for attempt in range(MAX_ATTEMPTS):
+            self.acquire(host)
+            response = requests.get(url, **kwargs)
+            if response.status_code not in THROTTLED_STATUSES:
+                self.succeeded(host)
+                return response
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            logging.getLogger().warning("Throttled by %s (attempt %s), retry after %s",
+                                        host, attempt + 1, retry_after)
+            self.throttled(host, retry_after)
+        return response
+
+
+    def acquire(self, host):
+        """
+        Waits until the host's budget allows another request.
+
+        :param host: Host name the request is for
+        :returns: Seconds waited
+        """
+        delay = self.reserve(host)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+    def reserve(self, host):
+        """
+        Takes the next token from the host's bucket, letting the bucket go into
+        debt if it is empty.
+
+        :param host: Host name the request is for
+        :returns: Seconds until the reserved token becomes available
+        """
+        def take(state, now):
+            start = max(now, state["blocked_until"])
+            state["tokens"] -= 1
+            return max(0.0, start - now - state["tokens"] / state["rate"])
+        return self.update(host, take)
+
+
+    def throttled(self, host, retry_after=None):
+        """
+        Slows the host's rate down and pauses it after a throttled response.
+
+        :param host: Host name which throttled a request
+        :param retry_after: Seconds the host asked to wait, if it said
+        """
+        def back_off(state, now):
+            state["rate"] = max(MIN_RATE, state["rate"] * BACKOFF_FACTOR)
+            pause = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+            state["blocked_until"] = max(state["blocked_until"], now + pause)
+            state["tokens"] = min(state["tokens"], 1.0)
+        self.update(host, back_off)
+
+
+    def succeeded(self, host):
+        """
+        Speeds the host's rate back up towards its budget after a successful request.
+
+        :param host: Host name which answered a request
+        """
+        budget = self.host_rates.get(host, DEFAULT_RATE)
+        def recover(state, now):
+            state["rate"] = min(budget, state["rate"] + RECOVERY_STEP)
+        self.update(host, recover)
+
+
+    def update(self, host, change):
+        """
+        Applies a change to a host's bucket while holding the lock on its state file,
+        after topping up the tokens earned since it was last updated.
+
+        :param host: Host name whose bucket to change
+        :param change: Function taking (state dict, current time) which updates the state
+        :returns: Whatever change returns
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(os.path.join(self.state_dir, host + ".json"), "a+") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            try:
+                state = json.loads(state_file.read())
+            except ValueError:
+                state = {"rate": self.host_rates.get(host, DEFAULT_RATE), "tokens": BURST,
+                         "updated": time.time(), "blocked_until": 0.0}
+            now = time.time()
+            elapsed = max(0.0, now - max(state["updated"], state["blocked_until"]))
+            state["tokens"] = min(BURST, state["tokens"] + elapsed * state["rate"])
+            state["updated"] = max(now, state["updated"])
+            result = change(state, now)
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(json.dumps(state))
+            return result
+
+
+def parse_retry_after(value):
+    """
+    :param value: Retry-After header value, as a number of seconds or an HTTP date
+    :returns: Seconds to wait, or None if the value is missing or unparseable
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+LIMITER = RateLimiter()
+
+def get(url, **kwargs):
+    """
+    Makes a GET request through the shared rate limiter. See RateLimiter.get.
+    """
+    return LIMITER.get(url, **kwargs)
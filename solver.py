@@ -0,0 +1,310 @@
+#!/usr/local/bin/python3
+
+"""
+Solves kakuro puzzles from their clue structure and saves the solutions.
+
+Candidate digits for each cell are held as bitmasks, with bit d set if digit d
+is still possible. Every run of cells is checked against a table, computed once
+at import, of the digit combinations which make up each (sum, run length) pair.
+The combinations still possible for each run are carried in the search state,
+so each branch only rescans combinations that haven't been ruled out.
+Constraints are propagated until nothing changes, and the search then branches
+on the cell with the fewest remaining candidates.
+"""
+
+import logging
+import time
+import logger
+import clue_reader
+from datastore_client import DatastoreClient
+from kakurizer_types import CellType, Solution
+
+ALL_DIGITS = 0b1111111110 # Bits 1 to 9
+
+
+def build_combinations():
+    """
+    :returns: Dict from (sum, run length) to a tuple of bitmasks, one for each set of
+              distinct digits with that sum and length
+    """
+    combinations = {}
+    for mask in range(2, ALL_DIGITS + 1, 2):
+        digits = [digit for digit in range(1, 10) if mask >> digit & 1]
+        combinations.setdefault((sum(digits), len(digits)), []).append(mask)
+    return {key: tuple(masks) for key, masks in combinations.items()}
+
+
+COMBINATIONS = build_combinations()
+BIT_COUNTS = tuple(bin(mask).count("1") for mask in range(ALL_DIGITS + 1))
+
+
+def solve():
+    """
+    Solves every puzzle in the database which has clues but no solution yet.
+    Puzzles with invalid clues or no solution are logged and left unchanged.
+    """
+    logger.setup_logger()
+    datastore = DatastoreClient()
+    for page in datastore.get_pages_with_clues(unsolved_only=True):
+        for entity in page:
+            try:
+                update_puzzle_with_solution(datastore, entity)
+            except ValueError as error:
+                logging.getLogger().warning("Unable to solve puzzle %s: %s", entity['id'], error)
+
+
+def update_puzzle_with_solution(datastore, entity):
+    """
+    Solves a puzzle and saves its solution to the database.
+
+    :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+    :param entity: database entry for a puzzle with has_clues set
+    :returns: None
+    :raises ValueError: if the clues are invalid or the puzzle has no solution
+    """
+    solution = Solver(clue_reader.get_clue_grid(entity)).solve()
+    if solution is None:
+        raise ValueError("No solution found for puzzle " + str(entity['id']))
+    set_solution(entity, solution)
+    datastore.update(entity)
+
+
+def set_solution(entity, solution):
+    """
+    Stores a solution on a puzzle entity and marks it as solved.
+
+    :param entity: database entry representing a puzzle
+    :param solution: kakurizer_types.Solution of the puzzle
+    :returns: None
+    """
+    entity['solution_data'] = solution.encode()
+    entity['has_solution'] = True
+    entity.exclude_from_indexes = set(entity.exclude_from_indexes) | {'solution_data'}
+
+
+def get_solution(entity):
+    """
+    :param entity: database entry for a puzzle with has_solution set
+    :returns: kakurizer_types.Solution stored on the entity
+    """
+    return Solution.decode(entity['solution_data'])
+
+
+def find_runs(grid):
+    """
+    Lists the runs of empty cells described by a clue structure.
+
+    :param grid: kakurizer_types.PuzzleGrid
+    :returns: List of (sum, tuple of row-major cell indexes) for each run
+    :raises ValueError: if a clue has no cells to sum or an impossible sum
+    """
+    size = grid.height * grid.width
+    runs = []
+    for index in range(size):
+        for total, step in ((grid.across[index], 1), (grid.down[index], grid.width)):
+            if not total:
+                continue
+            cells = []
+            position = index + step
+            while (position < size and (step != 1 or position % grid.width != 0)
+                   and grid.cells[position] == CellType.EMPTY.value):
+                cells.append(position)
+                position += step
+            if (total, len(cells)) not in COMBINATIONS:
+                raise ValueError("Impossible clue " + str(total) + " for run of "
+                                 + str(len(cells)) + " cells at cell " + str(index))
+            runs.append((total, tuple(cells)))
+    return runs
+
+
+class Solver:
+    """
+    Solves a single kakuro puzzle. Cells to fill in are numbered densely from zero
+    in row-major order, and the search state is a list of candidate bitmasks for
+    each cell along with a tuple of the digit combinations still possible for each run.
+    """
+
+    def __init__(self, grid):
+        """
+        :param grid: kakurizer_types.PuzzleGrid of the puzzle to solve
+        :raises ValueError: if the clues are invalid
+        """
+        runs = find_runs(grid)
+        self.height = grid.height
+        self.width = grid.width
+        self.positions = sorted({cell for _, cells in runs for cell in cells})
+        numbering = {position: cell for cell, position in enumerate(self.positions)}
+        self.run_cells = tuple(tuple(numbering[position] for position in cells)
+                               for _, cells in runs)
+        self.run_combinations = tuple(COMBINATIONS[(total, len(cells))] for total, cells in runs)
+        cell_runs = [[] for _ in self.positions]
+        for run, cells in enumerate(self.run_cells):
+            for cell in cells:
+                cell_runs[cell].append(run)
+        self.cell_runs = tuple(tuple(runs) for runs in cell_runs)
+        self.deadline = None
+
+
+    def solve(self, deadline=None):
+        """
+        :param deadline: If set, time.perf_counter() value after which to give up
+        :returns: kakurizer_types.Solution, or None if the puzzle has no solution
+        :raises TimeoutError: if the deadline passes before the search finishes
+        """
+        self.deadline = deadline
+        masks = [ALL_DIGITS] * len(self.positions)
+        options = list(self.run_combinations)
+        if not self.propagate(masks, options, list(range(len(self.run_cells)))):
+            return None
+        solved = self.search(masks, options)
+        if solved is None:
+            return None
+        digits = bytearray(self.height * self.width)
+        for position, mask in zip(self.positions, solved):
+            digits[position] = mask.bit_length() - 1
+        return Solution.from_digits(self.height, self.width, digits)
+
+
+    def search(self, masks, options):
+        """
+        Depth-first search over fully propagated states.
+
+        :param masks: List of candidate bitmasks, one per cell
+        :param options: List of tuples of combination bitmasks still possible, one per run
+        :returns: List of single-bit masks for a solution, or None if there isn't one
+        :raises TimeoutError: if the deadline passes
+        """
+        self.check_deadline()
+        best_cell = self.choose_cell(masks)
+        if best_cell is None:
+            return masks
+
+        remaining = masks[best_cell]
+        while remaining:
+            digit = remaining & -remaining
+            remaining ^= digit
+            trial = masks[:]
+            trial[best_cell] = digit
+            trial_options = options[:]
+            if self.propagate(trial, trial_options, list(self.cell_runs[best_cell])):
+                solved = self.search(trial, trial_options)
+                if solved is not None:
+                    return solved
+        return None
+
+
+    def check_deadline(self):
+        """
+        :raises TimeoutError: if the deadline has passed
+        """
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise TimeoutError("Gave up solving puzzle at deadline")
+
+
+    @staticmethod
+    def choose_cell(masks):
+        """
+        :param masks: List of candidate bitmasks, one per cell
+        :returns: Index of an unsolved cell with the fewest candidates, or None if all are solved
+        """
+        best_cell = None
+        best_count = 10
+        for cell, mask in enumerate(masks):
+            count = BIT_COUNTS[mask]
+            if 1 < count < best_count:
+                best_cell, best_count = cell, count
+                if count == 2:
+                    break
+        return best_cell
+
+
+    def propagate(self, masks, options, pending):
+        """
+        Narrows candidates in place until no run can narrow them any further. For
+        each run only the digit combinations still consistent with its cells are
+        kept; cells are limited to digits from those combinations and to digits
+        not already placed in the run, and a digit which every remaining
+        combination needs but only one cell can take is placed in that cell.
+
+        :param masks: List of candidate bitmasks, one per cell, which is updated
+        :param options: List of tuples of combinations still possible, one per run, which is updated
+        :param pending: List of run indexes which need checking
+        :returns: False if a contradiction was found, otherwise True
+        """
+        run_cells = self.run_cells
+        cell_runs = self.cell_runs
+        queued = set(pending)
+        while pending:
+            run = pending.pop(0)
+            queued.discard(run)
+            cells = run_cells[run]
+
+            placed = 0
+            available = 0
+            for cell in cells:
+                mask = masks[cell]
+                available |= mask
+                if mask & (mask - 1) == 0:
+                    if placed & mask:
+                        return False
+                    placed |= mask
+
+            allowed = 0
+            required = ALL_DIGITS
+            kept = []
+            for combination in options[run]:
+                if combination & placed != placed or combination & ~available:
+                    continue
+                covered = 0
+                for cell in cells:
+                    overlap = masks[cell] & combination
+                    if not overlap:
+                        break
+                    covered |= overlap
+                else:
+                    if covered == combination:
+                        allowed |= combination
+                        required &= combination
+                        kept.append(combination)
+            if not allowed:
+                return False
+            if len(kept) != len(options[run]):
+                options[run] = tuple(kept)
+
+            changed = []
+            for cell in cells:
+                mask = masks[cell]
+                narrowed = mask & allowed
+                if mask & (mask - 1):
+                    narrowed &= ~placed
+                if not narrowed:
+                    return False
+                if narrowed != mask:
+                    masks[cell] = narrowed
+                    changed.append(cell)
+
+            # Place any required digit which only one cell can take
+            once = 0
+            twice = 0
+            for cell in cells:
+                twice |= once & masks[cell]
+                once |= masks[cell]
+            if required & ~once:
+                return False
+            singles = required & ~twice & ~placed
+            if singles:
+                for cell in cells:
+                    single = masks[cell] & singles
+                    if single:
+                        if single & (single - 1):
+                            return False
+                        if masks[cell] != single:
+                            masks[cell] = single
+                            changed.append(cell)
+
+            for cell in changed:
+                for other_run in cell_runs[cell]:
+                    if other_run not in queued:
+                        queued.add(other_run)
+                        pending.append(other_run)
+        return True
@@ -0,0 +1,107 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the analyzer module which checks uniqueness and measures search effort.
+"""
+
+import unittest
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+import analyzer
+import clue_reader
+from kakurizer_types import CellType, PuzzleGrid
+
+EMPTY = CellType.EMPTY.value
+BLOCKED = CellType.BLOCKED.value
+CLUE = CellType.CLUE.value
+
+class InlinePool:
+    """
+    Stands in for multiprocessing.Pool by running tasks in the calling process.
+    """
+
+    def imap_unordered(self, func, tasks, chunk_size):
+        return map(func, tasks)
+
+
+class AnalyzerTest(unittest.TestCase):
+    """
+    Unit tests for the analyzer module.
+    """
+
+    cells = [BLOCKED, CLUE, CLUE, CLUE, EMPTY, EMPTY, CLUE, EMPTY, EMPTY]
+    unique = PuzzleGrid(3, 3, cells, [0, 0, 0, 10, 0, 0, 9, 0, 0], [0, 3, 16, 0, 0, 0, 0, 0, 0])
+    ambiguous = PuzzleGrid(3, 3, cells, [0, 0, 0, 10, 0, 0, 10, 0, 0],
+                           [0, 4, 16, 0, 0, 0, 0, 0, 0])
+
+    def test_unique(self):
+        """
+        Expect a unique puzzle to be proved unique with no branching needed.
+        """
+        analysis = analyzer.Analyzer(self.unique).analyze()
+        self.assertEqual(analysis.solutions, 1)
+        self.assertEqual(analysis.branches, 0)
+        self.assertEqual(analysis.max_depth, 0)
+        self.assertEqual(analysis.score, analysis.propagations)
+
+    def test_ambiguous(self):
+        """
+        Expect the search to stop at the second solution of an ambiguous puzzle.
+        """
+        analysis = analyzer.Analyzer(self.ambiguous).analyze()
+        self.assertEqual(analysis.solutions, 2)
+        self.assertGreater(analysis.branches, 0)
+        self.assertEqual(analysis.score,
+                         analysis.propagations + analyzer.BRANCH_WEIGHT * analysis.branches)
+        self.assertEqual(analyzer.Analyzer(self.ambiguous, limit=1).analyze().solutions, 1)
+
+    def test_no_solution(self):
+        """
+        Expect no solutions for contradictory clues.
+        """
+        grid = PuzzleGrid(3, 3, self.cells, self.unique.across, [0, 3, 17, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(analyzer.Analyzer(grid).analyze().solutions, 0)
+
+    def test_timeout(self):
+        """
+        Expect a timeout to be reported rather than raised by a worker.
+        """
+        self.assertIsNone(analyzer.analyze_task((self.ambiguous.encode(), -1.0))[1])
+
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_analyze_page(self, datastore_mock):
+        """
+        Expect duplicate grids to be analyzed once and analyzed puzzles to be skipped.
+        """
+        first = self.make_entity(1, "EASY", self.unique)
+        duplicate = self.make_entity(2, "EASY", self.unique)
+        ambiguous = self.make_entity(3, "HARD", self.ambiguous)
+        done = self.make_entity(4, "HARD", self.ambiguous)
+        analyzer.set_analysis(done, analyzer.Analyzer(self.ambiguous).analyze())
+        scores = {}
+
+        with mock.patch("analyzer.analyze_task", wraps=analyzer.analyze_task) as task:
+            analyzer.analyze_page(datastore_mock, InlinePool(),
+                                  [first, duplicate, ambiguous, done], scores)
+            self.assertEqual(task.call_count, 2)
+
+        datastore_mock.update_multi.assert_called_once_with([first, duplicate, ambiguous])
+        self.assertTrue(first['is_unique'])
+        self.assertTrue(duplicate['is_unique'])
+        self.assertFalse(ambiguous['is_unique'])
+        self.assertEqual(len(scores["HARD"]), 2)
+        self.assertIn("EASY", analyzer.format_scores(scores))
+
+    def make_entity(self, puzzle_id, difficulty, grid):
+        """
+        Make a puzzle entity with clues.
+        """
+        entity = Entity()
+        entity['id'] = puzzle_id
+        entity['difficulty'] = difficulty
+        clue_reader.set_clue_grid(entity, grid)
+        return entity
+
+
+if __name__ == '__main__':
+    unittest.main()
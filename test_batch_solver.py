@@ -0,0 +1,96 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the batch_solver module which solves puzzles across a process pool.
+"""
+
+import unittest
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+import batch_solver
+import clue_reader
+from kakurizer_types import CellType, PuzzleGrid
+
+EMPTY = CellType.EMPTY.value
+BLOCKED = CellType.BLOCKED.value
+CLUE = CellType.CLUE.value
+
+class InlinePool:
+    """
+    Stands in for multiprocessing.Pool by running tasks in the calling process.
+    """
+
+    def imap_unordered(self, func, tasks, chunk_size):
+        return map(func, tasks)
+
+
+class BatchSolverTest(unittest.TestCase):
+    """
+    Unit tests for the batch_solver module.
+    """
+
+    grid = PuzzleGrid(3, 3,
+                    [BLOCKED, CLUE, CLUE, CLUE, EMPTY, EMPTY, CLUE, EMPTY, EMPTY],
+                    [0, 0, 0, 10, 0, 0, 9, 0, 0],
+                    [0, 3, 16, 0, 0, 0, 0, 0, 0])
+
+    def test_solve_task(self):
+        """
+        Expect a solution with its timing for a solvable puzzle.
+        """
+        index, status, solution, seconds = batch_solver.solve_task((3, self.grid, 5.0))
+        self.assertEqual(index, 3)
+        self.assertEqual(status, batch_solver.SOLVED)
+        self.assertEqual(solution.digits, bytes([0, 0, 0, 0, 1, 9, 0, 2, 7]))
+        self.assertGreaterEqual(seconds, 0)
+
+    def test_solve_task_failures(self):
+        """
+        Expect timeouts, contradictions and invalid clues to be reported, not raised.
+        """
+        self.assertEqual(batch_solver.solve_task((0, self.grid, -1.0))[1],
+                         batch_solver.TIMED_OUT)
+        contradiction = PuzzleGrid(3, 3, self.grid.cells,
+                                   self.grid.across, [0, 3, 17, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(batch_solver.solve_task((0, contradiction, 5.0))[1],
+                         batch_solver.NO_SOLUTION)
+        invalid = PuzzleGrid(3, 3, self.grid.cells, [0, 0, 0, 18, 0, 0, 9, 0, 0], self.grid.down)
+        self.assertEqual(batch_solver.solve_task((0, invalid, 5.0))[1],
+                         batch_solver.INVALID)
+
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_solve_page(self, datastore_mock):
+        """
+        Expect solved puzzles to be saved together and results grouped by difficulty.
+        """
+        solvable = self.make_entity(1, "EASY", self.grid)
+        unsolvable = self.make_entity(2, "HARD",
+                                      PuzzleGrid(3, 3, self.grid.cells,
+                                                 self.grid.across, [0, 3, 17, 0, 0, 0, 0, 0, 0]))
+        results = {}
+
+        batch_solver.solve_page(datastore_mock, InlinePool(), [solvable, unsolvable],
+                                batch_solver.CHUNK_SIZE, 5.0, results)
+
+        datastore_mock.update_multi.assert_called_once_with([solvable])
+        self.assertTrue(solvable['has_solution'])
+        self.assertFalse(unsolvable['has_solution'])
+        self.assertEqual([status for status, _ in results["EASY"]], [batch_solver.SOLVED])
+        self.assertEqual([status for status, _ in results["HARD"]], [batch_solver.NO_SOLUTION])
+        report = batch_solver.format_results(results)
+        self.assertIn("HARD unsolved: 1 no_solution", report)
+
+    def make_entity(self, puzzle_id, difficulty, grid):
+        """
+        Make an unsolved puzzle entity with clues.
+        """
+        entity = Entity()
+        entity['id'] = puzzle_id
+        entity['difficulty'] = difficulty
+        entity['has_solution'] = False
+        clue_reader.set_clue_grid(entity, grid)
+        return entity
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the check module and the import cost of the entry points.
+"""
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import bench_startup
+import check
+
+
+class CheckTest(unittest.TestCase):
+    """
+    Unit tests for the check module.
+    """
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.state_path = os.path.join(temp_dir.name, "last_seen")
+        with open("test_index_page.html", "rb") as index_file:
+            self.content = index_file.read()
+
+    def test_latest_id(self):
+        """
+        Check the newest ID is read from the first headline of a saved real page.
+        """
+        self.assertEqual(check.latest_id(self.content.decode()), 1583)
+
+    def test_latest_id_no_headlines(self):
+        """
+        Check a page without puzzles is rejected.
+        """
+        with self.assertRaises(ValueError):
+            check.latest_id("<html></html>")
+
+    def test_last_seen(self):
+        """
+        Check the saved ID is read back, and nothing is read before it is saved.
+        """
+        self.assertIsNone(check.load_last_seen(self.state_path))
+        check.save_last_seen(1583, self.state_path)
+        self.assertEqual(check.load_last_seen(self.state_path), 1583)
+
+    @mock.patch("urllib.request.urlopen")
+    def test_check(self, urlopen_mock):
+        """
+        Check new puzzles are reported until their ID is saved.
+        """
+        urlopen_mock.side_effect = lambda *args, **kwargs: io.BytesIO(self.content)
+        self.assertEqual(check.check(self.state_path), 1583)
+        check.save_last_seen(1582, self.state_path)
+        self.assertEqual(check.check(self.state_path), 1583)
+        check.save_last_seen(1583, self.state_path)
+        self.assertIsNone(check.check(self.state_path))
+        self.assertEqual(urlopen_mock.call_args.args[0],
+                         "https://www.theguardian.com/lifeandstyle/series/kakuro?page=1")
+
+    @mock.patch("urllib.request.urlopen")
+    def test_exit_status(self, urlopen_mock):
+        """
+        Check new puzzles, nothing new and failures each exit with their own status.
+        """
+        urlopen_mock.side_effect = lambda *args, **kwargs: io.BytesIO(self.content)
+        for last_seen, status in ((1582, check.EXIT_NEW), (1583, check.EXIT_NOTHING_NEW)):
+            check.save_last_seen(last_seen, self.state_path)
+            with mock.patch("sys.argv", ["check.py", "--state", self.state_path]), \
+                 mock.patch("sys.stdout", io.StringIO()):
+                with self.assertRaises(SystemExit) as context:
+                    check.main()
+            self.assertEqual(context.exception.code, status)
+
+        urlopen_mock.side_effect = OSError("Network is unreachable")
+        with mock.patch("sys.argv", ["check.py", "--state", self.state_path]), \
+             mock.patch("sys.stderr", io.StringIO()) as stderr:
+            with self.assertRaises(SystemExit) as context:
+                check.main()
+        self.assertEqual(context.exception.code, check.EXIT_ERROR)
+        self.assertIn("Network is unreachable", stderr.getvalue())
+
+    def test_check_imports_light(self):
+        """
+        Check running a check doesn't import the rest of the project.
+        """
+        code = ("import io, sys, urllib.request, check\n"
+                "content = open('test_index_page.html', 'rb').read()\n"
+                "urllib.request.urlopen = lambda *args, **kwargs: io.BytesIO(content)\n"
+                "check.check(%r)\n"
+                "print(' '.join(m for m in ('index_scanner', 'datastore_client') if m in sys.modules))"
+                % self.state_path)
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(check.__file__)), check=True)
+        self.assertEqual(result.stdout.split(), [])
+
+    def test_entry_points_import_light(self):
+        """
+        Check importing the entry points doesn't load any heavy libraries.
+        """
+        for module in bench_startup.ENTRY_POINTS:
+            micros, loaded = bench_startup.measure_import(module)
+            self.assertGreater(micros, 0)
+            self.assertEqual(loaded, [], module)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the clue_reader module which reads clue numbers from puzzle images.
+"""
+
+import unittest
+from unittest import mock
+from io import BytesIO
+from PIL import Image
+from google.cloud.datastore.entity import Entity
+import clue_reader
+import grid_detector
+from kakurizer_types import CellType, PuzzleGrid
+from puzzle_generator import render as render_grid
+
+EMPTY = CellType.EMPTY.value
+BLOCKED = CellType.BLOCKED.value
+CLUE = CellType.CLUE.value
+
+class ClueReaderTest(unittest.TestCase):
+    """
+    Unit tests for the clue_reader module.
+    """
+
+    def setUp(self):
+        cache_patcher = mock.patch("grid_detector.LAYOUT_CACHE", grid_detector.LayoutCache(None))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    # Three by three puzzle with a unique solution of 1, 9 / 2, 7
+    small_grid = PuzzleGrid(3, 3,
+                          [BLOCKED, CLUE, CLUE, CLUE, EMPTY, EMPTY, CLUE, EMPTY, EMPTY],
+                          [0, 0, 0, 10, 0, 0, 9, 0, 0],
+                          [0, 3, 16, 0, 0, 0, 0, 0, 0])
+
+    def test_read_every_number(self):
+        """
+        Expect every possible clue sum to be read in both directions, both at the
+        size of scraped images and larger.
+        """
+        numbers = list(range(1, 46)) + [0] * 3
+        across = numbers
+        down = numbers[::-1]
+        grid = PuzzleGrid(6, 8, [CLUE] * 48, across, down)
+        for cell_size in (40, 56):
+            result = clue_reader.read_clue_grids([render_grid(grid, cell_size=cell_size)])[0]
+            self.assertEqual(result.across, bytes(across))
+            self.assertEqual(result.down, bytes(down))
+
+    def test_read_small_digits(self):
+        """
+        Expect digits drawn at one pixel per font pixel to be read.
+        """
+        result = clue_reader.read_clue_grids([render_grid(self.small_grid, cell_size=36,
+                                                          digit_scale=1)])[0]
+        self.assertEqual(result, self.small_grid)
+
+    def test_read_batch(self):
+        """
+        Expect a batch to keep its order and skip images with no grid.
+        """
+        blank = BytesIO()
+        Image.new("L", (60, 60), 255).save(blank, format="PNG")
+        grids = clue_reader.read_clue_grids([render_grid(self.small_grid), blank.getvalue(),
+                                             render_grid(self.small_grid, cell_size=48)])
+        self.assertEqual(grids[0], self.small_grid)
+        self.assertIsNone(grids[1])
+        self.assertEqual(grids[2], self.small_grid)
+
+    def test_is_consistent(self):
+        """
+        Expect clue structures which don't match the cells to be rejected.
+        """
+        self.assertTrue(clue_reader.is_consistent(self.small_grid))
+        missing_sum = PuzzleGrid(3, 3, self.small_grid.cells, [0] * 9, self.small_grid.down)
+        self.assertFalse(clue_reader.is_consistent(missing_sum))
+        extra_sum = PuzzleGrid(3, 3, self.small_grid.cells,
+                               self.small_grid.across, [0, 3, 16, 5, 0, 0, 0, 0, 0])
+        self.assertFalse(clue_reader.is_consistent(extra_sum))
+        for sums in ([0, 0, 0, 2, 0, 0, 9, 0, 0], [0, 0, 0, 10, 0, 0, 18, 0, 0]):
+            impossible_sum = PuzzleGrid(3, 3, self.small_grid.cells, sums, self.small_grid.down)
+            self.assertFalse(clue_reader.is_consistent(impossible_sum))
+        for length in (9, 10):
+            run = PuzzleGrid(2, length + 1, [BLOCKED] + [CLUE] * length + [CLUE] + [EMPTY] * length,
+                             [0] * (length + 1) + [45] + [0] * length,
+                             [0] + [5] * length + [0] * (length + 1))
+            self.assertEqual(clue_reader.is_consistent(run), length == 9)
+
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_update_puzzles(self, datastore_mock):
+        """
+        Expect readable puzzles to be saved with their clues in one batch.
+        """
+        readable = Entity()
+        readable['id'] = 1
+        readable['img_blob'] = render_grid(self.small_grid)
+        readable.exclude_from_indexes = ('img_blob',) # As left by img_finder
+        unreadable = Entity()
+        unreadable['id'] = 2
+        unreadable['img_blob'] = b"not an image"
+        unreadable['has_clues'] = False
+
+        clue_reader.update_puzzles_with_clues(datastore_mock, [readable, unreadable])
+
+        saved = datastore_mock.update_multi.call_args_list[0][0][0]
+        self.assertEqual(saved, [readable])
+        self.assertTrue(readable['has_clues'])
+        self.assertEqual(clue_reader.get_clue_grid(readable), self.small_grid)
+        self.assertEqual(readable.exclude_from_indexes, {'img_blob', 'grid_data'})
+        self.assertFalse(unreadable['has_clues'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,21 @@
 
 """
 Tests for DatastoreClient() which wraps access to the Google Cloud
-Datastore for Kakuro puzzles. These tests use the Cloud Datastore
+Datastore for Kakuro puzzles. Most of these tests use the Cloud Datastore
 Emulator which must be installed locally.
 """
 
 import unittest
 import os
+import tempfile
+from unittest import mock
 import pexpect
+from google.api_core.exceptions import InvalidArgument
+from google.cloud.datastore.entity import Entity
+from google.cloud.datastore.key import Key
+import datastore_client
 from datastore_client import DatastoreClient
-from kakurizer_types import IndexPuzzle
+from kakurizer_types import IndexPuzzle, index_hash
 
 class IndexScannerTest(unittest.TestCase):
     """
@@ -102,5 +108,230 @@ class IndexScannerTest(unittest.TestCase):
         self.assertEqual(results[0]['difficulty'], puzzle.difficulty)
 
 
+    def test_update_index_puzzles(self):
+        """
+        Check changed index fields are saved with a new hash, leaving other fields alone.
+        """
+        db_client = DatastoreClient()
+        puzzle = IndexPuzzle(id=1, timestamp_millis=123, page_url="link", difficulty="HARD")
+        entity = db_client.put_index_puzzles([puzzle])[0]
+        entity['img_url'] = "wheel.jpg"
+        db_client.update(entity)
+        key, stored_hash = db_client.get_index_hashes()[1]
+        self.assertEqual(stored_hash, index_hash(puzzle))
+
+        corrected = puzzle._replace(difficulty="MEDIUM")
+        self.assertEqual(len(db_client.update_index_puzzles([(key, corrected)])), 1)
+        result = db_client.get_index_puzzles()[0]
+        self.assertEqual(result['difficulty'], "MEDIUM")
+        self.assertEqual(result['img_url'], "wheel.jpg")
+        self.assertEqual(db_client.get_index_hashes()[1][1], index_hash(corrected))
+
+
+    def test_export_import(self):
+        """
+        Check a snapshot exported from the database can be imported back with the same keys.
+        """
+        db_client = DatastoreClient()
+
+        puzzles = [IndexPuzzle(id=i, timestamp_millis=i * 100, page_url="link", difficulty="EASY")
+                   for i in range(1, 4)]
+        db_client.put_index_puzzles(puzzles)
+        entity = db_client.get_index_puzzles()[0]
+        entity['img_blob'] = b"image"
+        entity.exclude_from_indexes = ('img_blob',)
+        db_client.update(entity)
+        original_keys = sorted(e.key.id for page in db_client.get_all_pages() for e in page)
+
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.assertEqual(db_client.export_puzzles(path), 3)
+            db_client.client.delete_multi([db_client.client.key("kakuro", key_id)
+                                           for key_id in original_keys])
+            self.assertEqual(tuple(db_client.get_ids()), tuple())
+            self.assertEqual(db_client.import_puzzles(path), 3)
+        finally:
+            os.remove(path)
+
+        restored = [e for page in db_client.get_all_pages(page_size=2) for e in page]
+        self.assertEqual(sorted(e.key.id for e in restored), original_keys)
+        blobs = [e['img_blob'] for e in restored if 'img_blob' in e]
+        self.assertEqual(blobs, [b"image"])
+
+
+class WriteBatchingTest(unittest.TestCase):
+    """
+    Unit tests for packing writes into batches, which don't need the emulator.
+    """
+
+    def make_entities(self, count, blob_size=0):
+        entities = []
+        for puzzle_id in range(1, count + 1):
+            entity = Entity(key=Key("kakuro", puzzle_id, project="kakurizer"))
+            entity['id'] = puzzle_id
+            entity['img_blob'] = b"\0" * blob_size
+            entities.append(entity)
+        return entities
+
+    def test_estimate_size(self):
+        """
+        Check estimated sizes grow with the bytes and text an entity holds.
+        """
+        small, large = self.make_entities(2, 1000)
+        large['img_blob'] = b"\0" * 5000
+        large['page_url'] = "https://www.theguardian.com/kakuro"
+        difference = datastore_client.estimate_size(large) - datastore_client.estimate_size(small)
+        self.assertEqual(difference, 4000 + len("page_url") + 8 + 34)
+
+    def test_put_batches(self):
+        """
+        Check batches are limited by count and by size, with oversized entities on their own.
+        """
+        by_count = datastore_client.put_batches(self.make_entities(5), 2, 10 ** 6)
+        self.assertEqual([len(batch) for batch in by_count], [2, 2, 1])
+
+        entities = self.make_entities(6, 400 * 1024)
+        entities[3]['img_blob'] = b"\0" * (1200 * 1024)
+        by_size = list(datastore_client.put_batches(entities, 500, 1024 * 1024))
+        self.assertEqual([len(batch) for batch in by_size], [2, 1, 1, 2])
+        self.assertEqual([entity for batch in by_size for entity in batch], entities)
+        self.assertEqual(list(datastore_client.put_batches([], 500, 1024)), [])
+
+    def test_rejected_batch_split(self):
+        """
+        Check a batch rejected as too large is saved in smaller pieces.
+        """
+        db_client = make_client()
+        saved = []
+        def put_multi(batch):
+            if len(batch) > 2:
+                raise InvalidArgument("Request payload size exceeds the limit")
+            saved.extend(batch)
+        db_client.client.put_multi.side_effect = put_multi
+        entities = self.make_entities(5)
+        db_client.update_multi(entities)
+        self.assertEqual(saved, entities)
+        self.assertTrue(all('updated_millis' in entity for entity in entities))
+        put_multi = db_client.usage.report()[0]
+        self.assertEqual((put_multi.requests, put_multi.entities), (5, 5))
+
+        db_client.client.put_multi.side_effect = InvalidArgument("Entity is too big")
+        with self.assertRaises(InvalidArgument):
+            db_client.update_multi(entities[:1])
+
+    def test_invalid_batch_not_split(self):
+        """
+        Check a batch rejected for anything but its size fails at once, without partial writes.
+        """
+        db_client = make_client()
+        db_client.client.put_multi.side_effect = InvalidArgument("A property has an invalid value")
+        with self.assertRaises(InvalidArgument):
+            db_client.update_multi(self.make_entities(5))
+        self.assertEqual(db_client.client.put_multi.call_count, 1)
+
+
+class UsageTest(unittest.TestCase):
+    """
+    Unit tests for counting requests and estimating their cost, which don't need the emulator.
+    """
+
+    def make_page(self, first_id, count):
+        page = []
+        for puzzle_id in range(first_id, first_id + count):
+            entity = Entity(key=Key("kakuro", puzzle_id, project="kakurizer"))
+            entity['id'] = puzzle_id
+            page.append(entity)
+        return page
+
+    def test_query_usage(self):
+        """
+        Check each page of a query is counted as a request, with its entities and bytes.
+        """
+        db_client = make_client()
+        pages = [self.make_page(1, 3), self.make_page(4, 2)]
+        db_client.client.query.return_value.fetch.return_value.pages = iter(pages)
+        self.assertEqual(len(db_client.get_index_puzzles()), 5)
+        db_client.client.query.return_value.fetch.return_value.pages = iter(pages)
+        self.assertEqual(list(db_client.get_ids()), [1, 2, 3, 4, 5])
+
+        usages = {usage.operation: usage for usage in db_client.usage.report()}
+        self.assertEqual(usages['get_index_puzzles'][1:5],
+                         (datastore_client.READ, 2, 5,
+                          sum(datastore_client.estimate_size(entity)
+                              for page in pages for entity in page)))
+        self.assertEqual(usages['get_ids'][1:3], (datastore_client.PROJECTION, 2))
+
+    def test_untranscoded_pages(self):
+        """
+        Check only puzzles with images not transcoded at the version are loaded in full.
+        """
+        db_client = make_client()
+        with_images, transcoded = mock.Mock(), mock.Mock()
+        with_images.fetch.return_value.pages = iter([self.make_page(1, 3), self.make_page(4, 2)])
+        transcoded.fetch.return_value.pages = iter([self.make_page(2, 2)])
+        db_client.client.query.side_effect = [with_images, transcoded]
+        db_client.client.get_multi.side_effect = lambda keys: [
+            page[0] for page in (self.make_page(key.id, 1) for key in keys)]
+
+        pages = list(db_client.get_untranscoded_pages(7, page_size=2))
+
+        self.assertEqual([[entity['id'] for entity in page] for page in pages], [[1, 4], [5]])
+        with_images.add_filter.assert_called_once_with('has_img', '=', True)
+        with_images.keys_only.assert_called_once_with()
+        transcoded.add_filter.assert_called_once_with('transcode_version', '=', 7)
+        transcoded.keys_only.assert_called_once_with()
+        usages = {usage.operation: usage for usage in db_client.usage.report()}
+        self.assertEqual(usages['get_untranscoded_pages'][1:4], (datastore_client.PROJECTION, 3, 7))
+        self.assertEqual(usages['get_multi'][1:4], (datastore_client.READ, 2, 3))
+
+    def test_report(self):
+        """
+        Check costs follow the price model for each kind of operation, and are logged.
+        """
+        prices = datastore_client.DatastorePrices(entity_read=1.0, entity_write=10.0,
+                                                  small_operation=0.5, gib_transferred=100.0)
+        usage = datastore_client.DatastoreUsage(prices)
+        usage.record("get_multi", datastore_client.READ, entities=3, size=1024 ** 3)
+        usage.record("get_ids", datastore_client.PROJECTION, entities=1000)
+        usage.record("get_ids", datastore_client.PROJECTION, entities=200, seconds=0.5)
+        usage.record("allocate_ids", datastore_client.SMALL_OPERATION, entities=4)
+        usage.record("put_multi", datastore_client.WRITE, entities=2)
+
+        report = usage.report()
+        self.assertEqual([(item.operation, item.cost) for item in report],
+                         [("get_ids", 602.0), ("get_multi", 103.0), ("put_multi", 20.0),
+                          ("allocate_ids", 2.0)])
+        self.assertEqual(report[0].requests, 2)
+        self.assertEqual(report[0].seconds, 0.5)
+        with self.assertLogs(level="INFO") as logs:
+            usage.log_report()
+        self.assertEqual(len(logs.records), 5)
+        self.assertIn("$727.000000", logs.records[-1].getMessage())
+
+        with self.assertNoLogs(level="INFO"):
+            datastore_client.DatastoreUsage().log_report()
+
+    def test_report_registered_once(self):
+        """
+        Check the usage report is only registered to run at exit once per process.
+        """
+        with mock.patch("datastore_client._report_registered", False), \
+                mock.patch("atexit.register") as register:
+            datastore_client.report_usage_at_exit()
+            datastore_client.report_usage_at_exit()
+        register.assert_called_once_with(datastore_client.USAGE.log_report)
+
+
+def make_client():
+    """
+    :returns: DatastoreClient with a mock in place of the Google client
+    """
+    db_client = DatastoreClient.__new__(DatastoreClient)
+    db_client.client = mock.Mock()
+    db_client.usage = datastore_client.DatastoreUsage()
+    return db_client
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,174 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the grid_detector module which finds the cell lattice in puzzle images.
+"""
+
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+import numpy as np
+from PIL import Image, ImageDraw
+import grid_detector
+from kakurizer_types import CellType
+
+EMPTY = CellType.EMPTY.value
+BLOCKED = CellType.BLOCKED.value
+CLUE = CellType.CLUE.value
+
+class GridDetectorTest(unittest.TestCase):
+    """
+    Unit tests for the grid_detector module.
+    """
+
+    def setUp(self):
+        cache_patcher = mock.patch("grid_detector.LAYOUT_CACHE", grid_detector.LayoutCache(None))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    cells = np.array([
+        [BLOCKED, CLUE, CLUE, BLOCKED, BLOCKED],
+        [CLUE, EMPTY, EMPTY, CLUE, CLUE],
+        [CLUE, EMPTY, EMPTY, EMPTY, EMPTY],
+        [BLOCKED, CLUE, EMPTY, EMPTY, BLOCKED],
+        [BLOCKED, BLOCKED, BLOCKED, BLOCKED, BLOCKED],
+    ], dtype=np.uint8)
+
+    def test_detect_grid(self):
+        """
+        Expect the lattice and cell types to be found in a rendered puzzle.
+        """
+        geometry = grid_detector.detect_grid(render_cells(self.cells, cell_size=30))
+        self.assertEqual(geometry.cells.shape, (5, 5))
+        np.testing.assert_array_equal(geometry.cells, self.cells)
+        np.testing.assert_allclose(np.diff(geometry.row_edges), 30, atol=1)
+        np.testing.assert_allclose(np.diff(geometry.col_edges), 30, atol=1)
+
+    def test_detect_batch_mixed_sizes(self):
+        """
+        Expect a batch with several image sizes to keep its order.
+        """
+        small = np.full((3, 4), EMPTY, dtype=np.uint8)
+        small[0, :] = CLUE
+        blobs = [render_cells(self.cells, cell_size=30),
+                 render_cells(small, cell_size=24),
+                 render_cells(self.cells.T, cell_size=30)]
+        results = grid_detector.detect_grids(blobs)
+        np.testing.assert_array_equal(results[0].cells, self.cells)
+        np.testing.assert_array_equal(results[1].cells, small)
+        np.testing.assert_array_equal(results[2].cells, self.cells.T)
+
+    def test_unparseable_in_batch(self):
+        """
+        Expect images which can't be read to be skipped without failing the batch.
+        """
+        results = grid_detector.detect_grids([b"not an image", render_cells(self.cells)])
+        self.assertIsNone(results[0])
+        np.testing.assert_array_equal(results[1].cells, self.cells)
+
+    def test_no_grid(self):
+        """
+        Expect an error for an image with no grid lines.
+        """
+        blank = BytesIO()
+        Image.new("L", (100, 100), 255).save(blank, format="PNG")
+        with self.assertRaises(ValueError):
+            grid_detector.detect_grid(blank.getvalue())
+
+
+class LayoutCacheTest(unittest.TestCase):
+    """
+    Unit tests for reusing grid layouts between images.
+    """
+
+    cells = GridDetectorTest.cells
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "layouts.json")
+        self.cache = grid_detector.LayoutCache(self.path)
+
+    def detect(self, cells, cell_size):
+        images = grid_detector.load_greyscale_batch([render_cells(cells, cell_size=cell_size)])
+        return grid_detector.detect_grids_in_images(images, self.cache)[0]
+
+    def test_reuses_layout(self):
+        """
+        Expect a puzzle with the same layout but different cells to reuse the lattice,
+        including from a new cache loaded from disk.
+        """
+        first = self.detect(self.cells, 30)
+        other_cells = self.cells.copy()
+        other_cells[2, 1:3] = BLOCKED
+        second = self.detect(other_cells, 30)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        np.testing.assert_array_equal(second.cells, other_cells)
+        np.testing.assert_array_equal(second.row_edges, first.row_edges)
+
+        self.cache = grid_detector.LayoutCache(self.path)
+        np.testing.assert_array_equal(self.detect(self.cells, 30).cells, self.cells)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_rejects_other_lattice(self):
+        """
+        Expect grids of the same size and extent but with more or fewer cells not
+        to be given the cached lattice.
+        """
+        self.detect(self.cells, 30)
+        fewer_cells = self.detect(self.cells[:3, :3], 50)
+        np.testing.assert_array_equal(fewer_cells.cells, self.cells[:3, :3])
+        more_cells = np.pad(self.cells, ((0, 1), (0, 1)), constant_values=EMPTY)
+        more_cells[5, 0] = CLUE
+        np.testing.assert_array_equal(self.detect(more_cells, 25).cells, more_cells)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 3))
+        self.assertEqual(len(self.cache.layouts), 1)
+
+    def test_least_recently_used_evicted(self):
+        """
+        Expect the least recently used layout to be dropped once the cache is full.
+        """
+        cache = grid_detector.LayoutCache(self.path, max_entries=2)
+        edges = np.array([0.0, 10.0])
+        for fingerprint in ("a", "b"):
+            cache.put(fingerprint, edges, edges)
+        cache.get("a")
+        cache.put("c", edges, edges)
+        cache.save()
+        reloaded = grid_detector.LayoutCache(self.path)
+        self.assertIsNone(reloaded.get("b"))
+        np.testing.assert_array_equal(reloaded.get("a")[1], edges)
+        self.assertEqual(list(reloaded.layouts), ["c", "a"])
+
+
+def render_cells(cells, cell_size=32, line_width=2):
+    """
+    Draws a grid in the Guardian's style: black blocked cells, shaded clue cells
+    split by a diagonal and white empty cells.
+
+    :returns: image as PNG bytes
+    """
+    rows, cols = cells.shape
+    image = Image.new("L", (cols * cell_size + line_width, rows * cell_size + line_width), 255)
+    draw = ImageDraw.Draw(image)
+    for (row, col), cell in np.ndenumerate(cells):
+        left, top = col * cell_size, row * cell_size
+        right, bottom = left + cell_size, top + cell_size
+        if cell == BLOCKED:
+            draw.rectangle((left, top, right, bottom), fill=0)
+        elif cell == CLUE:
+            draw.rectangle((left, top, right, bottom), fill=160)
+            draw.line((left, top, right, bottom), fill=0, width=line_width)
+    for row in range(rows + 1):
+        draw.rectangle((0, row * cell_size, image.width, row * cell_size + line_width - 1), fill=0)
+    for col in range(cols + 1):
+        draw.rectangle((col * cell_size, 0, col * cell_size + line_width - 1, image.height), fill=0)
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the image_archive module which packs puzzle images into a memory-mapped file.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+import image_archive
+from datastore_client import DatastoreClient
+
+IMAGES = {42: b"\x89PNG first", 7: b"GIF89a second", 1000: b"", 13: b"\xff\xd8 fourth"}
+
+
+def image_checksum(puzzle_id):
+    return hashlib.sha256(image_archive.worker_image(puzzle_id)).hexdigest()
+
+
+class ImageArchiveTest(unittest.TestCase):
+    """
+    Unit tests for the image_archive module.
+    """
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "images.kkri")
+
+    def write(self, images):
+        with image_archive.ArchiveWriter(self.path) as writer:
+            for puzzle_id, blob in images.items():
+                writer.add(puzzle_id, blob)
+
+    def test_round_trip(self):
+        """
+        Expect every image to be found by ID as a slice of the mapping, in ID order.
+        """
+        self.write(IMAGES)
+        with image_archive.ImageArchive(self.path) as archive:
+            self.assertEqual(len(archive), 4)
+            image = archive[42]
+            self.assertIsInstance(image, memoryview)
+            self.assertIs(image.obj, archive.map)
+            self.assertEqual(image, IMAGES[42])
+            self.assertEqual([(puzzle_id, bytes(blob)) for puzzle_id, blob in archive.items()],
+                             sorted(IMAGES.items()))
+            self.assertIn(1000, archive)
+            self.assertIsNone(archive.get(8))
+            with self.assertRaises(KeyError):
+                archive[-1]
+            del image
+
+    def test_close_with_slices_in_use(self):
+        """
+        Expect closing an archive not to fail while a slice is still referenced.
+        """
+        self.write(IMAGES)
+        archive = image_archive.ImageArchive(self.path)
+        image = archive[7]
+        archive.close()
+        self.assertEqual(image, IMAGES[7])
+
+    def test_empty(self):
+        """
+        Expect an archive with no images to open and find nothing.
+        """
+        self.write({})
+        with image_archive.ImageArchive(self.path) as archive:
+            self.assertEqual(len(archive), 0)
+            self.assertIsNone(archive.get(1))
+
+    def test_invalid(self):
+        """
+        Expect errors for duplicate IDs, and for files which aren't complete archives.
+        """
+        with self.assertRaises(ValueError):
+            with image_archive.ArchiveWriter(self.path) as writer:
+                writer.add(1, b"one")
+                writer.add(1, b"again")
+        self.assertFalse(os.path.exists(self.path))
+        with open(self.path, "wb") as archive_file:
+            archive_file.write(b"KKRX not an image archive at all")
+        with self.assertRaises(ValueError):
+            image_archive.ImageArchive(self.path)
+        self.write(IMAGES)
+        with open(self.path, "r+b") as archive_file:
+            archive_file.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ValueError):
+            image_archive.ImageArchive(self.path)
+
+    def test_failed_write(self):
+        """
+        Expect an archive whose writing fails part way through to leave no file behind.
+        """
+        with self.assertRaises(RuntimeError):
+            with image_archive.ArchiveWriter(self.path) as writer:
+                writer.add(1, b"one")
+                raise RuntimeError("Query failed")
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_pool_workers(self):
+        """
+        Expect each worker process to look images up in its own mapping of the archive.
+        """
+        self.write(IMAGES)
+        with multiprocessing.Pool(2, initializer=image_archive.init_worker,
+                                  initargs=(self.path,)) as pool:
+            checksums = pool.map(image_checksum, sorted(IMAGES))
+        self.assertEqual(checksums, [hashlib.sha256(IMAGES[puzzle_id]).hexdigest()
+                                     for puzzle_id in sorted(IMAGES)])
+
+    def test_export_images(self):
+        """
+        Expect the datastore client to write the image of every puzzle returned.
+        """
+        pages = []
+        for puzzle_id, blob in IMAGES.items():
+            entity = Entity()
+            entity['id'] = puzzle_id
+            entity['img_blob'] = blob
+            pages.append([entity])
+        datastore_mock = mock.Mock()
+        datastore_mock.get_pages_with_images.return_value = pages
+        self.assertEqual(DatastoreClient.export_images(datastore_mock, self.path), 4)
+        with image_archive.ImageArchive(self.path) as archive:
+            self.assertEqual(archive[13], IMAGES[13])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,17 +5,28 @@ Tests for img_finder module which updates a database entity with details of the
 puzzle image.
 """
 
+import tempfile
 import unittest
+from io import BytesIO
 from unittest import mock
 import requests_mock
+from PIL import Image
 from google.cloud.datastore.entity import Entity
 import img_finder
+import rate_limiter
 
 class ImageFinderTest(unittest.TestCase):
     """
     Unit tests for the img_finder script.
     """
 
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        limiter_patcher = mock.patch("rate_limiter.LIMITER", rate_limiter.RateLimiter(temp_dir.name))
+        limiter_patcher.start()
+        self.addCleanup(limiter_patcher.stop)
+
     @requests_mock.mock()
     @mock.patch("datastore_client.DatastoreClient")
     def test_simple_case(self, request_mock, datastore_mock):
@@ -48,11 +59,12 @@ class ImageFinderTest(unittest.TestCase):
         self.assertTrue(result['has_img'])
         self.assertEqual(result['page_url'], page_url)
         self.assertEqual(result['img_url'], img_url)
+        self.assertEqual(result['img_source_width'], 400)
         self.assertEqual(result['img_width'], 36)
         self.assertEqual(result['img_height'], 36)
         self.assertEqual(result['img_format'], 'PNG')
         self.assertEqual(result['img_blob'], img_bytes)
-        self.assertEqual(result.exclude_from_indexes, ('img_blob',))
+        self.assertEqual(result.exclude_from_indexes, {'img_blob'})
 
 
     @requests_mock.mock()
@@ -95,7 +107,7 @@ class ImageFinderTest(unittest.TestCase):
         # random small image file, found online (http://png-pixel.com/1x1-png-pixel.png)
         img_bytes = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00$\x00\x00\x00$\x08\x06\x00\x00\x00\xe1\x00\x98\x98\x00\x00\x00\x04sBIT\x08\x08\x08\x08|\x08d\x88\x00\x00\x00\tpHYs\x00\x00\x12$\x00\x00\x12$\x01hSJ\xdb\x00\x00\x00\x19tEXtSoftware\x00www.inkscape.org\x9b\xee<\x1a\x00\x00\x00\x7fIDATX\x85\xed\xd81\n\xc0 \x10D\xd1Q\xac\xd6\xde+\xe5\xcc\xb9\x92\x07X\x92\xc6\xa4\r\x01\x1dRH,\xe6\xb7\x82>\xd8j\r\x00.\xac\xd3\x19\xff\x16\xbc\x13\x88%\x10+\xf5\x0ej\xad\xbb\x99\xb5\x19\x8f\xba{,\xa5l\x9f@f\xd6r\xceS@\xa3\x96\x1b\x99@,\x81X\x02\xb1\x04b\t\xc4\x12\x88%\x10K \x96@,\x81X\xdd\xad\xc3\xdd\xa7aGw\x07\xe8\xf7c\x9c@\xac\xe5@\t\xc0\xf97\xe2\xd1q\x03\x0fe\x163\xa1a.O\x00\x00\x00\x00IEND\xaeB`\x82'
 
-        original_entity = Entity()
+        original_entity = Entity(exclude_from_indexes=('grid_data',))
         original_entity['id'] = puzzle_id
         original_entity['page_url'] = page_url
 
@@ -113,11 +125,68 @@ class ImageFinderTest(unittest.TestCase):
         self.assertTrue(result['has_img'])
         self.assertEqual(result['page_url'], page_url)
         self.assertEqual(result['img_url'], img_url)
+        self.assertEqual(result['img_source_width'], 600)
         self.assertEqual(result['img_width'], 36)
         self.assertEqual(result['img_height'], 36)
         self.assertEqual(result['img_format'], 'PNG')
         self.assertEqual(result['img_blob'], img_bytes)
-        self.assertEqual(result.exclude_from_indexes, ('img_blob',))
+        self.assertEqual(result.exclude_from_indexes, {'grid_data', 'img_blob'})
+
+
+    @requests_mock.mock()
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_smallest_adequate_source(self, request_mock, datastore_mock):
+        """
+        Expect it to pick the narrowest image at least as wide as the target
+        """
+        page_url = "http://page.html"
+        page_content = """
+        <html><picture>
+        <source media="(min-width: 660px)" sizes="620px"
+                srcset="http://image.jpg?width=620&amp;s=a 620w, http://image.jpg?width=1240&amp;s=b 1240w"/>
+        <source sizes="(max-width: 300px) 300px, 445px"
+                srcset="http://image.jpg?width=445&amp;s=c 1x, http://image.jpg?width=890&amp;s=d 2x"/>
+        </picture></html>"""
+        img_bytes = BytesIO()
+        Image.new("L", (36, 36)).save(img_bytes, "PNG")
+
+        original_entity = Entity()
+        original_entity['id'] = 1245
+        original_entity['page_url'] = page_url
+        request_mock.get(page_url, text=page_content)
+        request_mock.get("http://image.jpg", content=img_bytes.getvalue())
+
+        img_finder.update_puzzle_with_image(datastore_mock, original_entity)
+        result = datastore_mock.update.call_args_list[0][0][0]
+        self.assertEqual(result['img_url'], "http://image.jpg?width=620&s=a")
+        self.assertEqual(result['img_source_width'], 620)
+
+        img_finder.update_puzzle_with_image(datastore_mock, original_entity, target_width=800)
+        result = datastore_mock.update.call_args_list[1][0][0]
+        self.assertEqual(result['img_url'], "http://image.jpg?width=890&s=d")
+        self.assertEqual(result['img_source_width'], 890)
+
+        img_finder.update_puzzle_with_image(datastore_mock, original_entity, target_width=2000)
+        result = datastore_mock.update.call_args_list[2][0][0]
+        self.assertEqual(result['img_url'], "http://image.jpg?width=1240&s=b")
+
+
+    def test_parse_srcset(self):
+        """
+        Expect srcset candidates to be split on commas between candidates but not inside URLs
+        """
+        self.assertEqual(img_finder.parse_srcset(" a.jpg?x=1,2 640w 2x,b.jpg, c.jpg 3x "),
+                         [("a.jpg?x=1,2", ["640w", "2x"]), ("b.jpg", []), ("c.jpg", ["3x"])])
+        self.assertEqual(img_finder.parse_srcset(""), [])
+
+
+    def test_source_candidates(self):
+        """
+        Expect widths from width descriptors, or from sizes scaled by density
+        """
+        self.assertEqual(img_finder.source_candidates("a 1x, b 1.5x, c 300w, d bad", "200px"),
+                         [("a", 200), ("b", 300), ("c", 300), ("d", 200)])
+        self.assertEqual(img_finder.source_candidates("a 2x", "100vw"), [("a", None)])
 
 
     @requests_mock.mock()
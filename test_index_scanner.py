@@ -4,12 +4,14 @@
 Tests the index_scanner script.
 """
 
+import tempfile
 import unittest
 from unittest import mock
 import requests_mock
 import bs4
 import index_scanner
-from kakurizer_types import IndexPuzzle
+import rate_limiter
+from kakurizer_types import IndexPuzzle, index_hash
 
 class IndexScannerTest(unittest.TestCase):
     """
@@ -224,6 +226,12 @@ class IndexScannerTest(unittest.TestCase):
             difficulty='HARD'),
     }
 
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        limiter_patcher = mock.patch("rate_limiter.LIMITER", rate_limiter.RateLimiter(temp_dir.name))
+        limiter_patcher.start()
+        self.addCleanup(limiter_patcher.stop)
 
     @requests_mock.mock()
     @mock.patch("datastore_client.DatastoreClient")
@@ -268,6 +276,31 @@ class IndexScannerTest(unittest.TestCase):
         self.assertEqual(index_scanner.get_new_puzzles(datastore_mock), expected)
 
 
+    @requests_mock.mock()
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_verify_index(self, request_mock, datastore_mock):
+        """
+        Check only puzzles whose stored hash differs or is missing are written back.
+        """
+        url = "https://www.theguardian.com/lifeandstyle/series/kakuro?page="
+        with open("test_index_page.html") as real_index_file:
+            request_mock.get(url + "1", text=real_index_file.read())
+        request_mock.get(url + "2", text="<html></html>")
+
+        stored = {puzzle_id: ("key%s" % puzzle_id, index_hash(puzzle))
+                  for puzzle_id, puzzle in self.real_puzzles.items() if puzzle_id >= 1570}
+        stored[1583] = ("key1583", index_hash(self.real_puzzles[1583]._replace(difficulty="HARD")))
+        stored[1575] = ("key1575", None)
+        datastore_mock.get_index_hashes.return_value = stored
+        datastore_mock.MAX_PUT_SIZE = 500
+        datastore_mock.update_index_puzzles.side_effect = lambda changes: changes
+
+        self.assertEqual(index_scanner.verify_index(datastore_mock), 2)
+        datastore_mock.get_index_hashes.assert_called_once_with(1564, 1583)
+        datastore_mock.update_index_puzzles.assert_called_once_with(
+            [("key1583", self.real_puzzles[1583]), ("key1575", self.real_puzzles[1575])])
+
+
     def test_parse_real_index_page(self):
         """
         Check we get expected results from a saved real page.
@@ -0,0 +1,73 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the compact puzzle types and their binary encodings.
+"""
+
+import unittest
+from kakurizer_types import IndexPuzzle, PuzzleGrid, Solution, index_hash
+
+class KakurizerTypesTest(unittest.TestCase):
+    """
+    Unit tests for the kakurizer_types module.
+    """
+
+    grid = PuzzleGrid(3, 3, [1, 2, 2, 2, 0, 0, 2, 0, 0],
+                      [0, 0, 0, 10, 0, 0, 9, 0, 0], [0, 3, 16, 0, 0, 0, 0, 0, 0])
+
+    def test_index_hash(self):
+        """
+        Check the index hash is stable and changes with any field.
+        """
+        puzzle = IndexPuzzle(1583, 1513900898000, "kakuro-1583-medium", "MEDIUM")
+        self.assertEqual(index_hash(puzzle), index_hash(IndexPuzzle(*puzzle)))
+        self.assertEqual(len(index_hash(puzzle)), 16)
+        for field in IndexPuzzle._fields:
+            changed = puzzle._replace(**{field: getattr(puzzle, field) * 2})
+            self.assertNotEqual(index_hash(puzzle), index_hash(changed))
+
+    def test_grid_round_trip(self):
+        """
+        Expect a grid to decode to what was encoded, with one byte per cell per plane.
+        """
+        data = self.grid.encode()
+        self.assertEqual(len(data), 5 + 3 * 9)
+        self.assertEqual(PuzzleGrid.decode(data), self.grid)
+        self.assertEqual(PuzzleGrid.decode(data).across[3], 10)
+
+    def test_grid_wrong_size(self):
+        """
+        Expect an error when planes don't match the grid size.
+        """
+        with self.assertRaises(ValueError):
+            PuzzleGrid(2, 2, [0] * 4, [0] * 4, [0] * 3)
+        with self.assertRaises(ValueError):
+            PuzzleGrid.decode(self.grid.encode()[:-1])
+
+    def test_solution_round_trip(self):
+        """
+        Expect digits to be packed two to a byte, for odd and even numbers of cells.
+        """
+        odd = Solution.from_digits(3, 3, [0, 0, 0, 0, 1, 9, 0, 2, 7])
+        self.assertEqual(odd.packed, bytes([0x00, 0x00, 0x19, 0x02, 0x70]))
+        self.assertEqual(odd.digits, bytes([0, 0, 0, 0, 1, 9, 0, 2, 7]))
+        self.assertEqual(Solution.decode(odd.encode()), odd)
+
+        even = Solution.from_digits(2, 2, bytes([9, 8, 7, 6]))
+        self.assertEqual(even.packed, bytes([0x98, 0x76]))
+        self.assertEqual(Solution.decode(even.encode()).digits, bytes([9, 8, 7, 6]))
+
+    def test_unknown_version(self):
+        """
+        Expect an error when decoding data from another format version, or with no header.
+        """
+        data = bytearray(self.grid.encode())
+        data[0] = 99
+        with self.assertRaises(ValueError):
+            PuzzleGrid.decode(bytes(data))
+        with self.assertRaises(ValueError):
+            Solution.decode(b"")
+
+
+if __name__ == '__main__':
+    unittest.main()
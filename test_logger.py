@@ -0,0 +1,103 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the logger module which sets up queued logging output.
+"""
+
+import io
+import json
+import logging
+import logging.handlers
+import unittest
+from unittest import mock
+import logger
+
+
+class LoggerTest(unittest.TestCase):
+    """
+    Unit tests for the logger module.
+    """
+
+    def setUp(self):
+        self.output = io.StringIO()
+        stdout_patcher = mock.patch("sys.stdout", self.output)
+        stdout_patcher.start()
+        self.addCleanup(stdout_patcher.stop)
+        self.addCleanup(logger.shutdown_logger)
+
+    def lines(self):
+        logger.shutdown_logger()
+        return self.output.getvalue().splitlines()
+
+    def test_setup_idempotent(self):
+        """
+        Check calling setup twice leaves a single handler, so lines aren't repeated.
+        """
+        logger.setup_logger()
+        logger.setup_logger()
+        handlers = [handler for handler in logging.getLogger().handlers
+                    if isinstance(handler, logging.handlers.QueueHandler)]
+        self.assertEqual(len(handlers), 1)
+        logging.getLogger().info("Found %s new puzzles", 3)
+        lines = self.lines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith(" - INFO - Found 3 new puzzles"))
+
+    def test_json_output(self):
+        """
+        Check JSON records include the message and any extra values.
+        """
+        logger.setup_logger(json_output=True)
+        logging.getLogger(logger.PUZZLE_LOGGER).info("Updated puzzle %s", 1583,
+                                                     extra={"puzzle_id": 1583})
+        entry = json.loads(self.lines()[0])
+        self.assertEqual(entry["message"], "Updated puzzle 1583")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], logger.PUZZLE_LOGGER)
+        self.assertEqual(entry["puzzle_id"], 1583)
+
+    def test_json_exception(self):
+        """
+        Check a logged exception's traceback goes in its own field, not the message.
+        """
+        logger.setup_logger(json_output=True)
+        try:
+            raise ValueError("No solution found for puzzle 1583")
+        except ValueError:
+            logging.getLogger().exception("Unable to solve puzzle %s", 1583)
+        entry = json.loads(self.lines()[0])
+        self.assertEqual(entry["message"], "Unable to solve puzzle 1583")
+        self.assertIn("Traceback", entry["exception"])
+        self.assertIn("ValueError: No solution found for puzzle 1583", entry["exception"])
+
+    def test_sample_puzzle_messages(self):
+        """
+        Check only one in every n puzzle messages is kept, along with all warnings.
+        """
+        logger.setup_logger(sample_every=5)
+        puzzle_logger = logging.getLogger(logger.PUZZLE_LOGGER)
+        for puzzle_id in range(20):
+            puzzle_logger.info("Updated puzzle %s", puzzle_id)
+        puzzle_logger.warning("Unable to solve puzzle %s", 99)
+        logging.getLogger().info("Updated 20 puzzles")
+        lines = self.lines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[0].endswith("Updated puzzle 4"))
+        self.assertTrue(lines[4].endswith("Unable to solve puzzle 99"))
+
+    @mock.patch("time.monotonic")
+    def test_rate_limit(self, monotonic_mock):
+        """
+        Check puzzle messages beyond the limit in each second are dropped.
+        """
+        puzzle_filter = logger.PuzzleFilter(max_per_second=2)
+        record = logging.makeLogRecord({"levelno": logging.INFO})
+        monotonic_mock.return_value = 100.2
+        self.assertEqual([puzzle_filter.filter(record) for _ in range(4)],
+                         [True, True, False, False])
+        monotonic_mock.return_value = 101.1
+        self.assertTrue(puzzle_filter.filter(record))
+
+
+if __name__ == '__main__':
+    unittest.main()
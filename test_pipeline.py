@@ -0,0 +1,113 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the pipeline module which chains the pipeline stages in one process.
+"""
+
+import threading
+import unittest
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+import pipeline
+
+
+def make_entity(puzzle_id):
+    entity = Entity()
+    entity['id'] = puzzle_id
+    return entity
+
+
+class PipelineTest(unittest.TestCase):
+    """
+    Unit tests for the pipeline module.
+    """
+
+    def setUp(self):
+        self.entities = [make_entity(puzzle_id) for puzzle_id in range(1, 41)]
+        self.puzzles = [mock.Mock(id=puzzle_id) for puzzle_id in range(1, 41)]
+        self.datastore = mock.Mock()
+        self.datastore.put_index_puzzles.side_effect = lambda puzzles: self.entities[:len(puzzles)]
+        patchers = (
+            mock.patch("index_scanner.get_new_puzzles", return_value=self.puzzles),
+            mock.patch("img_finder.update_puzzle_with_image"),
+            mock.patch("clue_reader.update_puzzles_with_clues", side_effect=lambda _, batch: batch),
+            mock.patch("solver.update_puzzle_with_solution"),
+            mock.patch("check.save_last_seen"),
+        )
+        self.get_new, self.find_image, self.read_clues, self.solve, self.save_last_seen = (
+            patcher.start() for patcher in patchers)
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def solved_ids(self):
+        return sorted(call.args[1]['id'] for call in self.solve.call_args_list)
+
+    def test_run_once(self):
+        """
+        Expect every new puzzle to pass through all stages before run_once returns.
+        """
+        found = pipeline.Pipeline(self.datastore, image_workers=3, queue_size=4).run_once()
+        self.assertEqual(found, 40)
+        self.datastore.put_index_puzzles.assert_called_once_with(self.puzzles)
+        self.assertEqual(self.find_image.call_count, 40)
+        self.assertEqual(self.solved_ids(), list(range(1, 41)))
+        for call in self.read_clues.call_args_list:
+            self.assertLessEqual(len(call.args[1]), pipeline.CLUE_BATCH_SIZE)
+        self.save_last_seen.assert_called_once_with(1)
+
+    def test_failed_stage_drops_puzzle(self):
+        """
+        Expect a puzzle whose image can't be found to go no further, without stopping the others.
+        """
+        def find_image(datastore, entity):
+            if entity['id'] == 7:
+                raise ValueError("No image")
+        self.find_image.side_effect = find_image
+        pipeline.Pipeline(self.datastore).run_once()
+        self.assertEqual(self.solved_ids(), [i for i in range(1, 41) if i != 7])
+
+    def test_unexpected_errors(self):
+        """
+        Expect workers to carry on after errors of any type, so that run_once still returns.
+        """
+        def find_image(datastore, entity):
+            if entity['id'] == 3:
+                raise AttributeError("Unexpected")
+        def read_clues(datastore, batch):
+            if any(entity['id'] == 20 for entity in batch):
+                raise KeyError("grid_data")
+            return batch
+        self.find_image.side_effect = find_image
+        self.read_clues.side_effect = read_clues
+        self.solve.side_effect = RuntimeError("Unexpected")
+        runner = threading.Thread(target=pipeline.Pipeline(self.datastore, queue_size=2).run_once,
+                                  daemon=True)
+        with self.assertLogs(level="ERROR"):
+            runner.start()
+            runner.join(timeout=10)
+        self.assertFalse(runner.is_alive())
+        self.assertEqual(self.find_image.call_count, 40)
+        self.assertGreater(self.solve.call_count, 0)
+        self.assertNotIn(20, self.solved_ids())
+
+    def test_clues_not_read(self):
+        """
+        Expect only puzzles whose clues were read to be solved.
+        """
+        self.read_clues.side_effect = lambda _, batch: [e for e in batch if e['id'] % 2]
+        pipeline.Pipeline(self.datastore, clue_workers=2).run_once()
+        self.assertEqual(self.solved_ids(), list(range(1, 41, 2)))
+
+    def test_run_forever(self):
+        """
+        Expect scans to repeat until interrupted, and queued puzzles to finish afterwards.
+        """
+        self.get_new.side_effect = [self.puzzles, [], KeyboardInterrupt()]
+        with mock.patch("time.sleep") as sleep:
+            pipeline.Pipeline(self.datastore).run_forever(interval=10)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(self.solved_ids(), list(range(1, 41)))
+
+
+if __name__ == '__main__':
+    unittest.main()
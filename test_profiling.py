@@ -0,0 +1,113 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the profiling module which profiles entry point runs.
+"""
+
+import argparse
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import profiling
+
+
+def busy_work():
+    """
+    Allocates and spins for long enough to be sampled.
+    """
+    blocks = [bytearray(1024) for _ in range(100)]
+    end = time.perf_counter() + 0.05
+    while time.perf_counter() < end:
+        sum(range(100))
+    return len(blocks)
+
+
+class ProfilingTest(unittest.TestCase):
+    """
+    Unit tests for the profiling module.
+    """
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = os.path.join(temp_dir.name, "profiles")
+
+    def reports(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_cpu(self):
+        """
+        Check a pstats file naming the profiled function is written with its summary.
+        """
+        self.assertEqual(profiling.profile(busy_work, "cpu", self.directory, 5), 100)
+        reports = self.reports()
+        self.assertEqual([os.path.splitext(name)[1] for name in reports], [".pstats", ".txt"])
+        self.assertTrue(reports[0].startswith("busy_work-"))
+        stats = pstats.Stats(os.path.join(self.directory, reports[0]))
+        self.assertIn("busy_work", {function for _, _, function in stats.stats})
+
+    def test_cpu_threads(self):
+        """
+        Check work done in threads started by the profiled function is included,
+        and that profiling doesn't stop the threads from running.
+        """
+        results = []
+        def run_in_thread():
+            worker = threading.Thread(target=lambda: results.append(busy_work()))
+            worker.start()
+            worker.join()
+        profiling.profile(run_in_thread, "cpu", self.directory)
+        self.assertEqual(results, [100])
+        stats = pstats.Stats(os.path.join(self.directory, self.reports()[0]))
+        self.assertIn("busy_work", {function for _, _, function in stats.stats})
+
+    def test_memory(self):
+        """
+        Check a tracemalloc snapshot is written, with the peak including memory freed since.
+        """
+        profiling.profile(busy_work, "memory", self.directory)
+        reports = self.reports()
+        self.assertEqual([os.path.splitext(name)[1] for name in reports], [".tracemalloc", ".txt"])
+        tracemalloc.Snapshot.load(os.path.join(self.directory, reports[0]))
+        with open(os.path.join(self.directory, reports[1])) as summary:
+            peak = float(summary.readline().split()[-2])
+        self.assertGreater(peak, 100)
+
+    def test_sample(self):
+        """
+        Check folded stacks are written which include the profiled function.
+        """
+        profiling.profile(busy_work, "sample", self.directory)
+        reports = self.reports()
+        self.assertEqual([os.path.splitext(name)[1] for name in reports], [".folded", ".txt"])
+        with open(os.path.join(self.directory, reports[0])) as folded:
+            self.assertIn("busy_work", folded.read())
+
+    def test_reports_written_on_error(self):
+        """
+        Check reports are still written when the profiled function fails.
+        """
+        def failing():
+            raise ValueError("Failed")
+        with self.assertRaises(ValueError):
+            profiling.profile(failing, "cpu", self.directory)
+        self.assertEqual(len(self.reports()), 2)
+
+    def test_run_without_profile(self):
+        """
+        Check the function just runs when no profile mode is chosen.
+        """
+        parser = argparse.ArgumentParser()
+        profiling.add_arguments(parser)
+        self.assertEqual(profiling.run(busy_work, parser.parse_args([])), 100)
+        args = parser.parse_args(["--profile", "sample", "--profile-dir", self.directory])
+        self.assertEqual(profiling.run(busy_work, args), 100)
+        self.assertEqual(len(self.reports()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the puzzle_export module which reads and writes columnar snapshots
+of the kakuro kind.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from google.cloud import datastore
+import puzzle_export
+
+class PuzzleExportTest(unittest.TestCase):
+    """
+    Unit tests for the puzzle_export module.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".kkrx")
+        os.close(handle)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_round_trip(self):
+        """
+        Expect every property, key and index exclusion to survive export and import.
+        """
+        with_img = make_entity(1, has_img=True, img_blob=b"\x89PNG\x00\x01", img_width=36)
+        without_img = make_entity(2, has_img=False)
+        with puzzle_export.ExportWriter(self.path) as writer:
+            writer.write_group([with_img, without_img])
+            writer.write_group([make_entity(3, has_img=True, img_blob=b"GIF89a")])
+
+        groups = list(puzzle_export.read_groups(self.path))
+        self.assertEqual(writer.rows, 3)
+        self.assertEqual([len(group) for group in groups], [2, 1])
+
+        key_id, properties, unindexed = groups[0][0]
+        self.assertEqual(key_id, 10)
+        self.assertEqual(properties, dict(with_img))
+        self.assertEqual(unindexed, ("img_blob",))
+
+        key_id, properties, unindexed = groups[0][1]
+        self.assertEqual(key_id, 20)
+        self.assertEqual(properties, dict(without_img))
+        self.assertNotIn("img_blob", properties)
+        self.assertEqual(unindexed, ())
+
+        self.assertEqual(groups[1][0][1]["img_blob"], b"GIF89a")
+
+    def test_empty_export(self):
+        """
+        Expect an export with no puzzles to read back as no groups.
+        """
+        with puzzle_export.ExportWriter(self.path):
+            pass
+        self.assertEqual(list(puzzle_export.read_groups(self.path)), [])
+
+    def test_not_an_export(self):
+        """
+        Expect an error when reading a file which isn't an export.
+        """
+        with open(self.path, "wb") as other_file:
+            other_file.write(b"<html></html>")
+        with self.assertRaises(ValueError):
+            list(puzzle_export.read_groups(self.path))
+
+    def test_truncated(self):
+        """
+        Expect an error when the terminating header is missing.
+        """
+        with puzzle_export.ExportWriter(self.path) as writer:
+            writer.write_group([make_entity(1, has_img=False)])
+        with open(self.path, "r+b") as export_file:
+            export_file.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ValueError):
+            list(puzzle_export.read_groups(self.path))
+
+    def test_failed_export(self):
+        """
+        Expect an export which fails part way through, or while finishing, to leave
+        no snapshot behind.
+        """
+        with self.assertRaises(RuntimeError):
+            with puzzle_export.ExportWriter(self.path) as writer:
+                writer.write_group([make_entity(1, has_img=False)])
+                raise RuntimeError("Query failed")
+        self.assertFalse(os.path.exists(self.path))
+
+        with self.assertRaises(OSError):
+            with puzzle_export.ExportWriter(self.path) as writer:
+                writer.write_group([make_entity(1, has_img=False)])
+                header_patcher = mock.patch("puzzle_export.GROUP_HEADER")
+                header_patcher.start().pack.side_effect = OSError("No space left on device")
+                self.addCleanup(header_patcher.stop)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unsupported_property(self):
+        """
+        Expect an error rather than a lossy export for unsupported property types.
+        """
+        entity = make_entity(1, has_img=False)
+        entity['grid'] = [[1, 2], [3, 4]]
+        with puzzle_export.ExportWriter(self.path) as writer:
+            with self.assertRaises(ValueError):
+                writer.write_group([entity])
+
+
+def make_entity(puzzle_id, **properties):
+    """
+    Make a puzzle entity with a complete key and the standard index fields.
+    """
+    key = datastore.Key("kakuro", puzzle_id * 10, project="kakurizer")
+    entity = datastore.Entity(key=key)
+    if "img_blob" in properties:
+        entity.exclude_from_indexes.add("img_blob")
+    entity['id'] = puzzle_id
+    entity['timestamp_millis'] = 1513900898000 + puzzle_id
+    entity['difficulty'] = "HARD"
+    entity['page_url'] = "puzzle.html"
+    entity['has_clues'] = False
+    entity['has_solution'] = False
+    entity.update(properties)
+    return entity
+
+
+if __name__ == '__main__':
+    unittest.main()
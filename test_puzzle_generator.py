@@ -0,0 +1,117 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the puzzle_generator module which generates synthetic puzzles.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import analyzer
+import clue_reader
+import grid_detector
+import image_archive
+import puzzle_export
+import puzzle_generator
+from kakurizer_types import CellType, PuzzleGrid, Solution
+from solver import Solver
+
+
+class PuzzleGeneratorTest(unittest.TestCase):
+    """
+    Unit tests for the puzzle_generator module.
+    """
+
+    def setUp(self):
+        cache_patcher = mock.patch("grid_detector.LAYOUT_CACHE", grid_detector.LayoutCache(None))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    def assert_unique(self, grid, solution):
+        self.assertTrue(clue_reader.is_consistent(grid))
+        analysis = analyzer.Analyzer(grid).analyze()
+        self.assertEqual(analysis.solutions, 1)
+        self.assertEqual(Solver(grid).solve(), solution)
+
+    def test_unique_solution(self):
+        """
+        Expect generated puzzles to have exactly the generated solution.
+        """
+        for seed in range(5):
+            grid, solution = puzzle_generator.generate(8, 8, seed=seed)
+            self.assert_unique(grid, solution)
+            self.assertIn(CellType.EMPTY.value, grid.cells)
+
+    def test_size_and_run_length(self):
+        """
+        Expect puzzles of the requested size, with no run longer than allowed.
+        """
+        grid, solution = puzzle_generator.generate(14, 11, density=0.9, seed="wide", max_run=4)
+        self.assertEqual((grid.height, grid.width), (14, 11))
+        self.assert_unique(grid, solution)
+        is_open = bytearray(cell == CellType.EMPTY.value for cell in grid.cells)
+        runs, _ = puzzle_generator.find_runs(is_open, grid.height, grid.width)
+        self.assertTrue(all(2 <= len(run) <= 4 for run in runs))
+
+    def test_seeded(self):
+        """
+        Expect the same seed to give the same puzzle, and invalid sizes to be rejected.
+        """
+        self.assertEqual(puzzle_generator.generate(7, 9, seed=3),
+                         puzzle_generator.generate(7, 9, seed=3))
+        with self.assertRaises(ValueError):
+            puzzle_generator.generate(2, 9)
+        with self.assertRaises(ValueError):
+            puzzle_generator.generate(9, 9, max_run=1)
+
+    def test_render(self):
+        """
+        Expect rendered puzzles to be read back to the same clues at the default
+        size and at larger ones.
+        """
+        grids = [puzzle_generator.generate(seed=seed)[0] for seed in range(6)]
+        images = [puzzle_generator.render(grid) for grid in grids]
+        self.assertEqual(clue_reader.read_clue_grids(images), grids)
+        for cell_size in (48, 56, 72):
+            image = puzzle_generator.render(grids[0], cell_size=cell_size)
+            self.assertEqual(clue_reader.read_clue_grids([image]), grids[:1])
+
+    def test_generate_corpus(self):
+        """
+        Expect a corpus to be written to an image archive and an export which
+        match each other, and to be the same when generated again.
+        """
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        archive_path = os.path.join(temp_dir.name, "images.kkri")
+        export_path = os.path.join(temp_dir.name, "puzzles.kkrx")
+
+        self.assertEqual(puzzle_generator.generate_corpus(
+            6, 6, 7, seed=5, archive_path=archive_path, export_path=export_path,
+            processes=2), 6)
+
+        rows = [row for group in puzzle_export.read_groups(export_path) for row in group]
+        first_id = puzzle_generator.FIRST_ID
+        self.assertEqual(sorted(key_id for key_id, _, _ in rows), list(range(first_id, first_id + 6)))
+        with image_archive.ImageArchive(archive_path) as archive:
+            self.assertEqual(len(archive), 6)
+            for key_id, properties, unindexed in rows:
+                self.assertEqual(archive[key_id], properties['img_blob'])
+                self.assertIn('img_blob', unindexed)
+                self.assertTrue(properties['has_clues'] and properties['has_solution'])
+                self.assertEqual(properties['difficulty'], "EASY")
+                self.assertEqual(properties['timestamp_millis'],
+                                 puzzle_generator.SYNTHETIC_TIMESTAMP)
+                self.assertEqual(properties['page_url'], "synthetic:%d" % key_id)
+        puzzle_id = first_id + 3
+        _, grid_data, solution_data, _ = puzzle_generator.generate_task(
+            (puzzle_id, 6, 7, 0.8, 5, False))
+        properties = next(properties for key_id, properties, _ in rows if key_id == puzzle_id)
+        self.assertEqual(PuzzleGrid.decode(properties['grid_data']), PuzzleGrid.decode(grid_data))
+        self.assertEqual(Solution.decode(properties['solution_data']),
+                         Solution.decode(solution_data))
+
+
+if __name__ == '__main__':
+    unittest.main()
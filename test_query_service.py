@@ -0,0 +1,177 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the query_service module which serves puzzle metadata from memory.
+"""
+
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+import query_service
+
+
+def make_entity(puzzle_id, timestamp_millis, difficulty, has_img=False, has_clues=False,
+                has_solution=False):
+    entity = Entity()
+    entity['id'] = puzzle_id
+    entity['timestamp_millis'] = timestamp_millis
+    entity['difficulty'] = difficulty
+    entity['page_url'] = "https://www.theguardian.com/kakuro-" + str(puzzle_id)
+    entity['has_img'] = has_img
+    entity['has_clues'] = has_clues
+    entity['has_solution'] = has_solution
+    return entity
+
+
+def get_json(service, target, if_none_match=None):
+    status, etag, body = service.handle(target, if_none_match)
+    return status, etag, json.loads(body) if body else None
+
+
+class QueryServiceTest(unittest.TestCase):
+    """
+    Unit tests for the query_service module.
+    """
+
+    def setUp(self):
+        datastore_patcher = mock.patch("datastore_client.DatastoreClient")
+        self.datastore = datastore_patcher.start()
+        self.addCleanup(datastore_patcher.stop)
+        self.datastore.get_metadata_pages.return_value = [
+            [make_entity(1, 1000, "EASY", True, True, True),
+             make_entity(2, 2000, "HARD", True, True),
+             make_entity(3, 3000, "MEDIUM", True)],
+            [make_entity(4, 3000, "EASY"),
+             make_entity(5, 5000, "HARD", True, True, True)]]
+        self.service = query_service.QueryService(self.datastore)
+        self.service.refresh()
+
+    def ids(self, target):
+        status, _, body = get_json(self.service, target)
+        self.assertEqual(status, HTTPStatus.OK)
+        return [puzzle['id'] for puzzle in body['puzzles']], body['next']
+
+    def test_filters(self):
+        """
+        Expect puzzles newest first, filtered by difficulty, timestamp range and flags.
+        """
+        self.assertEqual(self.ids("/puzzles"), ([5, 4, 3, 2, 1], None))
+        self.assertEqual(self.ids("/puzzles?difficulty=easy,hard"), ([5, 4, 2, 1], None))
+        self.assertEqual(self.ids("/puzzles?from=2000&to=3000"), ([4, 3, 2], None))
+        self.assertEqual(self.ids("/puzzles?has_img=true&has_solution=false"), ([3, 2], None))
+        self.assertEqual(self.ids("/puzzles?difficulty=HARD&has_solution=1&to=4999"), ([], None))
+
+    def test_pagination(self):
+        """
+        Expect following the cursor to visit every matching puzzle once.
+        """
+        self.assertEqual(self.ids("/puzzles?limit=2"), ([5, 4], "3000:4"))
+        self.assertEqual(self.ids("/puzzles?limit=2&cursor=3000:4"), ([3, 2], "2000:2"))
+        self.assertEqual(self.ids("/puzzles?limit=2&cursor=2000:2"), ([1], None))
+        self.assertEqual(self.ids("/puzzles?limit=1&has_img=true&cursor=3000:3"), ([2], "2000:2"))
+
+    def test_filter_selectivity(self):
+        """
+        Expect the same pages whichever filter is most selective.
+        """
+        puzzles = {puzzle_id: query_service.metadata(make_entity(
+            puzzle_id, puzzle_id // 3 * 1000, ("EASY", "MEDIUM", "HARD")[puzzle_id % 3],
+            True, puzzle_id % 2 == 0, puzzle_id % 7 == 0)) for puzzle_id in range(1, 201)}
+        index = query_service.PuzzleIndex(puzzles)
+        for difficulties, flags in ((None, {'has_solution': True}), (["HARD"], {}),
+                                    (["EASY", "HARD"], {'has_clues': True}),
+                                    (["MEDIUM"], {'has_img': False}),
+                                    (["HARD"], {'has_clues': False, 'has_solution': True})):
+            expected = [puzzle_id for puzzle_id in range(200, 0, -1)
+                        if (difficulties is None or puzzles[puzzle_id]['difficulty'] in difficulties)
+                        and all(puzzles[puzzle_id][flag] == value for flag, value in flags.items())
+                        and 10000 <= puzzles[puzzle_id]['timestamp_millis'] <= 50000]
+            found, cursor = [], None
+            while True:
+                page, cursor = index.query(difficulties, 10000, 50000, flags, cursor, limit=4)
+                found.extend(puzzle['id'] for puzzle in page)
+                if cursor is None:
+                    break
+            self.assertEqual(found, expected, (difficulties, flags))
+
+    def test_single_puzzle(self):
+        """
+        Expect a puzzle by ID, and 404 for unknown puzzles and paths.
+        """
+        status, _, body = get_json(self.service, "/puzzles/2")
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertEqual(body['difficulty'], "HARD")
+        self.assertEqual(get_json(self.service, "/puzzles/9")[0], HTTPStatus.NOT_FOUND)
+        self.assertEqual(get_json(self.service, "/elsewhere")[0], HTTPStatus.NOT_FOUND)
+
+    def test_bad_request(self):
+        """
+        Expect 400 with an error message for invalid parameters.
+        """
+        for target in ("/puzzles?limit=0", "/puzzles?from=yesterday", "/puzzles?has_img=maybe",
+                       "/puzzles?cursor=5", "/puzzles/five"):
+            status, etag, body = get_json(self.service, target)
+            self.assertEqual(status, HTTPStatus.BAD_REQUEST, target)
+            self.assertIsNone(etag)
+            self.assertIn("error", body)
+
+    def test_not_modified(self):
+        """
+        Expect 304 when the client already has the current response, and a new
+        ETag once the puzzles change.
+        """
+        status, etag, _ = get_json(self.service, "/puzzles?difficulty=HARD")
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertEqual(self.service.handle("/puzzles?difficulty=HARD", etag),
+                         (HTTPStatus.NOT_MODIFIED, etag, b""))
+
+        self.datastore.get_metadata_pages.return_value = [[make_entity(6, 6000, "HARD")]]
+        self.service.refresh()
+        status, new_etag, body = get_json(self.service, "/puzzles?difficulty=HARD", etag)
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(body['puzzles'][0]['id'], 6)
+
+    def test_incremental_refresh(self):
+        """
+        Expect refreshes to load only recent changes, and to keep the snapshot if nothing changed.
+        """
+        self.datastore.get_metadata_pages.assert_called_once_with(updated_since=None)
+        self.datastore.get_metadata_pages.return_value = [[make_entity(3, 3000, "MEDIUM", True, True)]]
+        with mock.patch("time.time", return_value=100.0):
+            self.assertEqual(self.service.refresh(), 1)
+        self.assertEqual(self.service.index.version, 2)
+        self.assertEqual(self.ids("/puzzles?has_clues=true"), ([5, 3, 2, 1], None))
+
+        self.assertEqual(self.service.refresh(), 1)
+        self.datastore.get_metadata_pages.assert_called_with(
+            updated_since=100000 - query_service.REFRESH_OVERLAP)
+        self.assertEqual(self.service.index.version, 2)
+        self.assertEqual(get_json(self.service, "/status")[2], {"puzzles": 5, "version": 2})
+
+    def test_http_round_trip(self):
+        """
+        Expect the HTTP server to pass on bodies, ETags and 304s.
+        """
+        server = query_service.create_server(self.service, port=0)
+        self.addCleanup(server.server_close)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        url = "http://%s:%s/puzzles?limit=1" % server.server_address
+
+        with urllib.request.urlopen(url) as response:
+            etag = response.headers['ETag']
+            self.assertEqual(json.loads(response.read())['next'], "5000:5")
+        request = urllib.request.Request(url, headers={"If-None-Match": etag})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+        self.assertEqual(context.exception.code, HTTPStatus.NOT_MODIFIED)
+
+
+if __name__ == '__main__':
+    unittest.main()
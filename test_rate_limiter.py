@@ -0,0 +1,99 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the rate_limiter module which shares request budgets between processes.
+"""
+
+import email.utils
+import tempfile
+import unittest
+from unittest import mock
+import requests_mock
+import rate_limiter
+
+HOST = "www.theguardian.com"
+URL = "https://www.theguardian.com/lifeandstyle/series/kakuro?page=1"
+
+
+class RateLimiterTest(unittest.TestCase):
+    """
+    Unit tests for the rate_limiter module.
+    """
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.state_dir = temp_dir.name
+        self.limiter = rate_limiter.RateLimiter(self.state_dir, {HOST: 2.0})
+        time_patcher = mock.patch("time.time", return_value=1000.0)
+        self.time = time_patcher.start()
+        self.addCleanup(time_patcher.stop)
+
+    def test_burst_then_spaced(self):
+        """
+        Check a full bucket allows a burst, after which requests are spaced by the rate.
+        """
+        delays = [self.limiter.reserve(HOST) for _ in range(rate_limiter.BURST + 2)]
+        self.assertEqual(delays, [0.0] * rate_limiter.BURST + [0.5, 1.0])
+        self.time.return_value = 1001.0
+        self.assertEqual(self.limiter.reserve(HOST), 0.5)
+
+    def test_shared_between_limiters(self):
+        """
+        Check limiters using the same state directory draw from the same bucket.
+        """
+        other = rate_limiter.RateLimiter(self.state_dir, {HOST: 2.0})
+        for _ in range(rate_limiter.BURST):
+            self.limiter.reserve(HOST)
+        self.assertEqual(other.reserve(HOST), 0.5)
+        self.assertEqual(rate_limiter.RateLimiter(self.state_dir).reserve("i.guim.co.uk"), 0.0)
+
+    def test_throttled(self):
+        """
+        Check throttling halves the rate and pauses the host, and successes recover the rate.
+        """
+        self.limiter.throttled(HOST, 30)
+        self.assertEqual(self.limiter.reserve(HOST), 30.0)
+        self.assertEqual(self.limiter.reserve(HOST), 31.0)
+        for _ in range(30):
+            self.limiter.succeeded(HOST)
+        self.time.return_value = 1100.0
+        for _ in range(rate_limiter.BURST):
+            self.limiter.reserve(HOST)
+        self.assertEqual(self.limiter.reserve(HOST), 0.5)
+
+    @requests_mock.mock()
+    @mock.patch("time.sleep")
+    def test_get_retries_throttled(self, request_mock, sleep_mock):
+        """
+        Check a throttled request is retried after the time the host asked for.
+        """
+        request_mock.get(URL, [{"status_code": 429, "headers": {"Retry-After": "12"}},
+                               {"status_code": 200, "text": "index"}])
+        response = self.limiter.get(URL)
+        self.assertEqual(response.text, "index")
+        self.assertEqual(request_mock.call_count, 2)
+        sleep_mock.assert_called_once_with(12.0)
+
+    @requests_mock.mock()
+    @mock.patch("time.sleep")
+    def test_get_gives_up(self, request_mock, sleep_mock):
+        """
+        Check the throttled response is returned once every attempt has been throttled.
+        """
+        request_mock.get(URL, status_code=503)
+        self.assertEqual(self.limiter.get(URL).status_code, 503)
+        self.assertEqual(request_mock.call_count, rate_limiter.MAX_ATTEMPTS)
+
+    def test_parse_retry_after(self):
+        """
+        Check Retry-After is understood as either seconds or an HTTP date.
+        """
+        self.assertEqual(rate_limiter.parse_retry_after("120"), 120.0)
+        self.assertEqual(rate_limiter.parse_retry_after(email.utils.formatdate(1090.0)), 90.0)
+        self.assertIsNone(rate_limiter.parse_retry_after("soon"))
+        self.assertIsNone(rate_limiter.parse_retry_after(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the solver module which solves kakuro puzzles from their clues.
+"""
+
+import unittest
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+import clue_reader
+import solver
+from kakurizer_types import CellType, PuzzleGrid
+
+EMPTY = CellType.EMPTY.value
+BLOCKED = CellType.BLOCKED.value
+CLUE = CellType.CLUE.value
+
+class SolverTest(unittest.TestCase):
+    """
+    Unit tests for the solver module.
+    """
+
+    small_grid = PuzzleGrid(3, 3,
+                          [BLOCKED, CLUE, CLUE, CLUE, EMPTY, EMPTY, CLUE, EMPTY, EMPTY],
+                          [0, 0, 0, 10, 0, 0, 9, 0, 0],
+                          [0, 3, 16, 0, 0, 0, 0, 0, 0])
+
+    large_grid = PuzzleGrid(8, 8,
+                          [1, 2, 2, 2, 2, 2, 2, 1, 2, 0, 0, 0, 0, 0, 0, 1,
+                           2, 0, 0, 0, 0, 0, 0, 1, 2, 0, 0, 0, 2, 0, 0, 1,
+                           1, 2, 2, 0, 0, 0, 0, 2, 2, 0, 0, 0, 0, 0, 0, 0,
+                           2, 0, 0, 0, 0, 0, 0, 0, 1, 2, 0, 0, 0, 0, 1, 1],
+                          [0, 0, 0, 0, 0, 0, 0, 0, 29, 0, 0, 0, 0, 0, 0, 0,
+                           26, 0, 0, 0, 0, 0, 0, 0, 12, 0, 0, 0, 5, 0, 0, 0,
+                           0, 0, 23, 0, 0, 0, 0, 0, 38, 0, 0, 0, 0, 0, 0, 0,
+                           42, 0, 0, 0, 0, 0, 0, 0, 0, 25, 0, 0, 0, 0, 0, 0],
+                          [0, 16, 11, 39, 14, 37, 27, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                           0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 25, 0, 0, 0,
+                           0, 10, 13, 0, 0, 0, 0, 8, 0, 0, 0, 0, 0, 0, 0, 0,
+                           0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+
+    def test_combinations(self):
+        """
+        Expect the table to hold every set of distinct digits for a sum and length.
+        """
+        self.assertEqual(solver.COMBINATIONS[(3, 2)], (0b110,))
+        self.assertEqual(solver.COMBINATIONS[(45, 9)], (solver.ALL_DIGITS,))
+        self.assertEqual(len(solver.COMBINATIONS[(10, 2)]), 4)
+        self.assertNotIn((2, 2), solver.COMBINATIONS)
+
+    def test_solve_small(self):
+        """
+        Expect the unique solution of a small puzzle.
+        """
+        solution = solver.Solver(self.small_grid).solve()
+        self.assertEqual(solution.digits, bytes([0, 0, 0, 0, 1, 9, 0, 2, 7]))
+
+    def test_solve_large(self):
+        """
+        Expect every run of a larger puzzle to add up with distinct digits.
+        """
+        solution = solver.Solver(self.large_grid).solve().digits
+        for total, cells in solver.find_runs(self.large_grid):
+            digits = [solution[cell] for cell in cells]
+            self.assertEqual(sum(digits), total)
+            self.assertEqual(len(set(digits)), len(digits))
+            self.assertNotIn(0, digits)
+        filled = [index for index, cell in enumerate(self.large_grid.cells) if cell == EMPTY]
+        self.assertEqual([index for index, digit in enumerate(solution) if digit], filled)
+
+    def test_no_solution(self):
+        """
+        Expect no solution when the clues contradict each other.
+        """
+        grid = PuzzleGrid(3, 3, self.small_grid.cells,
+                          self.small_grid.across, [0, 3, 17, 0, 0, 0, 0, 0, 0])
+        self.assertIsNone(solver.Solver(grid).solve())
+
+    def test_impossible_clue(self):
+        """
+        Expect an error for a sum which no run of that length can make.
+        """
+        grid = PuzzleGrid(3, 3, self.small_grid.cells,
+                          [0, 0, 0, 18, 0, 0, 9, 0, 0], self.small_grid.down)
+        with self.assertRaises(ValueError):
+            solver.Solver(grid)
+
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_update_puzzle(self, datastore_mock):
+        """
+        Expect the solution to be saved on the entity.
+        """
+        entity = Entity()
+        entity['id'] = 1
+        clue_reader.set_clue_grid(entity, self.small_grid)
+
+        solver.update_puzzle_with_solution(datastore_mock, entity)
+
+        result = datastore_mock.update.call_args_list[0][0][0]
+        self.assertTrue(result['has_solution'])
+        self.assertEqual(solver.get_solution(result).digits, bytes([0, 0, 0, 0, 1, 9, 0, 2, 7]))
+        self.assertIn('solution_data', result.exclude_from_indexes)
+
+    @mock.patch("logger.setup_logger")
+    @mock.patch("solver.DatastoreClient")
+    def test_solve_skips_invalid(self, datastore_mock, _):
+        """
+        Expect puzzles with impossible clues or no solution to be skipped, and the
+        rest to be solved.
+        """
+        entities = []
+        for key_id, down in enumerate(([0, 3, 16, 0, 0, 0, 0, 0, 0], [0, 3, 17, 0, 0, 0, 0, 0, 0],
+                                       [0, 3, 18, 0, 0, 0, 0, 0, 0])):
+            entity = Entity()
+            entity['id'] = key_id
+            clue_reader.set_clue_grid(entity, PuzzleGrid(3, 3, self.small_grid.cells,
+                                                         self.small_grid.across, down))
+            entities.append(entity)
+        datastore = datastore_mock.return_value
+        datastore.get_pages_with_clues.return_value = [entities[2:], entities[:2]]
+
+        solver.solve()
+
+        self.assertEqual([call[0][0]['id'] for call in datastore.update.call_args_list], [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/local/bin/python3
+
+"""
+Tests for the transcoder module which re-encodes stored images as compact PNGs.
+"""
+
+import hashlib
+import unittest
+from io import BytesIO
+from unittest import mock
+from google.cloud.datastore.entity import Entity
+from PIL import Image
+import clue_reader
+import grid_detector
+import transcoder
+from kakurizer_types import CellType, PuzzleGrid
+from puzzle_generator import render as render_grid
+from test_batch_solver import InlinePool
+
+EMPTY = CellType.EMPTY.value
+BLOCKED = CellType.BLOCKED.value
+CLUE = CellType.CLUE.value
+
+
+def encode(image, image_format="PNG", **params):
+    output = BytesIO()
+    image.save(output, image_format, **params)
+    return output.getvalue()
+
+
+def decode(image_bytes):
+    return Image.open(BytesIO(image_bytes))
+
+
+class TranscoderTest(unittest.TestCase):
+    """
+    Unit tests for the transcoder module.
+    """
+
+    def setUp(self):
+        cache_patcher = mock.patch("grid_detector.LAYOUT_CACHE", grid_detector.LayoutCache(None))
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+
+    grid = PuzzleGrid(3, 3,
+                      [BLOCKED, CLUE, CLUE, CLUE, EMPTY, EMPTY, CLUE, EMPTY, EMPTY],
+                      [0, 0, 0, 10, 0, 0, 9, 0, 0],
+                      [0, 3, 16, 0, 0, 0, 0, 0, 0])
+
+    def test_lossless_greyscale(self):
+        """
+        Expect an RGB image with few greys to become a small palette PNG with the same pixels.
+        """
+        original = decode(render_grid(self.grid)).convert("RGB")
+        original_bytes = encode(original)
+        result = transcoder.transcode(original_bytes)
+        self.assertLess(len(result), len(original_bytes))
+        self.assertEqual(decode(result).mode, "P")
+        self.assertEqual(decode(result).convert("L").tobytes(), original.convert("L").tobytes())
+        self.assertEqual(clue_reader.read_clue_grids([result]), [self.grid])
+
+    def test_lossless_colour(self):
+        """
+        Expect colour to be kept when the channels differ.
+        """
+        original = Image.new("RGB", (20, 10), (200, 30, 30))
+        result = decode(transcoder.transcode(encode(original)))
+        self.assertEqual(result.convert("RGB").tobytes(), original.tobytes())
+
+    def test_palette_reduction(self):
+        """
+        Expect a noisy JPEG reduced to a few greys to be smaller and still readable.
+        """
+        jpeg = encode(decode(render_grid(self.grid)), "JPEG", quality=90)
+        _, result, checksum = transcoder.transcode_task((0, jpeg, 4))
+        self.assertLess(len(result), len(jpeg))
+        self.assertLessEqual(len(decode(result).convert("L").getcolors()), 4)
+        self.assertEqual(checksum, hashlib.sha256(jpeg).hexdigest())
+        self.assertEqual(clue_reader.read_clue_grids([result]), [self.grid])
+
+    def test_unparseable(self):
+        """
+        Expect unparseable images to be left alone.
+        """
+        with self.assertRaises(ValueError):
+            transcoder.transcode(b"not an image")
+        self.assertIsNone(transcoder.transcode_task((3, b"not an image", None))[1])
+
+    def test_palette_bits(self):
+        """
+        Expect the smallest PNG palette depth which fits the colours.
+        """
+        self.assertEqual([transcoder.palette_bits(colours) for colours in (1, 2, 3, 16, 17)],
+                         [1, 1, 2, 4, 8])
+
+    @mock.patch("datastore_client.DatastoreClient")
+    def test_transcode_page(self, datastore_mock):
+        """
+        Expect every image to be saved with the original's checksum, whether or not it shrank.
+        """
+        original_bytes = encode(decode(render_grid(self.grid)).convert("RGB"))
+        shrinks = Entity()
+        shrinks['id'] = 1
+        shrinks['img_blob'] = original_bytes
+        shrinks['img_format'] = "PNG"
+        broken = Entity()
+        broken['id'] = 2
+        broken['img_blob'] = b"not an image"
+        broken['img_format'] = "GIF"
+        done = Entity()
+        done['id'] = 3
+        done['img_blob'] = b"not an image"
+        transcoder.set_transcoded(done, None, hashlib.sha256(b"not an image").hexdigest())
+
+        before, after = transcoder.transcode_page(datastore_mock, InlinePool(),
+                                                  [shrinks, broken, done], None, 1)
+
+        datastore_mock.update_multi.assert_called_once_with([shrinks, broken])
+        self.assertEqual(before, len(original_bytes) + 24)
+        self.assertEqual(after, len(shrinks['img_blob']) + 24)
+        self.assertLess(after, before)
+        self.assertEqual(shrinks['img_original_sha256'], hashlib.sha256(original_bytes).hexdigest())
+        self.assertEqual(shrinks['img_original_bytes'], len(original_bytes))
+        self.assertEqual(shrinks['transcode_version'], transcoder.TRANSCODE_VERSION)
+        self.assertEqual(broken['img_blob'], b"not an image")
+        self.assertEqual(broken['img_original_format'], "GIF")
+
+    @mock.patch("logger.setup_logger")
+    @mock.patch("multiprocessing.Pool")
+    @mock.patch("transcoder.DatastoreClient")
+    def test_run(self, datastore_mock, pool_mock, _):
+        """
+        Expect only puzzles not yet transcoded at the current version to be loaded.
+        """
+        pool_mock.return_value.__enter__.return_value = InlinePool()
+        datastore = datastore_mock.return_value
+        entity = Entity()
+        entity['id'] = 1
+        entity['img_blob'] = encode(decode(render_grid(self.grid)).convert("RGB"))
+        datastore.get_untranscoded_pages.return_value = [[entity]]
+
+        before, after = transcoder.run(processes=1)
+
+        datastore.get_untranscoded_pages.assert_called_once_with(transcoder.TRANSCODE_VERSION)
+        datastore.update_multi.assert_called_once_with([entity])
+        self.assertLess(after, before)
+
+
+if __name__ == '__main__':
+    unittest.main()
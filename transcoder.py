@@ -0,0 +1,200 @@
+#!/usr/local/bin/python3
+
+"""
+Re-encodes stored puzzle images as compact PNGs to cut the size of every read and
+write that carries an image.
+
+Puzzles are black and white line art, so an image whose colour channels are all
+equal is stored as greyscale, and with only a handful of grey levels it fits a
+palette of 1, 2 or 4 bits per pixel. This is lossless. Optionally the greys can
+also be reduced to a fixed number of levels, which is lossy but keeps lines and
+digits readable. A new image is only kept if it is smaller than the original,
+and a SHA-256 checksum and the size and format of the original are recorded
+either way.
+"""
+
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+from io import BytesIO
+from PIL import Image
+import logger
+from datastore_client import DatastoreClient
+
+TRANSCODE_VERSION = 1
+CHUNK_SIZE = 8 # Images sent to a worker at a time
+
+
+def run(processes=None, palette_size=None, chunk_size=CHUNK_SIZE):
+    """
+    Transcodes every stored image which hasn't been transcoded at the current
+    version and saves the results.
+
+    :param processes: Number of worker processes, defaulting to one per CPU
+    :param palette_size: If set, reduce images to this many grey levels
+    :param chunk_size: Number of images sent to a worker at a time
+    :returns: Tuple of (total bytes before, total bytes after) for the images transcoded
+    """
+    logger.setup_logger()
+    datastore = DatastoreClient()
+    totals = [0, 0]
+    with multiprocessing.Pool(processes or os.cpu_count()) as pool:
+        for page in datastore.get_untranscoded_pages(TRANSCODE_VERSION):
+            before, after = transcode_page(datastore, pool, page, palette_size, chunk_size)
+            totals[0] += before
+            totals[1] += after
+    logging.getLogger().info("Transcoded images from %s to %s bytes", totals[0], totals[1])
+    return tuple(totals)
+
+
+def transcode_page(datastore, pool, entities, palette_size, chunk_size):
+    """
+    Transcodes a page of images in the pool and saves the puzzles which changed.
+
+    :param datastore: datastore_client.DatastoreClient for accessing Google Cloud Datastore
+    :param pool: multiprocessing.Pool of workers
+    :param entities: List of database entries with images
+    :param palette_size: If set, reduce images to this many grey levels
+    :param chunk_size: Number of images sent to a worker at a time
+    :returns: Tuple of (bytes before, bytes after) for the page
+    """
+    tasks = [(index, entity['img_blob'], palette_size) for index, entity in enumerate(entities)]
+    before = after = 0
+    changed = []
+    for index, blob, checksum in pool.imap_unordered(transcode_task, tasks, chunk_size):
+        entity = entities[index]
+        before += len(entity['img_blob'])
+        if blob is None:
+            logging.getLogger(logger.PUZZLE_LOGGER).info(
+                "Kept original image for puzzle %s", entity['id'], extra={"puzzle_id": entity['id']})
+        if set_transcoded(entity, blob, checksum):
+            changed.append(entity)
+        after += len(entity['img_blob'])
+    if changed:
+        datastore.update_multi(changed)
+    return before, after
+
+
+def transcode_task(task):
+    """
+    Transcodes one image in a worker process.
+
+    :param task: Tuple of (index, image bytes, palette size or None)
+    :returns: Tuple of (index, smaller PNG bytes or None if no smaller image was made,
+              hex SHA-256 of the original bytes)
+    """
+    index, image_bytes, palette_size = task
+    checksum = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        blob = transcode(image_bytes, palette_size)
+    except ValueError:
+        return index, None, checksum
+    return index, blob if len(blob) < len(image_bytes) else None, checksum
+
+
+def set_transcoded(entity, blob, checksum):
+    """
+    Records the original image's checksum, size and format on a puzzle entity, and
+    replaces its image if a smaller one was made. Entities which already have a
+    checksum keep it, so it always describes the image first fetched.
+
+    :param entity: database entry representing a puzzle with an image
+    :param blob: PNG bytes of the new image, or None to keep the current one
+    :param checksum: Hex SHA-256 of the current image bytes
+    :returns: True if anything on the entity changed, so that it needs saving
+    """
+    changed = entity.get('transcode_version') != TRANSCODE_VERSION
+    if 'img_original_sha256' not in entity:
+        entity['img_original_sha256'] = checksum
+        entity['img_original_bytes'] = len(entity['img_blob'])
+        entity['img_original_format'] = entity.get('img_format')
+        changed = True
+    if blob is not None and blob != entity['img_blob']:
+        entity['img_blob'] = blob
+        entity['img_format'] = "PNG"
+        changed = True
+    entity['transcode_version'] = TRANSCODE_VERSION
+    return changed
+
+
+def transcode(image_bytes, palette_size=None):
+    """
+    :param image_bytes: raw bytes making up the image
+    :param palette_size: If set, reduce the image to this many evenly spaced grey levels
+    :returns: bytes of the image as an optimized PNG
+    :raises ValueError: if image bytes are unparseable
+    """
+    try:
+        image = Image.open(BytesIO(image_bytes))
+        image.load()
+    except OSError:
+        raise ValueError("Cannot parse puzzle image")
+
+    grey = as_greyscale(image)
+    if grey is None and palette_size:
+        grey = image.convert("L")
+    output = BytesIO()
+    if grey is None:
+        image.save(output, "PNG", optimize=True)
+        return output.getvalue()
+
+    if palette_size:
+        levels = [round(255 * level / (palette_size - 1)) for level in range(palette_size)]
+        lookup = [min(range(palette_size), key=lambda level: abs(levels[level] - value))
+                  for value in range(256)]
+    else:
+        levels = [value for _, value in sorted(grey.getcolors(256), key=lambda pair: pair[1])]
+        lookup = [0] * 256
+        for level, value in enumerate(levels):
+            lookup[value] = level
+    indexed = Image.frombytes("P", grey.size, grey.point(lookup).tobytes())
+    indexed.putpalette([channel for value in levels for channel in (value, value, value)])
+    indexed.save(output, "PNG", optimize=True, bits=palette_bits(len(levels)))
+    return output.getvalue()
+
+
+def as_greyscale(image):
+    """
+    :param image: PIL.Image.Image of any mode
+    :returns: The image in mode L if that loses nothing, otherwise None
+    """
+    if image.mode in ("1", "L"):
+        return image.convert("L")
+    rgba = image.convert("RGBA")
+    red, green, blue, alpha = rgba.split()
+    if alpha.getextrema() != (255, 255):
+        return None
+    if not red.tobytes() == green.tobytes() == blue.tobytes():
+        return None
+    return red
+
+
+def palette_bits(colours):
+    """
+    :param colours: Number of palette entries needed
+    :returns: Smallest PNG palette bit depth with room for them
+    """
+    for bits in (1, 2, 4):
+        if colours <= 1 << bits:
+            return bits
+    return 8
+
+
+def main():
+    """
+    Command line entry point to transcode all stored images.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, help="Worker processes, default one per CPU")
+    parser.add_argument("--palette", type=int,
+                        help="Reduce images to this many grey levels (lossy), e.g. 16")
+    args = parser.parse_args()
+    if args.palette is not None and not 2 <= args.palette <= 256:
+        parser.error("--palette must be between 2 and 256")
+    run(args.processes, args.palette)
+
+
+if __name__ == "__main__":
+    main()